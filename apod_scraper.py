@@ -1,29 +1,26 @@
-from utils import save_image_data, HEADERS
-import time
-import requests
-from bs4 import BeautifulSoup
+from utils import ImageRecord, http_get, absolute_url
+from sources import register_source, run_source
+from http_cache import cached_get
+from catalog import get_catalog
+from checkpoint import (
+    CrawlProgress, load_checkpoint, save_checkpoint, clear_checkpoint, load_known_items, save_known_items,
+)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html_parser import make_soup
+import metrics
 import re
 import datetime
 import os
 
-def scrape_apod_images(days_to_scrape=7, force_redownload=False, recreate_overlays=False):
-    """
-    Scrape NASA's Astronomy Picture of the Day
-    
-    Args:
-        days_to_scrape: Number of recent days to scrape (default: 7)
-        force_redownload: Whether to re-download existing images
-        recreate_overlays: Whether to only recreate overlay images
-    """
-    if recreate_overlays:
-        print("APOD: Recreate overlays mode - skipping image scraping")
-        return
-        
-    print("Scraping NASA Astronomy Picture of the Day...")
-    
-    BASE_URL = "https://apod.nasa.gov/apod/"
-    CURRENT_URL = f"{BASE_URL}astropix.html"
-    
+BASE_URL = "https://apod.nasa.gov/apod/"
+CURRENT_URL = f"{BASE_URL}astropix.html"
+ARCHIVE_URL = f"{BASE_URL}archivepix.html"
+FIRST_APOD_DATE = "1995-06-16"
+OUTDIR = "apod_images"
+BULK_WORKERS = 4  # day pages fetched at once in bulk mode (http_get still paces each host)
+
+def apod_urls(days_to_scrape=7):
+    """Build the APOD page URLs for today and the days before it"""
     # Create a list to store the URLs we need to scrape
     # Start with today's APOD
     urls_to_scrape = [CURRENT_URL]
@@ -39,132 +36,293 @@ def scrape_apod_images(days_to_scrape=7, force_redownload=False, recreate_overla
             # Format: apYYMMDD.html
             archive_url = f"{BASE_URL}ap{past_date.strftime('%y%m%d')}.html"
             urls_to_scrape.append(archive_url)
+    return urls_to_scrape
+
+def apod_date(url):
+    """Return the YYYY-MM-DD date an APOD page URL stands for"""
+    date_match = re.search(r"ap(\d{6})\.html", url)
+    if date_match:
+        return datetime.datetime.strptime(date_match.group(1), "%y%m%d").date().isoformat()
+    return datetime.date.today().isoformat()  # astropix.html is today's picture
+
+def parse_apod_archive(soup):
+    """
+    Extract every day listed on the APOD archive index
+
+    Returns:
+        List of (YYYY-MM-DD date, title, day page URL) tuples, newest first
+    """
+    entries = []
+    for a_tag in soup.find_all("a", href=re.compile(r"^ap\d{6}\.html$")):
+        url = BASE_URL + a_tag["href"]
+        entries.append((apod_date(url), a_tag.get_text().strip(), url))
+    return entries
+
+def catalogued_apod_dates():
+    """Return the dates whose APOD image is already in the catalog"""
+    dates = set()
+    for title in get_catalog().titles("NASA_APOD"):
+        date_match = re.match(r"APOD (\d{4}-\d{2}-\d{2}) - ", title)
+        if date_match:
+            dates.add(date_match.group(1))
+    return dates
+
+def parse_apod_page(soup, url):
+    """
+    Extract the title, image URL and description from an APOD day page
+
+    Returns:
+        Tuple of (unique title, image URL, description), or None if the day has no image
+    """
+    # Extract the date from the URL
+    date_match = re.search(r"ap(\d{6})\.html", url)
+    date_str = "Today" if url == CURRENT_URL else (apod_date(url) if date_match else "Unknown Date")
     
-    # Process each URL
-    downloaded_count = 0
+    # Find the title - usually the first center tag with b tag inside
+    title_tag = soup.select_one("center b")
+    title = title_tag.text.strip() if title_tag else "Astronomy Picture of the Day"
+    
+    # Find the image - it's usually the first img tag after the title
+    # or within the first few elements
+    img_tag = None
+    
+    # First try to find it after the title tag's parent
+    if title_tag:
+        center_tag = title_tag.parent
+        if center_tag:
+            # Try the next centers
+            next_center = center_tag.find_next("center")
+            if next_center:
+                img_tag = next_center.find("img")
+    
+    # If we didn't find it, look more broadly
+    if not img_tag:
+        img_tags = soup.find_all("img")
+        # Most likely the first or second img tag
+        img_tag = img_tags[0] if img_tags else None
+    
+    # Get the image URL
+    if img_tag and img_tag.get("src"):
+        # Make sure it's an absolute URL
+        img_url = absolute_url(img_tag.get("src"), BASE_URL)
+    else:
+        # If no image found, skip this day
+        print(f"No image found for {date_str}")
+        return None
+    
+    # Find the explanation - usually in a tag following "Explanation:" text
+    # First look for the explanation heading
+    explanation_text = None
+    
+    # Try to find the explanation text
+    # Look for b tag with "Explanation:" text
+    exp_heading = soup.find("b", string=re.compile(r"Explanation:"))
+    
+    if exp_heading:
+        # The explanation often follows this heading in the same parent element
+        parent = exp_heading.parent
+        if parent:
+            # The explanation text might be directly in the parent or in sibling elements
+            explanation_text = parent.get_text().replace("Explanation:", "", 1).strip()
+    
+    # If we didn't find it with the above approach, try another method
+    if not explanation_text:
+        # Try finding a paragraph with substantial text
+        paragraphs = soup.find_all("p")
+        for p in paragraphs:
+            p_text = p.get_text().strip()
+            # A real explanation will be substantial text
+            if len(p_text) > 100:
+                explanation_text = p_text
+                break
+    
+    # If still not found, look for any substantial text block
+    if not explanation_text:
+        # Last resort - get text from the body and do some cleanup
+        body_text = soup.body.get_text() if soup.body else ""
+        # Try to extract the main text content
+        lines = [line.strip() for line in body_text.split("\n") if line.strip()]
+        for line in lines:
+            if len(line) > 100 and "Explanation:" not in line:
+                explanation_text = line
+                break
+    
+    if not explanation_text:
+        explanation_text = "No explanation available."
+    
+    # Find the credit - usually after the explanation
+    credit_text = ""
+    credit_tag = soup.find(string=re.compile(r"Credit:"))
+    if credit_tag:
+        # Try to get the full credit line
+        credit_parent = credit_tag.parent
+        if credit_parent:
+            credit_text = credit_parent.get_text().strip()
+        else:
+            credit_text = credit_tag.strip()
+    
+    # Combine description with credit
+    description = f"Date: {date_str}\n\n{explanation_text}"
+    if credit_text:
+        description += f"\n\nCredit: {credit_text}"
+    
+    # Get a unique title with date to avoid overwrites between days
+    unique_title = f"APOD {date_str} - {title}"
+    return unique_title, img_url, description
+
+
+def apod_range_records(start=None, end=None, force_redownload=False, backend="sync", workers=BULK_WORKERS):
+    """
+    Yield APOD images for a date range using the archive index
+
+    The index is read once to learn which dates exist, dates already in the
+    catalog (or known to have no image, e.g. video days) are skipped, and the
+    remaining day pages are fetched concurrently.
+
+    Args:
+        start: First date, YYYY-MM-DD (default: the first APOD)
+        end: Last date, YYYY-MM-DD (default: today)
+        force_redownload: Fetch every date in the range again
+        backend: "sync" uses a thread pool, "async" the aiohttp engine
+        workers: Number of day pages fetched at the same time (sync backend)
+    """
+    start = start or FIRST_APOD_DATE
+    end = end or datetime.date.today().isoformat()
+    print(f"Scraping NASA Astronomy Picture of the Day archive from {start} to {end}...")
+
+    response = cached_get(ARCHIVE_URL)
+    soup = make_soup(response.content)
+    # ISO dates compare correctly as strings
+    days = [entry for entry in parse_apod_archive(soup) if start <= entry[0] <= end]
+
+    no_image_dates = load_known_items("apod")
+    skip_dates = set() if force_redownload else catalogued_apod_dates() | no_image_dates
+    urls = [url for date, title, url in days if date not in skip_dates]
+    print(f"APOD: {len(days)} days in range, {len(days) - len(urls)} already ingested, fetching {len(urls)}")
+
+    if backend == "async":
+        from async_engine import iter_async_records, scrape_apod_async
+        try:
+            yield from iter_async_records(scrape_apod_async, no_image_dates, None, urls)
+        finally:
+            save_known_items("apod", no_image_dates)
+        return
+
+    agency = metrics.current_agency()  # pool threads don't inherit the runner's label
+
+    def fetch_day(url):
+        with metrics.agency(agency):
+            response = http_get(url)
+        if response.status_code != 200:
+            print(f"Failed to access {url}: {response.status_code}")
+            return None
+        parsed = parse_apod_page(make_soup(response.content), url)
+        if parsed is None:
+            no_image_dates.add(apod_date(url))
+        return parsed
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {executor.submit(fetch_day, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                parsed = future.result()
+            except Exception as e:
+                print(f"Error processing APOD for {futures[future]}: {e}")
+                continue
+            if parsed is None:
+                continue
+            unique_title, img_url, description = parsed
+            print(f"Processing APOD image: {unique_title}")
+            yield ImageRecord("NASA_APOD", unique_title, img_url, description, OUTDIR)
+    finally:
+        # Don't fetch the rest of the range if the runner stopped early
+        executor.shutdown(cancel_futures=True)
+        save_known_items("apod", no_image_dates)
+
+    print("APOD scraping complete")
+
+@register_source("APOD", OUTDIR, hosts={"apod.nasa.gov": (0.2, 8.0)})
+def apod_records(apod_days=7, force_redownload=False, backend="sync", resume=False,
+                 apod_start=None, apod_end=None, **options):
+    """
+    Yield NASA's Astronomy Picture of the Day images
     
+    Args:
+        apod_days: Number of recent days to scrape (default: 7)
+        force_redownload: Whether to re-download existing images
+        backend: "sync" fetches one day at a time, "async" fetches all days concurrently
+        resume: Skip the dates an interrupted earlier run already processed
+        apod_start: First date (YYYY-MM-DD) of a bulk range; with apod_end, replaces apod_days
+        apod_end: Last date (YYYY-MM-DD) of a bulk range
+    """
+    if apod_start or apod_end:
+        # Already catalogued dates are skipped, so a bulk run resumes by itself
+        yield from apod_range_records(apod_start, apod_end, force_redownload, backend)
+        return
+
+    if backend == "async":
+        if resume:
+            print("APOD: --resume is only supported by the sync backend, starting from the beginning")
+        from async_engine import iter_async_records, scrape_apod_async
+        no_image_dates = load_known_items("apod")
+        try:
+            yield from iter_async_records(scrape_apod_async, no_image_dates, apod_days)
+        finally:
+            save_known_items("apod", no_image_dates)
+        return
+        
+    print("Scraping NASA Astronomy Picture of the Day...")
+    
+    urls_to_scrape = apod_urls(apod_days)
+    
+    # Dates handled so far are checkpointed whenever a day is done, i.e. its
+    # image has been saved (or found missing)
+    state = load_checkpoint("apod") if resume else None
+
+    def checkpoint(progress):
+        save_checkpoint("apod", {"processed_dates": sorted(progress.finished)})
+    progress = CrawlProgress(state["processed_dates"] if state else (), on_change=checkpoint)
+    if progress.finished:
+        print(f"APOD: resuming, {len(progress.finished)} dates already processed")
+    
+    # Process each URL
     for url in urls_to_scrape:
+        if apod_date(url) in progress.finished:
+            continue
         try:
             print(f"Fetching APOD from {url}")
-            response = requests.get(url, headers=HEADERS)
+            response = http_get(url)
             
             if response.status_code != 200:
                 print(f"Failed to access {url}: {response.status_code}")
                 continue
             
-            soup = BeautifulSoup(response.content, "html.parser")
-            
-            # Extract the date from the URL
-            date_match = re.search(r"ap(\d{6})\.html", url)
-            date_str = "Today" if url == CURRENT_URL else (
-                f"20{date_match.group(1)[:2]}-{date_match.group(1)[2:4]}-{date_match.group(1)[4:]}" 
-                if date_match else "Unknown Date"
-            )
-            
-            # Find the title - usually the first center tag with b tag inside
-            title_tag = soup.select_one("center b")
-            title = title_tag.text.strip() if title_tag else "Astronomy Picture of the Day"
-            
-            # Find the image - it's usually the first img tag after the title
-            # or within the first few elements
-            img_tag = None
-            
-            # First try to find it after the title tag's parent
-            if title_tag:
-                center_tag = title_tag.parent
-                if center_tag:
-                    # Try the next centers
-                    next_center = center_tag.find_next("center")
-                    if next_center:
-                        img_tag = next_center.find("img")
-            
-            # If we didn't find it, look more broadly
-            if not img_tag:
-                img_tags = soup.find_all("img")
-                # Most likely the first or second img tag
-                img_tag = img_tags[0] if img_tags else None
-            
-            # Get the image URL
-            if img_tag and img_tag.get("src"):
-                img_url = img_tag.get("src")
-                # Make sure it's an absolute URL
-                if not img_url.startswith("http"):
-                    img_url = BASE_URL + img_url
-            else:
-                # If no image found, skip this day
-                print(f"No image found for {date_str}")
-                continue
-            
-            # Find the explanation - usually in a tag following "Explanation:" text
-            # First look for the explanation heading
-            explanation_text = None
-            
-            # Try to find the explanation text
-            # Look for b tag with "Explanation:" text
-            exp_heading = soup.find("b", string=re.compile(r"Explanation:"))
-            
-            if exp_heading:
-                # The explanation often follows this heading in the same parent element
-                parent = exp_heading.parent
-                if parent:
-                    # The explanation text might be directly in the parent or in sibling elements
-                    explanation_text = parent.get_text().replace("Explanation:", "", 1).strip()
-            
-            # If we didn't find it with the above approach, try another method
-            if not explanation_text:
-                # Try finding a paragraph with substantial text
-                paragraphs = soup.find_all("p")
-                for p in paragraphs:
-                    p_text = p.get_text().strip()
-                    # A real explanation will be substantial text
-                    if len(p_text) > 100:
-                        explanation_text = p_text
-                        break
-            
-            # If still not found, look for any substantial text block
-            if not explanation_text:
-                # Last resort - get text from the body and do some cleanup
-                body_text = soup.body.get_text() if soup.body else ""
-                # Try to extract the main text content
-                lines = [line.strip() for line in body_text.split("\n") if line.strip()]
-                for line in lines:
-                    if len(line) > 100 and "Explanation:" not in line:
-                        explanation_text = line
-                        break
-            
-            if not explanation_text:
-                explanation_text = "No explanation available."
-            
-            # Find the credit - usually after the explanation
-            credit_text = ""
-            credit_tag = soup.find(string=re.compile(r"Credit:"))
-            if credit_tag:
-                # Try to get the full credit line
-                credit_parent = credit_tag.parent
-                if credit_parent:
-                    credit_text = credit_parent.get_text().strip()
-                else:
-                    credit_text = credit_tag.strip()
-            
-            # Combine description with credit
-            description = f"Date: {date_str}\n\n{explanation_text}"
-            if credit_text:
-                description += f"\n\nCredit: {credit_text}"
-            
-            # Get a unique title with date to avoid overwrites between days
-            unique_title = f"APOD {date_str} - {title}"
-            
-            # Save the image
-            print(f"Processing APOD image: {unique_title}")
-            if save_image_data("NASA_APOD", unique_title, img_url, description, "apod_images", force_redownload, recreate_overlays):
-                downloaded_count += 1
-                
-            # Be nice to the server
-            time.sleep(1)
+            soup = make_soup(response.content)
             
+            parsed = parse_apod_page(soup, url)
         except Exception as e:
             print(f"Error processing APOD for {url}: {e}")
             continue
+
+        if parsed is None:
+            progress.complete(apod_date(url))
+            continue
+        unique_title, img_url, description = parsed
+        
+        # Save the image
+        print(f"Processing APOD image: {unique_title}")
+        yield ImageRecord("NASA_APOD", unique_title, img_url, description, OUTDIR, progress.track(apod_date(url)))
     
-    print(f"APOD scraping complete - downloaded {downloaded_count} images")
-    return downloaded_count > 0 
\ No newline at end of file
+    progress.wait()
+    clear_checkpoint("apod")
+    print("APOD scraping complete")
+
+def scrape_apod_images(days_to_scrape=7, force_redownload=False, recreate_overlays=False, backend="sync", resume=False,
+                       start=None, end=None):
+    """Scrape APOD on its own through the shared source runner (see apod_records)"""
+    if recreate_overlays:
+        print("APOD: Recreate overlays mode - skipping image scraping")
+        return
+    return run_source("APOD", apod_days=days_to_scrape, force_redownload=force_redownload, backend=backend,
+                      resume=resume, apod_start=start, apod_end=end)
@@ -0,0 +1,294 @@
+"""
+Asyncio scraping backend
+
+Runs the ESA pagination loop, the JAXA category crawl and the APOD date range
+with many requests in flight. Parsing is shared with the synchronous scrapers;
+only the fetching differs. Instead of sleeping the whole process between
+requests, each host gets its own async rate limiter, so waiting on one host
+never holds up another.
+
+The async scrapes only find images: iter_async_records runs one on an event
+loop of its own and yields the records it emits, so they reach the source
+runner like those of the sync scrapers (same limits, duplicate checks,
+metrics labels and completion callbacks).
+
+Requires aiohttp (pip install "happiness-in-space[async]").
+"""
+import asyncio
+import threading
+from urllib.parse import urlsplit
+from html_parser import make_soup
+import utils
+from utils import HEADERS, ImageRecord
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency
+    aiohttp = None
+
+ASYNC_CONCURRENCY = 16     # requests in flight overall
+ASYNC_PER_HOST = 4         # requests in flight per host
+ASYNC_RATE = 2.0           # request starts per second per host
+ASYNC_RETRIES = 3
+ASYNC_QUEUE_SIZE = 32      # records found but not yet taken by the runner
+
+def configure_async(concurrency=None, per_host=None, rate=None):
+    """Change the async backend settings for the next run"""
+    global ASYNC_CONCURRENCY, ASYNC_PER_HOST, ASYNC_RATE
+    if concurrency is not None:
+        ASYNC_CONCURRENCY = concurrency
+    if per_host is not None:
+        ASYNC_PER_HOST = per_host
+    if rate is not None:
+        ASYNC_RATE = rate
+
+class AsyncRateLimiter:
+    """Spaces out request starts to one host without blocking other hosts"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class AsyncFetcher:
+    """aiohttp session with per-host rate limiting and retries on 429/5xx"""
+
+    def __init__(self, concurrency=None, per_host=None, rate=None):
+        self.concurrency = concurrency or ASYNC_CONCURRENCY
+        self.per_host = per_host or ASYNC_PER_HOST
+        self.rate = rate or ASYNC_RATE
+        self._limiters = {}
+        self.session = None
+
+    async def __aenter__(self):
+        if aiohttp is None:
+            raise RuntimeError('The async backend needs aiohttp: pip install "happiness-in-space[async]"')
+        connect_timeout, read_timeout = utils.HTTP_TIMEOUT
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = AsyncRateLimiter(self.rate)
+        return self._limiters[host]
+
+    async def get(self, url):
+        """
+        Fetch a URL
+
+        Returns:
+            Tuple of (status code, body bytes)
+        """
+        for attempt in range(ASYNC_RETRIES + 1):
+            await self._limiter(url).wait()
+            async with self.session.get(url) as response:
+                body = await response.read()
+                if response.status in (429, 500, 502, 503, 504) and attempt < ASYNC_RETRIES:
+                    retry_after = response.headers.get("Retry-After", "")
+                    await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt)
+                    continue
+                return response.status, body
+
+    async def get_soup(self, url, keep=None):
+        status, body = await self.get(url)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status} for {url}")
+        return make_soup(body, keep)
+
+def iter_async_records(scrape, *args):
+    """
+    Run an async scrape on a thread of its own and yield the records it finds
+
+    The scrape is called as scrape(emit, *args) and awaits emit(record) for
+    every image; emit waits while the runner is behind. Closing the generator
+    (the runner stopped early) cancels the scrape. An exception raised by the
+    scrape is raised here once the records before it have been yielded.
+    """
+    loop = asyncio.new_event_loop()
+    records = asyncio.Queue(ASYNC_QUEUE_SIZE)
+    finished = object()
+    errors = []
+
+    async def main():
+        try:
+            await scrape(records.put, *args)
+        except Exception as e:
+            errors.append(e)
+        await records.put(finished)
+        # Keep the loop running until the runner has taken every record
+        await asyncio.Event().wait()
+
+    task = loop.create_task(main())
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, name="async-scrape", daemon=True)
+    thread.start()
+    try:
+        while True:
+            record = asyncio.run_coroutine_threadsafe(records.get(), loop).result()
+            if record is finished:
+                break
+            yield record
+        if errors:
+            raise errors[0]
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
+
+async def scrape_esa_async(emit, known_links, progress, incremental=False, stop_after=2):
+    """
+    Emit the images of the ESA archive
+
+    Args:
+        known_links: Detail pages ingested before; pages without an image are added
+        progress: CrawlProgress tracking the records (see esa_records)
+    """
+    from esa_scraper import (
+        START_URL, OUTDIR, keep_esa_listing, keep_esa_detail, parse_esa_listing, parse_esa_detail,
+    )
+
+    print("Scraping ESA (async)...")
+    seen_links = set()
+    detail_tasks = []
+    known_pages = 0
+
+    async with AsyncFetcher() as fetcher:
+        async def process_detail(full_url):
+            try:
+                parsed = parse_esa_detail(await fetcher.get_soup(full_url, keep_esa_detail))
+                if parsed is None:
+                    known_links.add(full_url)  # no image on this page, nothing to retry
+                    return
+                title, desc, img_url = parsed
+                await emit(ImageRecord("ESA", title, img_url, desc, OUTDIR, progress.track(full_url)))
+            except Exception as e:
+                print(f"ESA error: {e}")
+
+        # Listing pages must be walked in order, but the detail pages of one
+        # page are fetched while the next listing page is already loading
+        current_url = START_URL
+        while current_url:
+            soup = await fetcher.get_soup(current_url, keep_esa_listing)
+            detail_urls, current_url = parse_esa_listing(soup)
+            if incremental:
+                detail_urls = [url for url in detail_urls if url not in known_links]
+                known_pages = 0 if detail_urls else known_pages + 1
+                if known_pages >= stop_after:
+                    print(f"ESA: {known_pages} listing pages without new images, stopping incremental crawl")
+                    break
+            for full_url in detail_urls:
+                if full_url in seen_links:
+                    continue
+                seen_links.add(full_url)
+                detail_tasks.append(asyncio.create_task(process_detail(full_url)))
+
+        await asyncio.gather(*detail_tasks)
+
+async def scrape_jaxa_async(emit):
+    """Emit the images of the JAXA Digital Archives; the runner applies MAX_IMAGES"""
+    from jaxa_scraper import (
+        ARCHIVE_URL, OUTDIR, keep_jaxa_detail, parse_jaxa_landing, parse_jaxa_category, parse_jaxa_detail,
+    )
+
+    print("Scraping JAXA Digital Archives (async)...")
+    found_count = 0
+
+    async with AsyncFetcher() as fetcher:
+        async def save(title, img_url, desc):
+            nonlocal found_count
+            found_count += 1
+            print(f"Processing JAXA image: {title}")
+            await emit(ImageRecord("JAXA", title, img_url, desc, OUTDIR))
+
+        async def process_item(item):
+            img_url = item['url']
+            if item['detail_url']:
+                try:
+                    status, body = await fetcher.get(item['detail_url'])
+                    if status == 200:
+                        img_url = parse_jaxa_detail(make_soup(body, keep_jaxa_detail)) or img_url
+                except Exception as e:
+                    print(f"Error following detail link: {e}")
+            await save(item['title'] or f"JAXA Space Image {found_count + 1}", img_url, item['desc'])
+
+        async def process_category(idx, category_url):
+            try:
+                print(f"Accessing category/gallery page: {category_url}")
+                status, body = await fetcher.get(category_url)
+                if status != 200:
+                    print(f"Failed to access category page: {status}")
+                    return
+                items = parse_jaxa_category(make_soup(body))
+                await asyncio.gather(*(process_item(item) for item in items))
+            except Exception as e:
+                print(f"Error accessing category {idx+1}: {e}")
+
+        try:
+            soup = await fetcher.get_soup(ARCHIVE_URL)
+            categories, main_page_images = parse_jaxa_landing(soup)
+            for img_data in main_page_images:
+                await save(img_data['title'], img_data['url'], img_data['desc'])
+            await asyncio.gather(*(process_category(idx, url) for idx, url in enumerate(categories)))
+        except Exception as e:
+            print(f"Error accessing JAXA Digital Archives: {e}")
+
+    print(f"JAXA scraping complete - found {found_count} images")
+
+async def scrape_apod_async(emit, no_image_dates, days_to_scrape=7, urls=None):
+    """
+    Emit APOD images for recent days, or for the given day page URLs
+
+    Args:
+        no_image_dates: Dates known to have no image; days without one are added
+    """
+    from apod_scraper import OUTDIR, apod_urls, apod_date, parse_apod_page
+
+    print("Scraping NASA Astronomy Picture of the Day (async)...")
+    found_count = 0
+    if urls is None:
+        urls = apod_urls(days_to_scrape)
+
+    async with AsyncFetcher() as fetcher:
+        async def process_day(url):
+            nonlocal found_count
+            try:
+                status, body = await fetcher.get(url)
+                if status != 200:
+                    print(f"Failed to access {url}: {status}")
+                    return
+                parsed = parse_apod_page(make_soup(body), url)
+                if parsed is None:
+                    no_image_dates.add(apod_date(url))
+                    return
+                unique_title, img_url, description = parsed
+                print(f"Processing APOD image: {unique_title}")
+                found_count += 1
+                await emit(ImageRecord("NASA_APOD", unique_title, img_url, description, OUTDIR))
+            except Exception as e:
+                print(f"Error processing APOD for {url}: {e}")
+
+        await asyncio.gather(*(process_day(url) for url in urls))
+
+    print(f"APOD scraping complete - found {found_count} images")
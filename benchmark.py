@@ -0,0 +1,676 @@
+"""
+Offline benchmark for the scrapers and the overlay path
+
+Every scraper stage runs the real source generator, HTTP client, HTML
+parsers, download pipeline and catalog, but all requests are answered by a
+stub HTTP server on localhost that replays a fixture set: recorded HTML and
+JSON responses plus synthetic JPEGs for every image URL. The overlay stages
+render synthetic images of several sizes through
+create_image_with_text_overlay and regenerate_all_overlays. The startup
+stages time how long download_all.py takes to start (--help, and
+--recreate-overlays on an empty directory) and list the heavy libraries each
+command imported, which should stay empty for --help.
+
+Each stage runs in a fresh process and a fresh temporary working directory
+(removed when the stage ends), so module caches, the catalog and peak RSS
+never carry over between stages, and the real ./data and image directories
+are never touched.
+
+Usage:
+    python benchmark.py run                      # synthetic fixtures, all stages
+    python benchmark.py run --fixtures DIR       # replay a recorded fixture set
+    python benchmark.py record --fixtures DIR    # record fixtures (needs network)
+    python benchmark.py fixtures DIR             # write the synthetic fixture set
+    python benchmark.py compare OLD.json NEW.json
+
+A fixture set is a directory of response bodies and an index.json mapping
+each URL to its body and content type, plus the run options (e.g.
+the APOD date range) the recorded pages belong to.
+"""
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import random
+import hashlib
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import multiprocessing
+from itertools import islice
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
+from utils import TimedHTTPAdapter
+
+SCRAPER_STAGES = ["ESA", "NASA", "JAXA", "APOD", "CNSA"]
+OVERLAY_SIZES = [(800, 600), (1920, 1080), (4000, 3000)]  # also the sizes of the served images
+OVERLAY_RENDERS = 20         # renders per image size in the overlay stages
+REGENERATE_IMAGES = 60       # originals in the regenerate_all_overlays stage
+RECORD_IMAGES = 10           # records taken from each source when recording
+RESULTS_DIR = "benchmark_results"
+STARTUP_RUNS = 10            # runs of each command in the startup stages
+# Startup stage -> interpreter arguments; the bare interpreter is the baseline
+STARTUP_COMMANDS = {
+    "startup_python": ["-c", "pass"],
+    "startup_help": ["download_all.py", "--help"],
+    "startup_recreate": ["download_all.py", "--recreate-overlays", "--only", "esa", "--no-metrics-summary"],
+}
+# Libraries that should only be imported by the modes that use them
+HEAVY_MODULES = ("requests", "urllib3", "bs4", "lxml", "PIL", "aiohttp", "numpy")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".tif", ".tiff")
+WORDS = ("galaxy nebula star cluster telescope image shows bright region of dust and gas "
+         "spacecraft orbit Earth Moon Mars Jupiter comet asteroid light years across "
+         "infrared observations (NGC 1300) reveal 12.5 km/s Explanation: Credit:").split()
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+def latency_summary(seconds):
+    """p50/p95 of a list of durations, in milliseconds"""
+    p50, p95 = percentile(seconds, 50), percentile(seconds, 95)
+    return {
+        "count": len(seconds),
+        "p50": round(p50 * 1000, 2) if p50 is not None else None,
+        "p95": round(p95 * 1000, 2) if p95 is not None else None,
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children, or None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def random_description(rng, words=120):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def synthetic_image(width, height, seed=0, quality=90):
+    """A JPEG with smooth gradients and some noise, so it compresses like a photo"""
+    from PIL import Image, ImageChops
+    base = Image.radial_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    channels = [base, Image.linear_gradient("L").resize((width, height)), ImageChops.add(base, noise, 2)]
+    buffer = io.BytesIO()
+    Image.merge("RGB", channels).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+# Fixture sets
+
+def _page(body, title="Page"):
+    # Navigation and footer around the content, as real pages have; the
+    # parsers have to get through it either way
+    nav = "".join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(120))
+    scripts = "".join(f"<script>var config{i} = {{'id': {i}}};</script>" for i in range(20))
+    return (f"<!DOCTYPE html><html><head><title>{title}</title>{scripts}</head>"
+            f"<body><nav><ul>{nav}</ul></nav>{body}<footer><ul>{nav}</ul></footer></body></html>")
+
+def synthetic_fixtures(scale=1, seed=1):
+    """
+    Build a fixture set in the shape of each agency's site
+
+    Args:
+        scale: Multiplies the number of pages and items per agency
+        seed: Seed for the generated text
+
+    Returns:
+        Tuple of (responses, options): {url: (content type, body bytes)} and
+        the run options the pages belong to
+    """
+    import esa_scraper, nasa_scraper, jaxa_scraper, apod_scraper, cnsa_scraper
+    rng = random.Random(seed)
+    html, js = "text/html; charset=utf-8", "application/json"
+    responses = {}
+
+    def add(url, content_type, body):
+        responses[url] = (content_type, body.encode("utf-8") if isinstance(body, str) else body)
+
+    # ESA: paginated listing, one detail page per item
+    esa_pages, esa_items = 4 * scale, 10
+    for page in range(1, esa_pages + 1):
+        url = esa_scraper.START_URL if page == 1 else f"{esa_scraper.START_URL}?page={page}"
+        items = []
+        for i in range(esa_items):
+            path = f"/ESA_Multimedia/Images/bench/Image_{page}_{i}"
+            items.append(f'<div class="feature-item"><a class="cta popup" href="{path}">Image {page}.{i}</a></div>')
+            add(esa_scraper.BASE_URL + path, html, _page(
+                f"<h1>ESA image {page}.{i}</h1>"
+                f'<div class="modal__tab-description"><p>{random_description(rng)}</p></div>'
+                f'<meta property="og:image" content="https://www.esa.int/var/esa/storage/images/bench/{page}_{i}.jpg">'))
+        if page < esa_pages:
+            items.append(f'<a class="next" rel="next" href="{urlsplit(esa_scraper.START_URL).path}?page={page + 1}">Next</a>')
+        add(url, html, _page("".join(items)))
+
+    # NASA: one search page; half the items only link a thumbnail and need their asset manifest
+    nasa_items = []
+    for i in range(50 * scale):
+        nasa_id = f"BENCH{i:05d}"
+        asset = f"https://images-assets.nasa.gov/image/{nasa_id}/{nasa_id}"
+        manifest = f"https://images-assets.nasa.gov/image/{nasa_id}/collection.json"
+        rendition = "~large" if i % 2 else "~thumb"
+        nasa_items.append({
+            "href": manifest,
+            "data": [{"nasa_id": nasa_id, "title": f"NASA image {i}", "description": random_description(rng, 60),
+                      "keywords": ["bench"]}],
+            "links": [{"href": f"{asset}{rendition}.jpg", "rel": "preview", "render": "image"}],
+        })
+        add(manifest, js, json.dumps([f"{asset}~orig.jpg", f"{asset}~large.jpg", f"{asset}~thumb.jpg",
+                                      f"https://images-assets.nasa.gov/image/{nasa_id}/metadata.json"]))
+    add(nasa_scraper.API_URL, js, json.dumps({"collection": {"items": nasa_items, "links": []}}))
+
+    # JAXA: landing page with categories, galleries linking detail pages
+    categories = []
+    for c in range(3 * scale):
+        category_url = f"{jaxa_scraper.JAXA_ROOT}category.php?lang=e&cat={c}"
+        categories.append(f'<div class="category"><a href="category.php?lang=e&amp;cat={c}">Category {c}</a></div>')
+        figures = []
+        for i in range(8):
+            image_id = f"{c}_{i}"
+            figures.append(f'<figure><a href="detail.php?id={image_id}"><img src="thumb/{image_id}.jpg" alt="JAXA image {image_id}"></a>'
+                           f'<p class="description">{random_description(rng, 40)}</p></figure>')
+            add(f"{jaxa_scraper.JAXA_ROOT}detail.php?id={image_id}", html,
+                _page(f'<div class="full-image"><img src="/image/{image_id}.jpg"></div>'))
+        add(category_url, html, _page("".join(figures)))
+    add(jaxa_scraper.ARCHIVE_URL, html, _page('<img src="/img/logo.png">' + "".join(categories)))
+
+    # APOD: archive index and one page per day
+    end = datetime.date(2024, 1, 1)
+    days = [end - datetime.timedelta(days=n) for n in range(30 * scale)]
+    links = []
+    for day in days:
+        name = f"ap{day.strftime('%y%m%d')}.html"
+        links.append(f'{day.isoformat()}:  <a href="{name}">Picture {day.isoformat()}</a><br>')
+        add(apod_scraper.BASE_URL + name, html,
+            f"<html><body><center><h1>Astronomy Picture of the Day</h1></center>"
+            f"<center><b> Picture {day.isoformat()} </b><br><b>Image Credit:</b> Bench</center>"
+            f'<center><p><a href="image/{day:%y%m}/bench_{day:%d}.jpg"><img src="image/{day:%y%m}/bench_{day:%d}_1024.jpg"></a></p></center>'
+            f"<p><b> Explanation: </b> {random_description(rng, 150)} </p></body></html>")
+    add(apod_scraper.ARCHIVE_URL, html, "<html><body><b>" + "\n".join(links) + "</b></body></html>")
+
+    # CNSA: home page linking articles, each with a couple of images
+    articles = []
+    for i in range(10 * scale):
+        articles.append(f'<a href="n6465/c{i}/content.html">Article {i}</a>')
+        add(f"{cnsa_scraper.BASE_URL}/n6465/c{i}/content.html", html, _page(
+            f'<div class="title">CNSA article {i}</div><div class="TRS_Editor"><p>{random_description(rng)}</p>'
+            f'<img src="W0{i}a.jpg"><img src="W0{i}b.jpg"></div>'))
+    add(cnsa_scraper.START_URL, html, _page('<div class="new">' + "".join(articles) + "</div>"))
+
+    options = {"apod_start": days[-1].isoformat(), "apod_end": days[0].isoformat()}
+    return responses, options
+
+def write_fixtures(directory, responses, options, origin):
+    """Write a fixture set: one file per body plus index.json"""
+    os.makedirs(directory, exist_ok=True)
+    index = {"origin": origin, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+             "options": options, "responses": {}}
+    for key, (content_type, body) in responses.items():
+        ext = ".json" if "json" in content_type else ".html"
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:20] + ext
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(body)
+        index["responses"][key] = {"file": name, "content_type": content_type}
+    with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+def load_fixtures(directory):
+    """
+    Read a fixture set written by write_fixtures
+
+    Returns:
+        Tuple of (responses, options, origin)
+    """
+    with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    responses = {}
+    for key, entry in index["responses"].items():
+        with open(os.path.join(directory, entry["file"]), "rb") as f:
+            responses[key] = (entry["content_type"], f.read())
+    return responses, index.get("options", {}), index.get("origin", "recorded")
+
+# Stub server
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers /<scheme>/<host><path>?<query> with the fixture for that URL
+
+    Any other URL ending in an image extension gets one of the synthetic
+    JPEGs, picked by a hash of the URL; everything else is a 404.
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real hosts
+
+    def do_GET(self):
+        scheme, _, rest = self.path.lstrip("/").partition("/")
+        url = f"{scheme}://{rest}"
+        server = self.server
+        found = server.responses.get(url) or server.responses.get(url.split("?")[0])
+        if found is None and urlsplit(url).path.lower().endswith(IMAGE_EXTENSIONS):
+            found = ("image/jpeg", server.images[zlib.crc32(url.encode("utf-8")) % len(server.images)])
+        if found is None:
+            self.send_error(404)
+            return
+        content_type, body = found
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(responses, images):
+    """Serve a fixture set on a free localhost port; returns the server (call shutdown() when done)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.responses = responses
+    server.images = images
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+class ReplayAdapter(TimedHTTPAdapter):
+    """
+    Sends every request to the stub server instead of the real host
+
+    The request still goes through the shared session's connection pool and
+    retry settings; only its destination changes. Each request's latency,
+    size and kind (page or image) are kept in self.requests.
+    """
+
+    def __init__(self, stub_url, **kwargs):
+        super().__init__(**kwargs)
+        self.stub_url = stub_url
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        original_url = request.url
+        parts = urlsplit(original_url)
+        request.url = f"{self.stub_url}/{parts.scheme}/{parts.netloc}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        response.url = request.url = original_url
+        kind = "image" if response.headers.get("Content-Type", "").startswith("image/") else "page"
+        self.requests.append((kind, time.perf_counter() - started, int(response.headers.get("Content-Length") or 0)))
+        return response
+
+class RecordingAdapter(HTTPAdapter):
+    """Keeps the body of every page and API response that passes through (images are not kept)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = {}
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code == 200 and not content_type.startswith("image/"):
+            self.responses[request.url] = (content_type, response.content)
+        return response
+
+def _mount(adapter):
+    """Route the shared session of utils through an adapter"""
+    from utils import get_session
+    session = get_session()
+    current = session.get_adapter("https://")
+    adapter.max_retries = current.max_retries
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return adapter
+
+# Stages (each runs in its own process)
+
+@contextlib.contextmanager
+def _stage_environment(name, verbose):
+    """
+    Run in a fresh temporary working directory with the stage's output silenced
+
+    The directory (images, overlays, catalog) is removed and the previous
+    working directory restored when the stage ends.
+    """
+    previous = os.getcwd()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name.lower()}_") as workdir:
+        os.chdir(workdir)
+        try:
+            with output:
+                yield workdir
+        finally:
+            os.chdir(previous)
+
+def stage_scraper(name, stub_url, options, download_workers=4, verbose=False):
+    """Run one source against the stub server, end to end, and measure it"""
+    with _stage_environment(name, verbose):
+        from sources import load_sources, run_sources
+        from rate_limit import configure_rate_limits
+        from pipeline import ImagePipeline
+        from utils import setup_catalog
+
+        load_sources()
+        # The stub answers at once; pacing would only measure the limiter's sleeps
+        configure_rate_limits(enabled=False)
+        adapter = _mount(ReplayAdapter(stub_url, pool_maxsize=16))
+        catalog = setup_catalog()
+
+        started = time.perf_counter()
+        if download_workers > 0:
+            with ImagePipeline(download_workers, 2, 32):
+                run_sources([name], options)
+        else:
+            run_sources([name], options)
+        catalog.flush()
+        elapsed = time.perf_counter() - started
+        # The catalog lives in the stage's directory, which is removed on exit
+        saved = sum(catalog.count_by_source().values())
+
+    pages = [seconds for kind, seconds, _ in adapter.requests if kind == "page"]
+    images = [seconds for kind, seconds, _ in adapter.requests if kind == "image"]
+    return {
+        "stage": name,
+        "seconds": round(elapsed, 3),
+        "pages": len(pages),
+        "images": saved,
+        "bytes": sum(size for _, _, size in adapter.requests),
+        "pages_per_s": round(len(pages) / elapsed, 2),
+        "images_per_s": round(saved / elapsed, 2),
+        "latency_ms": {"pages": latency_summary(pages), "images": latency_summary(images)},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def stage_overlay(size, renders=OVERLAY_RENDERS, verbose=False):
+    """Render overlays onto one image size with create_image_with_text_overlay"""
+    name = f"overlay_{size[0]}x{size[1]}"
+    with _stage_environment(name, verbose) as workdir:
+        from utils import create_image_with_text_overlay
+        rng = random.Random(size[0])
+        path = os.path.join(workdir, "original.jpg")
+        with open(path, "wb") as f:
+            f.write(synthetic_image(*size))
+        timings = []
+        started = time.perf_counter()
+        for _ in range(renders):
+            description = random_description(rng, rng.randint(20, 300))
+            render_started = time.perf_counter()
+            create_image_with_text_overlay(path, description).save(os.path.join(workdir, "original_overlay.jpg"))
+            timings.append(time.perf_counter() - render_started)
+        elapsed = time.perf_counter() - started
+    return {
+        "stage": name,
+        "seconds": round(elapsed, 3),
+        "images": renders,
+        "images_per_s": round(renders / elapsed, 2),
+        "latency_ms": {"images": latency_summary(timings)},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def stage_regenerate(count=REGENERATE_IMAGES, jobs=1, verbose=False):
+    """Regenerate every overlay of a directory of originals with regenerate_all_overlays"""
+    with _stage_environment("regenerate", verbose) as workdir:
+        from utils import regenerate_all_overlays
+        rng = random.Random(count)
+        directory = os.path.join(workdir, "images")
+        os.makedirs(directory)
+        images = [synthetic_image(*size) for size in OVERLAY_SIZES]
+        for i in range(count):
+            with open(os.path.join(directory, f"image_{i}.jpg"), "wb") as f:
+                f.write(images[i % len(images)])
+            with open(os.path.join(directory, f"image_{i}.txt"), "w", encoding="utf-8") as f:
+                f.write(random_description(rng, rng.randint(20, 300)))
+        started = time.perf_counter()
+        regenerated = regenerate_all_overlays(directory, jobs=jobs, force=True)
+        elapsed = time.perf_counter() - started
+
+        # Per-image timings are not observable from outside the workers, but
+        # with one job the overlays are written one after another, so the
+        # gaps between their modification times are the per-image latencies
+        timings = []
+        if jobs == 1:
+            finished = sorted(os.stat(os.path.join(directory, name)).st_mtime_ns
+                              for name in os.listdir(directory) if "_overlay" in name)
+            timings = [(b - a) / 1e9 for a, b in zip(finished, finished[1:])]
+    return {
+        "stage": "regenerate",
+        "seconds": round(elapsed, 3),
+        "images": regenerated,
+        "jobs": jobs,
+        "images_per_s": round(regenerated / elapsed, 2),
+        "latency_ms": {"images": latency_summary(timings)},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def stage_startup(name, runs=STARTUP_RUNS):
+    """Time a download_all.py command from process start to exit, in a fresh Python each run"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    arguments = [os.path.join(script_dir, arg) if arg == "download_all.py" else arg
+                 for arg in STARTUP_COMMANDS[name]]
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+        def run(*options):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, *options, *arguments], cwd=workdir,
+                                       capture_output=True, text=True)
+            return time.perf_counter() - started, completed
+
+        run()  # warm the OS file cache and the bytecode caches
+        timings = [run()[0] for _ in range(runs)]
+        # One more run reports every import; only top-level packages are kept
+        _, completed = run("-X", "importtime")
+    imported = set()
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            imported.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return {
+        "stage": name,
+        "seconds": round(sum(timings), 3),
+        "runs": runs,
+        "latency_ms": {"startup": latency_summary(timings)},
+        "heavy_modules": sorted(imported & set(HEAVY_MODULES)),
+        "returncode": completed.returncode,
+    }
+
+def _in_subprocess(function, *args, **kwargs):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args, **kwargs).result()
+
+# Commands
+
+def _environment():
+    import PIL
+    from html_parser import HTML_PARSER
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "html_parser": HTML_PARSER,
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+def print_stage(result):
+    latency = result.get("latency_ms", {})
+    parts = [f"{result['stage']:<20} {result['seconds']:8.2f}s"]
+    if "pages_per_s" in result:
+        parts.append(f"{result['pages_per_s']:8.1f} pages/s")
+    if "images_per_s" in result:
+        parts.append(f"{result['images_per_s']:8.1f} images/s")
+    for kind, summary in latency.items():
+        if summary.get("p50") is not None:
+            parts.append(f"{kind} p50 {summary['p50']:.1f}ms p95 {summary['p95']:.1f}ms")
+    if result.get("peak_rss_mb") is not None:
+        parts.append(f"RSS {result['peak_rss_mb']:.0f}MB")
+    if "heavy_modules" in result:
+        parts.append(f"imports {', '.join(result['heavy_modules']) or 'none of ' + '/'.join(HEAVY_MODULES)}")
+    if result.get("returncode"):
+        parts.append(f"exit status {result['returncode']}")
+    print("  ".join(parts))
+
+def run_benchmark(args):
+    if args.fixtures:
+        responses, fixture_options, origin = load_fixtures(args.fixtures)
+    else:
+        responses, fixture_options = synthetic_fixtures(args.scale)
+        origin = "synthetic"
+    stages = [s.strip() for s in args.stages.split(",")] if args.stages else SCRAPER_STAGES + ["overlay", "regenerate", "startup"]
+    print(f"Benchmarking {', '.join(stages)} against {origin} fixtures ({len(responses)} responses)")
+
+    server = start_stub_server(responses, [synthetic_image(*size, seed=i) for i, size in enumerate(OVERLAY_SIZES)])
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+    options = dict(fixture_options)
+    results = []
+    try:
+        for stage in stages:
+            if stage.upper() in SCRAPER_STAGES:
+                results.append(_in_subprocess(stage_scraper, stage.upper(), stub_url, options,
+                                              args.download_workers, args.verbose))
+                print_stage(results[-1])
+            elif stage == "overlay":
+                for size in OVERLAY_SIZES:
+                    results.append(_in_subprocess(stage_overlay, size, args.renders, args.verbose))
+                    print_stage(results[-1])
+            elif stage == "regenerate":
+                results.append(_in_subprocess(stage_regenerate, args.regenerate_images, args.jobs, args.verbose))
+                print_stage(results[-1])
+            elif stage == "startup":
+                # Already one process per run, so no subprocess around it
+                for name in STARTUP_COMMANDS:
+                    results.append(stage_startup(name, args.startup_runs))
+                    print_stage(results[-1])
+            else:
+                print(f"Unknown stage: {stage}")
+    finally:
+        server.shutdown()
+
+    report = {"environment": _environment(), "fixtures": origin, "options": options, "stages": results}
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+    return report
+
+def record_fixtures(args):
+    """Run each source against the real sites and keep the pages it fetched"""
+    from sources import load_sources
+    from utils import report_outcome
+    directory = os.path.abspath(args.fixtures)
+    sources = load_sources()
+    adapter = _mount(RecordingAdapter())
+    today = datetime.date.today()
+    options = {"apod_start": (today - datetime.timedelta(days=13)).isoformat(), "apod_end": today.isoformat()}
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_record_") as workdir:
+        os.chdir(workdir)  # keep checkpoints and caches out of ./data
+        try:
+            for name in SCRAPER_STAGES:
+                print(f"Recording {name}...")
+                records = sources[name].records(**options)
+                taken = 0
+                try:
+                    for record in islice(records, args.images):
+                        # Nothing is downloaded, but sources wait for their
+                        # records to finish before moving past a page
+                        report_outcome(record.on_done, "saved")
+                        taken += 1
+                except Exception as e:
+                    print(f"{name}: recording failed: {e}")
+                finally:
+                    records.close()
+                print(f"{name}: {taken} records")
+        finally:
+            os.chdir(previous)
+    write_fixtures(directory, adapter.responses, options, "recorded")
+    print(f"Recorded {len(adapter.responses)} responses to {directory}")
+
+def compare_results(old_path, new_path):
+    """Print the change in throughput, latency and RSS between two result files"""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+
+    def change(before, after):
+        if not before or after is None:
+            return "n/a"
+        return f"{before:.1f} -> {after:.1f} ({(after - before) / before * 100:+.0f}%)"
+
+    for name, after in new.items():
+        before = old.get(name)
+        if before is None:
+            print(f"{name:<20} (new stage)")
+            continue
+        if "images_per_s" not in after:
+            # Startup stages: time to exit and what got imported
+            p50_before = (before.get("latency_ms", {}).get("startup") or {}).get("p50")
+            p50_after = (after.get("latency_ms", {}).get("startup") or {}).get("p50")
+            print(f"{name:<20} startup p50 ms {change(p50_before, p50_after)}  "
+                  f"imports {', '.join(before.get('heavy_modules', [])) or '-'} -> "
+                  f"{', '.join(after.get('heavy_modules', [])) or '-'}")
+            continue
+        latency_before = (before.get("latency_ms", {}).get("images") or {}).get("p95")
+        latency_after = (after.get("latency_ms", {}).get("images") or {}).get("p95")
+        print(f"{name:<20} images/s {change(before['images_per_s'], after['images_per_s'])}  "
+              f"image p95 ms {change(latency_before, latency_after)}  "
+              f"RSS MB {change(before.get('peak_rss_mb'), after.get('peak_rss_mb'))}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the scrapers and the overlay path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmark stages against the stub server")
+    run.add_argument("--fixtures", default=None, help="Fixture set to replay (default: generate synthetic fixtures)")
+    run.add_argument("--scale", type=int, default=1, help="Size multiplier for synthetic fixtures (default: 1)")
+    run.add_argument("--stages", default=None, help=f"Comma-separated stages (default: {','.join(SCRAPER_STAGES)},overlay,regenerate,startup)")
+    run.add_argument("--download-workers", type=int, default=4, help="Download threads in the scraper stages, 0 saves inline (default: 4)")
+    run.add_argument("--renders", type=int, default=OVERLAY_RENDERS, help=f"Renders per image size in the overlay stage (default: {OVERLAY_RENDERS})")
+    run.add_argument("--regenerate-images", type=int, default=REGENERATE_IMAGES, help=f"Originals in the regenerate stage (default: {REGENERATE_IMAGES})")
+    run.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes in the regenerate stage (default: 1)")
+    run.add_argument("--startup-runs", type=int, default=STARTUP_RUNS, help=f"Runs of each command in the startup stage (default: {STARTUP_RUNS})")
+    run.add_argument("--output", "-o", default=None, help=f"Results file (default: {RESULTS_DIR}/benchmark_<time>.json)")
+    run.add_argument("--verbose", "-v", action="store_true", help="Show the scrapers' own output")
+
+    record = commands.add_parser("record", help="Record a fixture set from the live sites (needs network)")
+    record.add_argument("--fixtures", required=True, help="Directory to write the fixture set to")
+    record.add_argument("--images", type=int, default=RECORD_IMAGES, help=f"Records taken from each source (default: {RECORD_IMAGES})")
+
+    fixtures = commands.add_parser("fixtures", help="Write the synthetic fixture set to a directory")
+    fixtures.add_argument("directory")
+    fixtures.add_argument("--scale", type=int, default=1)
+
+    compare = commands.add_parser("compare", help="Compare two results files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        run_benchmark(args)
+    elif args.command == "record":
+        record_fixtures(args)
+    elif args.command == "fixtures":
+        responses, options = synthetic_fixtures(args.scale)
+        write_fixtures(args.directory, responses, options, "synthetic")
+        print(f"Wrote {len(responses)} responses to {args.directory}")
+    else:
+        compare_results(args.old, args.new)
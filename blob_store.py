@@ -0,0 +1,79 @@
+import os
+import uuid
+import shutil
+
+BLOB_DIR = "./data/blobs"
+
+class BlobStore:
+    """
+    Content-addressed store for downloaded originals
+
+    Every distinct image is kept once under its SHA-256 and the per-title files
+    in the agency directories are hardlinks to it (or copies where the
+    filesystem does not support hardlinks), so different titles or URLs serving
+    the same bytes share one blob. The catalog records each image's hash, which
+    lets a URL already fetched by any agency skip the download entirely.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def has(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def staging_path(self):
+        """A fresh path inside the store to download into before hashing is known"""
+        staging_dir = os.path.join(self.root, "staging")
+        os.makedirs(staging_dir, exist_ok=True)
+        return os.path.join(staging_dir, uuid.uuid4().hex)
+
+    def add(self, path, sha256):
+        """
+        Move a downloaded file into the store
+
+        If the content is already stored the file is dropped instead.
+
+        Returns:
+            True if the content was new, False if it was a duplicate
+        """
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.unlink(path)
+            return False
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(path, blob_path)
+        return True
+
+    def link(self, sha256, dest):
+        """Make dest a hardlink to (or a copy of) a stored blob, replacing dest atomically"""
+        blob_path = self.blob_path(sha256)
+        tmp_path = f"{dest}.{uuid.uuid4().hex}.part"
+        try:
+            try:
+                os.link(blob_path, tmp_path)
+            except OSError:
+                # Different filesystem or no hardlink support
+                shutil.copyfile(blob_path, tmp_path)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+_store = BlobStore()
+_enabled = True
+
+def configure_blob_store(root=None, enabled=None):
+    """Change the shared blob store settings"""
+    global _store, _enabled
+    if root is not None:
+        _store = BlobStore(root)
+    if enabled is not None:
+        _enabled = enabled
+
+def get_blob_store():
+    """Return the shared blob store, or None when deduplication is disabled"""
+    return _store if _enabled else None
@@ -0,0 +1,182 @@
+import os
+import csv
+import atexit
+import sqlite3
+import datetime
+import threading
+
+CATALOG_DB = "./data/image_catalog.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    image_url TEXT NOT NULL,
+    description TEXT,
+    path TEXT NOT NULL,
+    sha256 TEXT,
+    size INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_source ON images(source);
+CREATE INDEX IF NOT EXISTS idx_images_image_url ON images(image_url);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images(sha256);
+CREATE INDEX IF NOT EXISTS idx_images_created_at ON images(created_at);
+"""
+
+COLUMNS = ["id", "source", "title", "image_url", "description", "path", "sha256", "size", "created_at"]
+CSV_HEADER = ["Source", "Title", "Image URL", "Description", "Saved Image Path"]
+
+class Catalog:
+    """
+    SQLite catalog of every saved image
+
+    Replaces the append-only CSV: rows are indexed by source, image URL,
+    content hash and date, so "have we seen this URL" is a lookup instead of a
+    file scan. Inserts are buffered and written in batches inside one
+    transaction; reads flush the buffer first so they always see earlier
+    writes. One connection is shared by all threads behind a lock, so
+    concurrent scrapers never interleave partial rows.
+    """
+
+    def __init__(self, path=CATALOG_DB, batch_size=50):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.RLock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def add(self, source, title, image_url, description, path, sha256=None, size=None):
+        """Queue an image row; it is written with the next batch"""
+        created_at = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._pending.append((source, title, image_url, description, path, sha256, size, created_at))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write all queued rows in a single transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO images (source, title, image_url, description, path, sha256, size, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._pending,
+                )
+            self._pending = []
+
+    def _fetch(self, sql, params=()):
+        with self._lock:
+            self.flush()
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def find_by_url(self, image_url):
+        """Return the most recent row for an image URL, or None"""
+        rows = self._fetch("SELECT * FROM images WHERE image_url = ? ORDER BY id DESC LIMIT 1", (image_url,))
+        return rows[0] if rows else None
+
+    def find_by_hash(self, sha256):
+        """Return all rows whose original has this content hash"""
+        return self._fetch("SELECT * FROM images WHERE sha256 = ? ORDER BY id", (sha256,))
+
+    def has_url(self, image_url):
+        return self.find_by_url(image_url) is not None
+
+    def query(self, source=None, since=None, until=None, limit=None):
+        """
+        Look up images by source and date
+
+        Args:
+            source: Agency source name, e.g. "ESA" or "NASA_APOD"
+            since: Only rows saved at or after this ISO date/datetime
+            until: Only rows saved before this ISO date/datetime
+            limit: Maximum number of rows
+
+        Returns:
+            List of row dictionaries, newest first
+        """
+        conditions = []
+        params = []
+        if source is not None:
+            conditions.append("source = ?")
+            params.append(source)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+        sql = "SELECT * FROM images"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._fetch(sql, params)
+
+    def titles(self, source):
+        """Return the titles of all images saved for a source"""
+        rows = self._fetch("SELECT title FROM images WHERE source = ?", (source,))
+        return [row["title"] for row in rows]
+
+    def count_by_source(self):
+        """Return a dictionary of source name to number of images"""
+        rows = self._fetch("SELECT source, COUNT(*) AS n FROM images GROUP BY source ORDER BY source")
+        return {row["source"]: row["n"] for row in rows}
+
+    def is_empty(self):
+        return not self._fetch("SELECT 1 FROM images LIMIT 1")
+
+    def import_csv(self, csv_path):
+        """Load rows from the old image_catalog.csv; returns the number imported"""
+        if not os.path.exists(csv_path):
+            return 0
+        imported = 0
+        with open(csv_path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            for row in reader:
+                if row == CSV_HEADER or len(row) < 5:
+                    continue
+                self.add(*row[:5])
+                imported += 1
+        self.flush()
+        return imported
+
+    def export_csv(self, csv_path):
+        """Write the catalog in the old image_catalog.csv layout"""
+        rows = self._fetch("SELECT source, title, image_url, description, path FROM images ORDER BY id")
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for row in rows:
+                writer.writerow([row["source"], row["title"], row["image_url"], row["description"], row["path"]])
+        os.replace(tmp_path, csv_path)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog(path=None):
+    """Return the shared catalog, opening it on first use"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog(path or CATALOG_DB)
+            # Make sure buffered rows reach the database even if the run is cut short
+            atexit.register(_catalog.flush)
+        return _catalog
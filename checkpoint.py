@@ -0,0 +1,142 @@
+import os
+import json
+import tempfile
+import threading
+
+CHECKPOINT_DIR = "./data/checkpoints"
+
+def _write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _checkpoint_path(agency):
+    return os.path.join(CHECKPOINT_DIR, f"{agency.lower()}.json")
+
+def load_checkpoint(agency):
+    """
+    Return the saved crawl state for an agency
+
+    Returns:
+        The state dictionary, or None if there is no (readable) checkpoint
+    """
+    try:
+        with open(_checkpoint_path(agency), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_checkpoint(agency, state):
+    """
+    Persist the crawl state for an agency
+
+    The state is written to a temporary file and renamed over the old
+    checkpoint, so a run killed mid-write leaves the previous checkpoint intact.
+    """
+    _write_json_atomic(_checkpoint_path(agency), state)
+
+def clear_checkpoint(agency):
+    """Forget the crawl state once an agency has been scraped to the end"""
+    try:
+        os.unlink(_checkpoint_path(agency))
+    except FileNotFoundError:
+        pass
+
+# Outcomes (see utils.ImageRecord) that leave the image on disk
+SAVED_OUTCOMES = ("saved", "exists")
+
+class CrawlProgress:
+    """
+    Which of the records a crawl has handed to the source runner are done
+
+    The runner may only queue a record for the download pipeline, so when a
+    scraper's yield returns the image is not saved yet, and a checkpoint
+    written then would skip it on --resume if the run dies with it still in
+    the queue. track() returns the callback for the record's on_done; it is
+    called once the save has finished. Crawls call wait() before moving a
+    checkpoint past a page, or save their checkpoint from on_change, which
+    runs after every finished item.
+
+    Attributes:
+        finished: Keys of the items that are done, saved or not (with the
+            ones passed in, e.g. from a checkpoint)
+        saved: Keys of the items whose image is on disk
+        new: Number of records whose image this run saved
+    """
+
+    def __init__(self, finished=(), on_change=None):
+        self.finished = set(finished)
+        self.saved = set()
+        self.new = 0
+        self._outstanding = 0
+        self._on_change = on_change
+        self._condition = threading.Condition()
+
+    def track(self, key):
+        """
+        Count an item's record as outstanding
+
+        Returns:
+            The record's on_done callback; only its first call counts
+        """
+        with self._condition:
+            self._outstanding += 1
+        reported = []
+
+        def on_done(outcome):
+            with self._condition:
+                if reported:
+                    return
+                reported.append(outcome)
+                self._outstanding -= 1
+                if outcome in SAVED_OUTCOMES:
+                    self.saved.add(key)
+                if outcome == "saved":
+                    self.new += 1
+                self._finish(key)
+
+        return on_done
+
+    def complete(self, key):
+        """Mark an item done that needed no record (e.g. a page without an image)"""
+        with self._condition:
+            self._finish(key)
+
+    def _finish(self, key):
+        # Callers hold the lock, so on_change runs for one item at a time
+        self.finished.add(key)
+        self._condition.notify_all()
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def wait(self):
+        """Block until every tracked record has finished"""
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+
+# Items already ingested, kept across runs (unlike checkpoints, which only
+# live until a crawl finishes)
+KNOWN_ITEMS_DIR = "./data/known_items"
+
+def _known_items_path(agency):
+    return os.path.join(KNOWN_ITEMS_DIR, f"{agency.lower()}.json")
+
+def load_known_items(agency):
+    """Return the set of item keys (e.g. detail page URLs) already ingested for an agency"""
+    try:
+        with open(_known_items_path(agency), "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+def save_known_items(agency, items):
+    """Persist the set of ingested item keys atomically"""
+    _write_json_atomic(_known_items_path(agency), sorted(items))
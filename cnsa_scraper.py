@@ -1,21 +1,33 @@
-from utils import save_image_data, HEADERS
-import requests
-from bs4 import BeautifulSoup
-import time
+from utils import ImageRecord, http_get, absolute_url
+from sources import register_source, run_source
+from http_cache import cached_get
+from html_parser import make_soup, has_class
 
-def scrape_cnsa_images(force_redownload=False, recreate_overlays=False):
-    if recreate_overlays:
-        print("CNSA: Recreate overlays mode - skipping image scraping")
-        return
-        
+OUTDIR = "cnsa_images"
+BASE_URL = "https://www.cnsa.gov.cn/english"
+START_URL = f"{BASE_URL}"
+
+def keep_cnsa_home(name, attrs):
+    """The home page is only searched for news and list containers"""
+    if name == "div":
+        return any(has_class(attrs, c) for c in ("new", "news-list", "list"))
+    return name == "ul" and has_class(attrs, "list")
+
+def keep_cnsa_detail(name, attrs):
+    """Detail pages only need the title, content and images"""
+    if name == "div":
+        return any(has_class(attrs, c) for c in ("title", "TRS_Editor", "content"))
+    return name in ("h1", "img")
+
+@register_source("CNSA", OUTDIR, hosts={"www.cnsa.gov.cn": (0.1, 1.0)})
+def cnsa_records(**options):
+    """Yield the images of the articles linked from the CNSA English home page"""
     print("Scraping CNSA...")
-    BASE_URL = "https://www.cnsa.gov.cn/english"
-    START_URL = f"{BASE_URL}"
     
     try:
         # Get the main page
-        response = requests.get(START_URL, headers=HEADERS)
-        soup = BeautifulSoup(response.content, "html.parser")
+        response = cached_get(START_URL)
+        soup = make_soup(response.content, keep_cnsa_home)
         
         # Look for image galleries or news sections with images
         # CNSA website structure might change, so we need to inspect the current structure
@@ -34,20 +46,13 @@ def scrape_cnsa_images(force_redownload=False, recreate_overlays=False):
                 if not link.get("href"):
                     continue
                     
-                href = link["href"]
-                if not href.startswith("http"):
-                    # Make relative URLs absolute
-                    if href.startswith("/"):
-                        full_url = f"https://www.cnsa.gov.cn{href}"
-                    else:
-                        full_url = f"{BASE_URL}/{href}"
-                else:
-                    full_url = href
+                # Make relative URLs absolute
+                full_url = absolute_url(link["href"], f"{BASE_URL}/")
                 
                 try:
                     # Get the detail page
-                    detail_response = requests.get(full_url, headers=HEADERS)
-                    detail_soup = BeautifulSoup(detail_response.content, "html.parser")
+                    detail_response = http_get(full_url)
+                    detail_soup = make_soup(detail_response.content, keep_cnsa_detail)
                     
                     # Try to find the title
                     title_elem = detail_soup.find("h1") or detail_soup.find("div", class_="title")
@@ -72,27 +77,24 @@ def scrape_cnsa_images(force_redownload=False, recreate_overlays=False):
                         if not img.get("src"):
                             continue
                             
-                        img_url = img["src"]
-                        if not img_url.startswith("http"):
-                            # Make relative URLs absolute
-                            if img_url.startswith("/"):
-                                img_url = f"https://www.cnsa.gov.cn{img_url}"
-                            else:
-                                img_url = f"{BASE_URL}/{img_url}"
+                        img_url = absolute_url(img["src"], f"{BASE_URL}/")
                         
                         # Add a suffix for multiple images from the same article
                         img_title = title
                         if i > 0:
                             img_title = f"{title} ({i+1})"
                             
-                        save_image_data("CNSA", img_title, img_url, desc, "cnsa_images", force_redownload, recreate_overlays)
-                        time.sleep(1)
+                        yield ImageRecord("CNSA", img_title, img_url, desc, OUTDIR)
                         
                 except Exception as e:
                     print(f"CNSA detail error: {e}")
                 
-                # Don't overload the server
-                time.sleep(2)
-                
     except Exception as e:
-        print(f"CNSA error: {e}") 
\ No newline at end of file
+        print(f"CNSA error: {e}")
+
+def scrape_cnsa_images(force_redownload=False, recreate_overlays=False):
+    """Scrape CNSA on its own through the shared source runner (see cnsa_records)"""
+    if recreate_overlays:
+        print("CNSA: Recreate overlays mode - skipping image scraping")
+        return
+    return run_source("CNSA", force_redownload=force_redownload)
@@ -1,23 +1,106 @@
 import argparse
-from utils import setup_csv, regenerate_all_overlays
-from esa_scraper import scrape_esa_images
-from nasa_scraper import scrape_nasa_images
-from jaxa_scraper import scrape_jaxa_images
-from apod_scraper import scrape_apod_images
-from cnsa_scraper import scrape_cnsa_images
+import datetime
+# Everything else is imported once the arguments are parsed, and only for the
+# chosen mode: --help needs none of it, and --recreate-overlays needs neither
+# the scrapers nor requests, lxml and the HTTP cache behind them
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Download images from space agencies")
     parser.add_argument("--force", "-f", action="store_true", help="Force redownload of images even if they already exist")
     parser.add_argument("--apod-days", "-a", type=int, default=7, help="Number of days to download from NASA APOD (default: 7)")
+    parser.add_argument("--apod-start", default=None, help="Bulk-ingest APOD from this date (YYYY-MM-DD) using the archive index; replaces --apod-days")
+    parser.add_argument("--apod-end", default=None, help="Last date (YYYY-MM-DD) of a bulk APOD range (default: today)")
+    parser.add_argument("--nasa-harvest", action="store_true", help="Page through every NASA Images API result for the configured queries and year ranges instead of one random page")
+    parser.add_argument("--nasa-workers", type=int, default=4, help="With --nasa-harvest, number of NASA asset manifests fetched at the same time to find each item's best rendition; downloads use --download-workers (default: 4)")
+    parser.add_argument("--only", default=None, metavar="NAMES", help="Comma-separated agencies to process, e.g. esa,apod (ESA, NASA, JAXA, APOD, CNSA; default: all)")
     parser.add_argument("--recreate-overlays", "-r", action="store_true", help="Only recreate overlay images using existing originals")
-    return parser.parse_args()
+    parser.add_argument("--force-overlays", action="store_true", help="With --recreate-overlays, re-render every overlay even if it is up to date")
+    parser.add_argument("--overlay-max-dimension", type=int, default=None, help="Downscale overlays so their longest side is at most this many pixels (default: keep original size)")
+    parser.add_argument("--derivatives", action="store_true", help="Also write smaller JPEG/WebP renditions of each overlay to <agency>_images/derivatives for the web front end")
+    parser.add_argument("--derivative-sizes", default=None, metavar="NAME=PIXELS,...", help="With --derivatives, sizes by longest side (default: thumb=320,preview=1280; the preview shows the description)")
+    parser.add_argument("--derivative-formats", default=None, metavar="FORMATS", help="With --derivatives, comma-separated formats from jpeg, webp, avif (default: jpeg,webp)")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB", help="Cap the decoded image buffers held by all overlay renders at once; larger images wait their turn, and JPEGs too large for the whole budget are decoded at reduced size (default: no cap)")
+    parser.add_argument("--max-image-pixels", type=int, default=None, help="Refuse originals with more pixels than this, as a decompression bomb guard (default: Pillow's limit, about 179 million)")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of processes used by --recreate-overlays (default: number of CPUs)")
+    parser.add_argument("--parallel", "-p", action="store_true", help="Run all agency scrapers at the same time instead of one after another")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="Number of agencies to scrape at the same time (implies --parallel, default: all of them)")
+    parser.add_argument("--download-workers", type=int, default=4, help="Number of threads downloading images (default: 4, 0 saves images inline in the scrapers)")
+    parser.add_argument("--overlay-workers", type=int, default=2, help="Number of threads rendering overlays (default: 2)")
+    parser.add_argument("--queue-size", type=int, default=32, help="Maximum number of images waiting for download (default: 32)")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a server response before giving up (default: 30)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries on connection errors, 429 and 5xx responses (default: 3)")
+    parser.add_argument("--max-per-host", type=int, default=4, help="Maximum concurrent requests to a single host (default: 4)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Do not pace requests per host (only --max-per-host applies)")
+    parser.add_argument("--host-rate", action="append", default=[], metavar="HOST=FLOOR:CEILING", help="Override the adaptive rate range for a host in requests per second, e.g. www.esa.int=0.5:2 (repeatable)")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="Seconds a cached listing page or API response is reused before revalidating (default: 3600)")
+    parser.add_argument("--no-http-cache", action="store_true", help="Always fetch listing pages and API responses from the network")
+    parser.add_argument("--no-dedup", action="store_true", help="Store every download separately instead of sharing identical images through data/blobs")
+    parser.add_argument("--resume", action="store_true", help="Continue each agency's crawl from where an interrupted run stopped")
+    parser.add_argument("--incremental", action="store_true", help="ESA: skip images ingested by earlier runs and stop once listing pages hold nothing new")
+    parser.add_argument("--esa-stop-after", type=int, default=2, help="With --incremental, number of consecutive ESA listing pages without new images that ends the crawl (default: 2)")
+    parser.add_argument("--backend", choices=["sync", "async"], default="sync", help="Scraping engine for ESA, JAXA and APOD; async needs aiohttp (default: sync)")
+    parser.add_argument("--async-rate", type=float, default=2.0, help="Async backend: request starts per second per host (default: 2)")
+    parser.add_argument("--metrics-log", default=None, metavar="PATH", help="Append a JSON line per request, download and overlay render with its timings to PATH")
+    parser.add_argument("--metrics-prom", default=None, metavar="PATH", help="Write Prometheus-style counters and histograms to PATH at the end of the run")
+    parser.add_argument("--no-metrics-summary", action="store_true", help="Do not print the per-agency timing table at the end of the run")
+    parser.add_argument("--profile", nargs="?", const="sample", choices=["sample", "cprofile"], default=None, help="Profile the run: sample the stacks of all threads (default) or also run the main thread under cProfile; writes a ranked report and per-agency flamegraph stacks to --profile-dir")
+    parser.add_argument("--profile-memory", action="store_true", help="Trace allocations with tracemalloc around overlay rendering and image saving (slows the run down)")
+    parser.add_argument("--profile-dir", default=None, help="Directory for the profile reports (default: data/profiles/<time>)")
+    args = parser.parse_args()
+    for value in args.host_rate:
+        try:
+            host, limits = value.split("=", 1)
+            floor, ceiling = (float(x) for x in limits.split(":", 1))
+        except ValueError:
+            parser.error(f"invalid --host-rate {value!r}, expected HOST=FLOOR:CEILING")
+        if not 0 < floor <= ceiling:
+            parser.error(f"invalid --host-rate {value!r}, need 0 < FLOOR <= CEILING")
+    for value in (args.apod_start, args.apod_end):
+        if value:
+            try:
+                datetime.date.fromisoformat(value)
+            except ValueError:
+                parser.error(f"invalid APOD date {value!r}, expected YYYY-MM-DD")
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        parser.error("--memory-budget must be positive")
+    if args.max_image_pixels is not None and args.max_image_pixels <= 0:
+        parser.error("--max-image-pixels must be positive")
+    if args.derivative_sizes:
+        try:
+            args.derivative_sizes = {name.strip(): int(pixels) for name, pixels in
+                                     (item.split("=", 1) for item in args.derivative_sizes.split(","))}
+        except ValueError:
+            parser.error(f"invalid --derivative-sizes {args.derivative_sizes!r}, expected NAME=PIXELS,...")
+        if any(pixels <= 0 for pixels in args.derivative_sizes.values()):
+            parser.error("--derivative-sizes must be positive")
+    if args.derivative_formats:
+        args.derivative_formats = [fmt.strip().lower() for fmt in args.derivative_formats.split(",") if fmt.strip()]
+        from utils import DERIVATIVE_SETTINGS
+        unknown = [fmt for fmt in args.derivative_formats if fmt not in DERIVATIVE_SETTINGS["encoders"]]
+        if unknown:
+            parser.error(f"invalid --derivative-formats {', '.join(unknown)} (choose from {', '.join(DERIVATIVE_SETTINGS['encoders'])})")
+    from sources import select_sources
+    try:
+        args.sources = select_sources(args.only)
+    except ValueError as e:
+        parser.error(f"invalid --only: {e}")
+    return args
 
 if __name__ == "__main__":
     args = parse_args()
     force_download = args.force
     apod_days = args.apod_days
     recreate_overlays = args.recreate_overlays
+    from utils import OVERLAY_SETTINGS, configure_derivatives
+    from metrics import configure_metrics, get_metrics
+    configure_metrics(log_path=args.metrics_log)
+    if args.overlay_max_dimension:
+        OVERLAY_SETTINGS["max_dimension"] = args.overlay_max_dimension
+    if args.memory_budget or args.max_image_pixels:
+        from memory_budget import configure_memory_budget
+        configure_memory_budget(args.memory_budget, args.max_image_pixels)
+    if args.derivatives:
+        configure_derivatives(enabled=True, sizes=args.derivative_sizes, formats=args.derivative_formats)
     
     if force_download and recreate_overlays:
         print("WARNING: --force and --recreate-overlays are mutually exclusive. Using --recreate-overlays only.")
@@ -26,19 +109,96 @@ if __name__ == "__main__":
     if force_download:
         print("WARNING: Force download mode enabled. All images will be downloaded again.")
     
+    profiler = None
+    if args.profile or args.profile_memory:
+        from profiling import Profiler
+        profiler = Profiler(args.profile, args.profile_memory, args.profile_dir)
+        profiler.start()
+
     if recreate_overlays:
+        from utils import regenerate_overlays
+        from sources import source_outdirs
         print("Recreate overlays mode enabled. Will regenerate all overlay images.")
-        # Regenerate overlays for all image directories
-        regenerate_all_overlays("esa_images")
-        regenerate_all_overlays("nasa_images")
-        regenerate_all_overlays("jaxa_images")
-        regenerate_all_overlays("apod_images")
-        regenerate_all_overlays("cnsa_images")
+        # Regenerate overlays for all image directories over one process pool
+        _, errors = regenerate_overlays(
+            source_outdirs(args.sources),
+            jobs=args.jobs,
+            force=args.force_overlays,
+        )
+        if errors:
+            print(f"{len(errors)} overlays could not be regenerated:")
+            for img_path, error in errors:
+                print(f"  {img_path}: {error}")
     else:
         # Normal operation - download images
-        setup_csv()
-        scrape_esa_images(force_download, recreate_overlays)
-        scrape_nasa_images(force_download, recreate_overlays)
-        scrape_jaxa_images(force_download, recreate_overlays)
-        scrape_apod_images(apod_days, force_download, recreate_overlays)
-        scrape_cnsa_images(force_download, recreate_overlays)
\ No newline at end of file
+        from utils import setup_catalog, export_catalog_csv, configure_http, save_overlay_manifests
+        from pipeline import ImagePipeline
+        from http_cache import configure_cache
+        from blob_store import configure_blob_store
+        from sources import load_sources, run_sources
+        from rate_limit import configure_rate_limits, set_host_limits
+        configure_http(timeout=(10, args.timeout), retries=args.retries, max_per_host=args.max_per_host)
+        configure_cache(ttl=args.cache_ttl, enabled=not args.no_http_cache)
+        configure_blob_store(enabled=not args.no_dedup)
+        if args.backend == "async":
+            from async_engine import configure_async
+            configure_async(per_host=args.max_per_host, rate=args.async_rate)
+
+        sources = load_sources(args.sources)
+        configure_rate_limits(enabled=not args.no_rate_limit)
+        # Command-line overrides win over the ranges the sources register
+        for value in args.host_rate:
+            host, limits = value.split("=", 1)
+            floor, ceiling = limits.split(":", 1)
+            set_host_limits(host, float(floor), float(ceiling))
+
+        catalog = setup_catalog()
+        options = {
+            "force_redownload": force_download,
+            "backend": args.backend,
+            "resume": args.resume,
+            "incremental": args.incremental,
+            "esa_stop_after": args.esa_stop_after,
+            "apod_days": apod_days,
+            "apod_start": args.apod_start,
+            "apod_end": args.apod_end,
+            "nasa_harvest": args.nasa_harvest,
+            "nasa_workers": args.nasa_workers,
+        }
+
+        # --workers implies --parallel; --parallel alone runs every agency at once
+        if args.workers is not None:
+            workers = max(1, args.workers)
+        elif args.parallel:
+            workers = len(sources)
+        else:
+            workers = 1
+
+        if workers > 1:
+            print(f"Parallel mode enabled. Scraping up to {workers} agencies at the same time.")
+
+        if args.download_workers > 0:
+            with ImagePipeline(args.download_workers, args.overlay_workers, args.queue_size):
+                run_sources(args.sources, options=options, workers=workers)
+        else:
+            run_sources(args.sources, options=options, workers=workers)
+        save_overlay_manifests()
+
+        # Keep data/image_catalog.csv available for tools that read the old format
+        catalog.flush()
+        exported = export_catalog_csv()
+        print(f"Catalog: {exported} images ({', '.join(f'{source}: {n}' for source, n in catalog.count_by_source().items())})")
+
+    if profiler:
+        profiler.stop()
+        profiler.write_reports()
+
+    # Where the time went, per agency
+    metrics = get_metrics()
+    if not args.no_metrics_summary:
+        print("\n=== Timing by agency (seconds per phase) ===")
+        print(metrics.summary())
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+        print(f"Metrics written to {args.metrics_prom}")
+    metrics.close()
@@ -1,68 +1,183 @@
-from utils import save_image_data, HEADERS
-import time
-import requests
-from bs4 import BeautifulSoup
+from utils import ImageRecord, http_get, absolute_url
+from sources import register_source, run_source
+from http_cache import cached_get
+from checkpoint import (
+    CrawlProgress, load_checkpoint, save_checkpoint, clear_checkpoint, load_known_items, save_known_items,
+)
+from html_parser import make_soup, has_class, has_token
 
-def scrape_esa_images(force_redownload=False, recreate_overlays=False):
-    if recreate_overlays:
-        print("ESA: Recreate overlays mode - skipping image scraping")
+BASE_URL = "https://www.esa.int"
+START_URL = f"{BASE_URL}/Applications/Observing_the_Earth/Highlights/Image_of_the_Day"
+OUTDIR = "esa_images"
+STOP_AFTER_KNOWN_PAGES = 2  # incremental mode: stop after this many listing pages with nothing new
+
+def keep_esa_listing(name, attrs):
+    """Listing pages only need the feature items and the next page link"""
+    if name == "div":
+        return has_class(attrs, "feature-item")
+    return name == "a" and (has_class(attrs, "next") or has_token(attrs, "rel", "next"))
+
+def keep_esa_detail(name, attrs):
+    """Detail pages only need the title, description, og:image and fallback image"""
+    if name == "div":
+        return has_class(attrs, "modal__tab-description")
+    if name == "meta":
+        return attrs.get("property") == "og:image"
+    return name in ("h1", "img")
+
+def parse_esa_listing(soup):
+    """
+    Extract detail page links and the next page link from a listing page
+
+    Returns:
+        Tuple of (list of detail page URLs, next listing page URL or None)
+    """
+    detail_urls = []
+    # The class structure has changed from "teaser" to "feature-item"
+    feature_items = soup.find_all("div", class_="feature-item")
+
+    for item in feature_items:
+        # Find the anchor link which is inside the feature-item
+        a_tag = item.find("a", class_="cta popup")
+        if not a_tag or "href" not in a_tag.attrs:
+            continue
+
+        detail_urls.append(absolute_url(a_tag["href"], BASE_URL))
+
+    # Find the next page link - ESA uses rel="next" now
+    next_url = None
+    next_link = soup.find("a", class_="next") or soup.find("a", rel="next")
+    if next_link and "href" in next_link.attrs:
+        next_url = absolute_url(next_link["href"], BASE_URL)
+    return detail_urls, next_url
+
+def parse_esa_detail(detail):
+    """
+    Extract the title, description and image URL from a detail page
+
+    Returns:
+        Tuple of (title, description, image URL), or None if there is no image
+    """
+    title = detail.find("h1").text.strip()
+    # Find description in the modal__tab-description div
+    desc_div = detail.find("div", class_="modal__tab-description")
+    desc = desc_div.text.strip() if desc_div else "No description available"
+
+    # Find the main image src - it's often a direct image with a pillars.jpg format
+    img_element = detail.find("meta", property="og:image")
+    if img_element and "content" in img_element.attrs:
+        img_url = img_element["content"]
+    else:
+        # Fallback to find the main image
+        img_div = detail.find("img", alt=title)
+        if img_div and "src" in img_div.attrs:
+            img_url = absolute_url(img_div["src"], BASE_URL)
+        else:
+            return None  # Skip if we can't find an image
+    return title, desc, img_url
+
+@register_source("ESA", OUTDIR, hosts={"www.esa.int": (0.2, 4.0)})
+def esa_records(force_redownload=False, backend="sync", resume=False, incremental=False,
+                esa_stop_after=STOP_AFTER_KNOWN_PAGES, **options):
+    """
+    Yield the images of the ESA Image of the Day archive
+
+    Args:
+        force_redownload: Whether to re-download existing images
+        backend: "sync" or "async" fetching engine
+        resume: Continue from the checkpoint of an interrupted run (sync only)
+        incremental: Skip detail pages ingested by earlier runs and stop paginating
+            after esa_stop_after consecutive listing pages without new items, or
+            at the first unchanged listing page (HTTP cache) without new items
+        esa_stop_after: Number of fully known listing pages that ends an incremental crawl
+    """
+    if backend == "async":
+        if resume:
+            print("ESA: --resume is only supported by the sync backend, starting from the beginning")
+        from async_engine import iter_async_records, scrape_esa_async
+        known_links = load_known_items("esa")
+        progress = CrawlProgress()
+        yield from iter_async_records(scrape_esa_async, known_links, progress, incremental, esa_stop_after)
+        # Only images that were saved are known; the pipeline may still be at work
+        progress.wait()
+        save_known_items("esa", known_links | progress.saved)
         return
-        
+
     print("Scraping ESA...")
-    BASE_URL = "https://www.esa.int"
-    START_URL = f"{BASE_URL}/Applications/Observing_the_Earth/Highlights/Image_of_the_Day"
     seen_links = set()
     current_url = START_URL
 
-    def get_soup(url):
-        return BeautifulSoup(requests.get(url, headers=HEADERS).content, "html.parser")
+    # Pick up at the listing page and links where the last run stopped
+    state = load_checkpoint("esa") if resume else None
+    if state:
+        current_url = state["current_url"]
+        seen_links = set(state["seen_links"])
+        print(f"ESA: resuming at {current_url} ({len(seen_links)} links already handled)")
+
+    # Written once per listing page, after that page's records have been saved
+    def checkpoint():
+        save_checkpoint("esa", {"current_url": current_url, "seen_links": sorted(seen_links)})
+    progress = CrawlProgress()
+
+    # Detail pages ingested by any earlier run; the archive is newest first,
+    # so once whole listing pages are known there is nothing new further back
+    known_links = load_known_items("esa")
+    known_pages = 0
+
+    def get_soup(url, keep):
+        # Detail pages never change once fetched, so only listing pages go through the HTTP cache
+        return make_soup(http_get(url).content, keep)
 
     while current_url:
-        soup = get_soup(current_url)
-        # The class structure has changed from "teaser" to "feature-item"
-        feature_items = soup.find_all("div", class_="feature-item")
-
-        for item in feature_items:
-            # Find the anchor link which is inside the feature-item
-            a_tag = item.find("a", class_="cta popup")
-            if not a_tag or "href" not in a_tag.attrs:
-                continue
+        listing = cached_get(current_url)
+        detail_urls, next_url = parse_esa_listing(make_soup(listing.content, keep_esa_listing))
+
+        if incremental:
+            new_urls = [url for url in detail_urls if url not in known_links]
+            if not new_urls and listing.not_modified:
+                # New uploads would have changed this page, so none were published since the last crawl
+                print("ESA: listing page unchanged and fully known, stopping incremental crawl")
+                break
+            known_pages = 0 if new_urls else known_pages + 1
+            if known_pages >= esa_stop_after:
+                print(f"ESA: {known_pages} listing pages without new images, stopping incremental crawl")
+                break
+            detail_urls = new_urls
 
-            href = a_tag["href"]
-            full_url = BASE_URL + href if not href.startswith("http") else href
+        for full_url in detail_urls:
             if full_url in seen_links:
                 continue
             seen_links.add(full_url)
 
             try:
-                detail = get_soup(full_url)
-                title = detail.find("h1").text.strip()
-                # Find description in the modal__tab-description div
-                desc_div = detail.find("div", class_="modal__tab-description")
-                desc = desc_div.text.strip() if desc_div else "No description available"
-                
-                # Find the main image src - it's often a direct image with a pillars.jpg format
-                img_element = detail.find("meta", property="og:image")
-                if img_element and "content" in img_element.attrs:
-                    img_url = img_element["content"]
-                else:
-                    # Fallback to find the main image
-                    img_div = detail.find("img", alt=title)
-                    if img_div and "src" in img_div.attrs:
-                        img_url = img_div["src"]
-                        if not img_url.startswith("http"):
-                            img_url = BASE_URL + img_url
-                    else:
-                        continue  # Skip if we can't find an image
-                
-                save_image_data("ESA", title, img_url, desc, "esa_images", force_redownload, recreate_overlays)
-                time.sleep(1)
+                parsed = parse_esa_detail(get_soup(full_url, keep_esa_detail))
             except Exception as e:
                 print(f"ESA error: {e}")
+                continue
+            if parsed is None:
+                known_links.add(full_url)  # no image on this page, nothing to retry
+                continue
+            title, desc, img_url = parsed
 
-        # Find the next page link - ESA uses rel="next" now
-        next_link = soup.find("a", class_="next") or soup.find("a", rel="next")
-        if next_link and "href" in next_link.attrs:
-            current_url = BASE_URL + next_link["href"] if not next_link["href"].startswith("http") else next_link["href"]
-        else:
-            break 
\ No newline at end of file
+            yield ImageRecord("ESA", title, img_url, desc, OUTDIR, progress.track(full_url))
+
+        # Records still queued for the pipeline would be skipped on --resume,
+        # and only saved images are known (failed ones are retried next run)
+        progress.wait()
+        known_links |= progress.saved
+        save_known_items("esa", known_links)
+        current_url = next_url
+        if current_url:
+            checkpoint()
+
+    progress.wait()
+    clear_checkpoint("esa")
+
+def scrape_esa_images(force_redownload=False, recreate_overlays=False, backend="sync", resume=False,
+                      incremental=False, stop_after=STOP_AFTER_KNOWN_PAGES):
+    """Scrape the ESA archive on its own through the shared source runner (see esa_records)"""
+    if recreate_overlays:
+        print("ESA: Recreate overlays mode - skipping image scraping")
+        return
+    return run_source("ESA", force_redownload=force_redownload, backend=backend, resume=resume,
+                      incremental=incremental, esa_stop_after=stop_after)
@@ -0,0 +1,57 @@
+from bs4 import BeautifulSoup
+from bs4.filter import ElementFilter
+
+# lxml builds trees several times faster than the pure-Python html.parser;
+# it is optional, so fall back when it is not installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+class TagFilter(ElementFilter):
+    """
+    Parse only the subtrees rooted at the tags a scraper actually reads
+
+    keep(name, attrs) is called for each tag outside an already kept subtree,
+    with the raw attribute strings; tags it rejects are not created (their
+    children are still offered to it) and loose text between them is dropped.
+    Everything inside a kept tag is parsed normally, so find(), select() and
+    get_text() behave as on a full tree within those subtrees.
+    """
+
+    def __init__(self, keep):
+        super().__init__()
+        self.keep = keep
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return self.keep(name, attrs or {})
+
+    def allow_string_creation(self, string):
+        return False
+
+def has_token(attrs, attribute, token):
+    """Whether a raw attribute dictionary lists token in a space-separated attribute such as rel"""
+    tokens = attrs.get(attribute) or ""
+    if isinstance(tokens, str):
+        tokens = tokens.split()
+    return token in tokens
+
+def has_class(attrs, class_name):
+    """Whether a raw attribute dictionary lists class_name in its class attribute"""
+    return has_token(attrs, "class", class_name)
+
+def make_soup(markup, keep=None):
+    """
+    Parse an HTML page with the fastest available parser
+
+    Args:
+        markup: Page body as bytes or str
+        keep: Optional keep(name, attrs) predicate limiting the tree to the
+            subtrees the caller needs (see TagFilter)
+
+    Returns:
+        BeautifulSoup object
+    """
+    parse_only = TagFilter(keep) if keep else None
+    return BeautifulSoup(markup, HTML_PARSER, parse_only=parse_only)
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import requests
+from requests.structures import CaseInsensitiveDict
+from utils import http_get
+
+HTTP_CACHE_DIR = "./data/http_cache"
+HTTP_CACHE_TTL = 3600  # seconds a cached page is served without asking the server
+
+class HttpCache:
+    """
+    Persistent HTTP cache for listing pages and API responses
+
+    Each response is stored on disk together with its ETag / Last-Modified
+    validators. Within the TTL the cached copy is served without touching the
+    network; after that the request is sent with If-None-Match /
+    If-Modified-Since and a 304 answer is served from disk.
+
+    Responses returned by get() carry a not_modified attribute: True when the
+    server confirmed (or the TTL assumed) that the page is unchanged since it
+    was last fetched, so listing scrapers can stop early when nothing on it is
+    new (see esa_records and nasa_harvest_records).
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, enabled=True):
+        self.directory = directory
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def _load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+            return meta, body
+        except (OSError, ValueError):
+            return None, None
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _store(self, url, meta, body=None):
+        meta_path, body_path = self._paths(url)
+        # Body first, so the metadata never points at a missing body
+        if body is not None:
+            self._write_atomic(body_path, body)
+        self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def _cached_response(self, url, meta, body):
+        response = requests.Response()
+        response.status_code = meta.get("status", 200)
+        response._content = body
+        response.url = url
+        response.encoding = meta.get("encoding")
+        response.headers = CaseInsensitiveDict(meta.get("headers", {}))
+        response.not_modified = True
+        return response
+
+    def get(self, url, params=None, **kwargs):
+        """GET a URL, revalidating against the on-disk copy when there is one"""
+        if params:
+            url = requests.Request("GET", url, params=params).prepare().url
+        if not self.enabled:
+            response = http_get(url, **kwargs)
+            response.not_modified = False
+            return response
+
+        meta, body = self._load(url)
+        now = time.time()
+        if meta is not None and now - meta.get("fetched_at", 0) < self.ttl:
+            return self._cached_response(url, meta, body)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = http_get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and meta is not None:
+            meta["fetched_at"] = now
+            self._store(url, meta)
+            return self._cached_response(url, meta, body)
+
+        response.not_modified = False
+        if response.status_code == 200:
+            meta = {
+                "url": url,
+                "status": 200,
+                "fetched_at": now,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "encoding": response.encoding,
+                "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+            }
+            self._store(url, meta, response.content)
+        return response
+
+_cache = HttpCache()
+
+def configure_cache(directory=None, ttl=None, enabled=None):
+    """Change the settings of the shared HTTP cache"""
+    if directory is not None:
+        _cache.directory = directory
+    if ttl is not None:
+        _cache.ttl = ttl
+    if enabled is not None:
+        _cache.enabled = enabled
+
+def cached_get(url, params=None, **kwargs):
+    """
+    GET a URL through the shared on-disk HTTP cache
+
+    The response has not_modified set (False when the cache is disabled)
+    """
+    return _cache.get(url, params=params, **kwargs)
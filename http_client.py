@@ -0,0 +1,189 @@
+"""
+Shared HTTP client: one keep-alive session, per-host concurrency slots and
+adaptive rate limiting (see rate_limit.py) for every page and image request
+"""
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from rate_limit import get_rate_limiter, parse_retry_after, THROTTLE_STATUSES
+from metrics import record_event
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# Shared HTTP client settings (see configure_http)
+HTTP_TIMEOUT = (10, 30)      # (connect, read) seconds
+HTTP_RETRIES = 3             # retries on connection errors, 429 and 5xx
+HTTP_BACKOFF = 0.5           # backoff factor: 0.5s, 1s, 2s, ...
+HTTP_POOL_SIZE = 10          # keep-alive connections kept per host
+HTTP_MAX_PER_HOST = 4        # concurrent requests allowed per host
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+
+def configure_http(timeout=None, retries=None, max_per_host=None):
+    """Change the shared HTTP client settings; takes effect on the next request"""
+    global HTTP_TIMEOUT, HTTP_RETRIES, HTTP_MAX_PER_HOST, _session
+    with _session_lock:
+        if timeout is not None:
+            HTTP_TIMEOUT = timeout
+        if retries is not None:
+            HTTP_RETRIES = retries
+        if max_per_host is not None:
+            HTTP_MAX_PER_HOST = max_per_host
+            _host_slots.clear()
+        if _session is not None:
+            _session.close()
+            _session = None
+
+# Connection setup times of the request in progress on this thread (see _limited_get)
+_connection_timings = threading.local()
+
+class _TimedConnectionMixin:
+    def _new_conn(self):
+        # DNS lookup and TCP connect
+        started = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _connection_timings.connect = getattr(_connection_timings, "connect", 0.0) + time.perf_counter() - started
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        # Everything connect() does besides opening the socket is the TLS handshake
+        started = time.perf_counter()
+        opened_before = getattr(_connection_timings, "connect", 0.0)
+        super().connect()
+        opening = _connection_timings.connect - opened_before
+        _connection_timings.tls = getattr(_connection_timings, "tls", 0.0) + time.perf_counter() - started - opening
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections note their connect and TLS handshake times"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+def get_session():
+    """
+    Return the process-wide requests session
+
+    The session keeps a pool of keep-alive connections per host, so repeated
+    page and image fetches reuse TCP+TLS connections, and retries connection
+    errors and 500/502/504 responses with exponential backoff. 429 and 503
+    are retried by _limited_get instead, so the host's rate limiter sees them.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(500, 502, 504),
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=False,  # Retry-After is handled by the rate limiter
+                raise_on_status=False,
+            )
+            pool_size = max(HTTP_POOL_SIZE, HTTP_MAX_PER_HOST)
+            adapter = TimedHTTPAdapter(pool_connections=20, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _host_slot(url):
+    host = urlsplit(url).netloc
+    with _session_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+        return slot
+
+def _limited_get(url, params=None, timeout=None, **kwargs):
+    """
+    Send one GET, paced by the host's adaptive rate limiter (see rate_limit.py)
+
+    Every response feeds its status, latency and Retry-After back into the
+    limiter. 429 and 503 responses are retried here, after the limiter has
+    slowed down (or paused) the host for all threads.
+
+    Each attempt is recorded as a "fetch" event with its connect, TLS, TTFB
+    and transfer times (see metrics.py). Streamed responses carry those
+    timings as response.timings instead, and the caller records the event
+    once the body has been read.
+    """
+    limiter = get_rate_limiter(urlsplit(url).netloc)
+    stream = kwargs.get("stream", False)
+    for attempt in range(HTTP_RETRIES + 1):
+        if limiter:
+            limiter.acquire()
+        _connection_timings.connect = _connection_timings.tls = 0.0
+        started = time.monotonic()
+        try:
+            response = get_session().get(url, params=params, timeout=timeout or HTTP_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            if limiter:
+                limiter.record(None)
+            record_event("fetch", "error", url=url, error=type(e).__name__)
+            raise
+        total = time.monotonic() - started
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if limiter:
+            limiter.record(response.status_code, total, retry_after)
+
+        # response.elapsed runs until the headers were parsed, connection setup included
+        headers_at = response.elapsed.total_seconds()
+        connect, tls = _connection_timings.connect, _connection_timings.tls
+        response.timings = {"connect": connect, "tls": tls, "ttfb": max(0.0, headers_at - connect - tls)}
+        if not stream:
+            record_event("fetch", response.status_code, len(response.content), url=url,
+                         transfer=max(0.0, total - headers_at), **response.timings)
+        if response.status_code not in THROTTLE_STATUSES or attempt == HTTP_RETRIES:
+            return response
+        response.close()
+        if not limiter:
+            time.sleep(retry_after if retry_after is not None else HTTP_BACKOFF * 2 ** attempt)
+
+def http_get(url, params=None, timeout=None, **kwargs):
+    """
+    GET a URL through the shared session
+
+    Applies the default timeouts, waits for the host's rate limiter and holds
+    one of the host's concurrency slots for the duration of the request, so
+    parallel scrapers and download workers never have more than
+    HTTP_MAX_PER_HOST requests in flight per host.
+    """
+    with _host_slot(url):
+        return _limited_get(url, params=params, timeout=timeout, **kwargs)
+
+@contextmanager
+def http_stream(url, params=None, timeout=None, **kwargs):
+    """
+    Stream a response body through the shared session
+
+    The host's concurrency slot is held until the body has been consumed and
+    the connection is returned to the pool when the block exits.
+    """
+    with _host_slot(url):
+        response = _limited_get(url, params=params, timeout=timeout, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
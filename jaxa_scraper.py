@@ -1,308 +1,338 @@
-from utils import save_image_data, HEADERS
-import time
-import requests
-from bs4 import BeautifulSoup
+from utils import ImageRecord, http_get, absolute_url
+from sources import register_source, run_source, SourceLimitReached
+from http_cache import cached_get
+from checkpoint import CrawlProgress, load_checkpoint, save_checkpoint, clear_checkpoint
+from html_parser import make_soup, has_class
 import re
 
-def scrape_jaxa_images(force_redownload=False, recreate_overlays=False):
-    if recreate_overlays:
-        print("JAXA: Recreate overlays mode - skipping image scraping")
+# Use JAXA Digital Archives as the source
+ARCHIVE_URL = "https://jda.jaxa.jp/?lang=e"
+SEARCH_URL = "https://jda.jaxa.jp/search.php?lang=e"
+DEFAULT_DESC = "JAXA satellite or space mission image from JAXA Digital Archives."
+MAX_IMAGES = 20  # Set a limit on total images to download
+OUTDIR = "jaxa_images"
+JAXA_ROOT = "https://jda.jaxa.jp/"
+
+def jaxa_url(href):
+    """Make a root- or page-relative link on the archive absolute"""
+    return absolute_url(href, JAXA_ROOT)
+
+def parse_jaxa_landing(soup):
+    """
+    Find category/gallery links and content images on the archive landing page
+
+    Returns:
+        Tuple of (list of category URLs, list of image dicts with url/title/desc)
+    """
+    # Look for category links - these might lead to image galleries
+    categories = []
+
+    # Try to find the category containers
+    category_divs = soup.select('.category') or soup.select('[class*="category"]') or soup.select('.CATEGORY')
+
+    if category_divs:
+        for div in category_divs:
+            link = div.find('a')
+            if link and link.get('href'):
+                categories.append(jaxa_url(link.get('href')))
+
+    # If no categories found, try looking for cards or image containers
+    if not categories:
+        # Try to find featured images or PICK UP section
+        pickup_links = soup.select('.pickup a') or soup.select('[class*="pick"] a') or soup.select('#PICK_UP a')
+        if pickup_links:
+            for link in pickup_links:
+                href = link.get('href')
+                if href:
+                    categories.append(jaxa_url(href))
+
+    # If still no categories, check for any image links
+    if not categories:
+        image_links = []
+        all_links = soup.find_all('a')
+        for link in all_links:
+            href = link.get('href', '')
+            # Look for links that likely lead to images
+            if href and ('detail' in href.lower() or 'photo' in href.lower() or 'image' in href.lower()):
+                image_links.append(jaxa_url(href))
+
+        categories = image_links
+
+    # Look for images directly on the main page
+    main_page_images = []
+    img_tags = soup.find_all('img')
+    for img in img_tags:
+        src = img.get('src', '')
+        # Skip logos, icons, buttons
+        if src and not ('logo' in src.lower() or 'icon' in src.lower() or 'button' in src.lower()):
+            # Check if it's a content image (larger than icons)
+            width = img.get('width', '')
+            height = img.get('height', '')
+            if (not width or int(width) > 150) and (not height or int(height) > 150):
+                src = jaxa_url(src)
+
+                # Get caption/title from alt or parent elements
+                title = img.get('alt', '') or (img.parent.get_text().strip() if img.parent else '')
+                if not title:
+                    # Check if there's a nearby caption
+                    caption = img.find_next('figcaption') or img.find_next('div', class_='caption')
+                    if caption:
+                        title = caption.get_text().strip()
+
+                if not title:
+                    title = f"JAXA Archive Image {len(main_page_images) + 1}"
+
+                main_page_images.append({
+                    'url': src,
+                    'title': title,
+                    'desc': "JAXA satellite or space mission image."
+                })
+    return categories, main_page_images
+
+def parse_jaxa_category(category_soup):
+    """
+    Find the images on a category/gallery page
+
+    Returns:
+        List of image dicts with url/detail_url/title/desc. detail_url is set when
+        the thumbnail links to a detail page that may hold a larger image, and
+        title is empty when the page gives no usable title.
+    """
+    items = []
+
+    # Look for content images in the category page
+    img_containers = category_soup.select('.img-container') or category_soup.select('.photo') or category_soup.select('.image') or category_soup.select('figure')
+
+    if not img_containers:
+        # If no containers found, look for img tags directly
+        img_containers = category_soup.find_all('img')
+
+    print(f"Found {len(img_containers)} potential image containers")
+
+    for container in img_containers:
+        # If the container itself is an img tag
+        if container.name == 'img':
+            img = container
+        else:
+            img = container.find('img')
+
+        if not img or not img.get('src'):
+            continue
+
+        img_url = jaxa_url(img.get('src'))
+        detail_url = None
+
+        # Check if this is a thumbnail and there's a link to a larger image
+        parent_link = img.find_parent('a')
+        if parent_link and parent_link.get('href'):
+            href = parent_link.get('href')
+            # Check if link points to a full-size image
+            if href.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
+                img_url = jaxa_url(href)
+            # Or if it's a link to a detail page
+            elif 'detail' in href.lower() or 'photo' in href.lower():
+                detail_url = jaxa_url(href)
+
+        # Get title from alt text, figcaption, or parent text
+        title = img.get('alt', '')
+        if not title:
+            # Check for caption
+            figcaption = container.find('figcaption') if container.name != 'img' else None
+            if figcaption:
+                title = figcaption.get_text().strip()
+            else:
+                title_tag = container.find('h2') or container.find('h3') or container.find('div', class_='title')
+                if title_tag:
+                    title = title_tag.get_text().strip()
+
+        # Get description
+        desc_elem = container.find('p', class_='description') or container.find('div', class_='description')
+        if desc_elem:
+            desc = desc_elem.get_text().strip()
+        else:
+            # Use default description
+            desc = DEFAULT_DESC
+
+        items.append({'url': img_url, 'detail_url': detail_url, 'title': title, 'desc': desc})
+    return items
+
+def keep_jaxa_detail(name, attrs):
+    """Detail pages only need the full-size image containers"""
+    return name == "figure" or has_class(attrs, "full-image") or has_class(attrs, "detail-image")
+
+def parse_jaxa_detail(detail_soup):
+    """Return the full-size image URL from a detail page, or None"""
+    # Look for the full-size image
+    detail_img = detail_soup.select_one('.full-image img') or detail_soup.select_one('.detail-image img') or detail_soup.select_one('figure img')
+
+    if detail_img and detail_img.get('src'):
+        return jaxa_url(detail_img.get('src'))
+    return None
+
+@register_source("JAXA", OUTDIR, limit=MAX_IMAGES, hosts={"jda.jaxa.jp": (0.2, 2.0)})
+def jaxa_records(force_redownload=False, backend="sync", resume=False, **options):
+    """
+    Yield images from the JAXA Digital Archives
+
+    The runner stops pulling once MAX_IMAGES images have been saved, which
+    completes the crawl like reaching its end.
+
+    Args:
+        force_redownload: Whether to re-download existing images
+        backend: "sync" or "async" fetching engine
+        resume: Continue at the category an interrupted run had reached (sync only)
+    """
+    if backend == "async":
+        if resume:
+            print("JAXA: --resume is only supported by the sync backend, starting from the beginning")
+        from async_engine import iter_async_records, scrape_jaxa_async
+        try:
+            yield from iter_async_records(scrape_jaxa_async)
+        except SourceLimitReached:
+            pass
         return
-        
+
     print("Scraping JAXA Digital Archives...")
-    
-    # Use JAXA Digital Archives as the source
-    jaxa_archive_url = "https://jda.jaxa.jp/?lang=e"
-    downloaded_count = 0
-    max_images = 20  # Set a limit on total images to download
-    
+
+    found_count = 0
+
+    # A checkpoint is saved once the main page is done and after every
+    # category, holding the next category to visit and the number of images
+    # saved so far (the runner's limit counts them); the records of the page
+    # must have been saved first
+    progress = CrawlProgress()
+    state = load_checkpoint("jaxa") if resume else None
+    start_category = 0
+    downloaded_before = 0
+    if state:
+        start_category = state["category_index"]
+        downloaded_before = state.get("downloaded_count", 0)
+        print(f"JAXA: resuming at category {start_category + 1} ({downloaded_before} images already saved)")
+
+    def checkpoint(category_index):
+        progress.wait()
+        save_checkpoint("jaxa", {"category_index": category_index, "downloaded_count": downloaded_before + progress.new})
+
     try:
         # Access the main page
-        response = requests.get(jaxa_archive_url, headers=HEADERS)
+        response = cached_get(ARCHIVE_URL)
         if response.status_code != 200:
             print(f"Failed to access JAXA Digital Archives: {response.status_code}")
             return
-        
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Look for category links - these might lead to image galleries
-        categories = []
-        
-        # Try to find the category containers
-        category_divs = soup.select('.category') or soup.select('[class*="category"]') or soup.select('.CATEGORY')
-        
-        if category_divs:
-            for div in category_divs:
-                link = div.find('a')
-                if link and link.get('href'):
-                    href = link.get('href')
-                    # Make sure we have an absolute URL
-                    if not href.startswith('http'):
-                        # Check if it's a root-relative URL or page-relative URL
-                        if href.startswith('/'):
-                            href = "https://jda.jaxa.jp" + href
-                        else:
-                            href = "https://jda.jaxa.jp/" + href
-                    categories.append(href)
-        
-        # If no categories found, try looking for cards or image containers
-        if not categories:
-            # Try to find featured images or PICK UP section
-            pickup_links = soup.select('.pickup a') or soup.select('[class*="pick"] a') or soup.select('#PICK_UP a')
-            if pickup_links:
-                for link in pickup_links:
-                    href = link.get('href')
-                    if href:
-                        # Make sure we have an absolute URL
-                        if not href.startswith('http'):
-                            if href.startswith('/'):
-                                href = "https://jda.jaxa.jp" + href
-                            else:
-                                href = "https://jda.jaxa.jp/" + href
-                        categories.append(href)
-        
-        # If still no categories, check for any image links
-        if not categories:
-            image_links = []
-            all_links = soup.find_all('a')
-            for link in all_links:
-                href = link.get('href', '')
-                # Look for links that likely lead to images
-                if href and ('detail' in href.lower() or 'photo' in href.lower() or 'image' in href.lower()):
-                    # Make sure we have an absolute URL
-                    if not href.startswith('http'):
-                        if href.startswith('/'):
-                            href = "https://jda.jaxa.jp" + href
-                        else:
-                            href = "https://jda.jaxa.jp/" + href
-                    
-                    image_links.append(href)
-                    
-            categories = image_links
-        
-        # Look for images directly on the main page
-        main_page_images = []
-        img_tags = soup.find_all('img')
-        for img in img_tags:
-            src = img.get('src', '')
-            # Skip logos, icons, buttons
-            if src and not ('logo' in src.lower() or 'icon' in src.lower() or 'button' in src.lower()):
-                # Check if it's a content image (larger than icons)
-                width = img.get('width', '')
-                height = img.get('height', '')
-                if (not width or int(width) > 150) and (not height or int(height) > 150):
-                    if not src.startswith('http'):
-                        if src.startswith('/'):
-                            src = "https://jda.jaxa.jp" + src
-                        else:
-                            src = "https://jda.jaxa.jp/" + src
-                    
-                    # Get caption/title from alt or parent elements
-                    title = img.get('alt', '') or (img.parent.get_text().strip() if img.parent else '')
-                    if not title:
-                        # Check if there's a nearby caption
-                        caption = img.find_next('figcaption') or img.find_next('div', class_='caption')
-                        if caption:
-                            title = caption.get_text().strip()
-                    
-                    if not title:
-                        title = f"JAXA Archive Image {len(main_page_images) + 1}"
-                    
-                    main_page_images.append({
-                        'url': src,
-                        'title': title,
-                        'desc': "JAXA satellite or space mission image."
-                    })
-        
+
+        soup = make_soup(response.content)
+        categories, main_page_images = parse_jaxa_landing(soup)
+
+        # The main page images were already handled by the interrupted run
+        if state is not None:
+            main_page_images = []
+
         # Process direct images from main page first
         for img_data in main_page_images:
-            if downloaded_count >= max_images:
-                break
-                
-            try:
-                print(f"Processing JAXA image: {img_data['title']}")
-                if save_image_data("JAXA", img_data['title'], img_data['url'], img_data['desc'], "jaxa_images", force_redownload, recreate_overlays):
-                    downloaded_count += 1
-                time.sleep(1)
-            except Exception as e:
-                print(f"Error processing main page image: {e}")
-        
+            print(f"Processing JAXA image: {img_data['title']}")
+            found_count += 1
+            yield ImageRecord("JAXA", img_data['title'], img_data['url'], img_data['desc'], OUTDIR,
+                              progress.track(img_data['url']))
+        checkpoint(start_category)
+
         # Now go through category/gallery pages
         for idx, category_url in enumerate(categories):
-            if downloaded_count >= max_images:
-                break
-                
+            if idx < start_category:
+                continue
+
             try:
                 print(f"Accessing category/gallery page: {category_url}")
-                category_response = requests.get(category_url, headers=HEADERS)
+                category_response = cached_get(category_url)
                 if category_response.status_code != 200:
                     print(f"Failed to access category page: {category_response.status_code}")
                     continue
-                
-                category_soup = BeautifulSoup(category_response.content, "html.parser")
-                
-                # Look for content images in the category page
-                img_containers = category_soup.select('.img-container') or category_soup.select('.photo') or category_soup.select('.image') or category_soup.select('figure')
-                
-                if not img_containers:
-                    # If no containers found, look for img tags directly
-                    img_containers = category_soup.find_all('img')
-                    
-                print(f"Found {len(img_containers)} potential image containers")
-                
-                for container in img_containers:
-                    if downloaded_count >= max_images:
-                        break
-                        
-                    try:
-                        # If the container itself is an img tag
-                        if container.name == 'img':
-                            img = container
-                        else:
-                            img = container.find('img')
-                            
-                        if not img or not img.get('src'):
-                            continue
-                            
-                        img_url = img.get('src')
-                        # Make absolute URL if needed
-                        if not img_url.startswith('http'):
-                            if img_url.startswith('/'):
-                                img_url = "https://jda.jaxa.jp" + img_url
-                            else:
-                                img_url = "https://jda.jaxa.jp/" + img_url
-                        
-                        # Check if this is a thumbnail and there's a link to a larger image
-                        parent_link = img.find_parent('a')
-                        if parent_link and parent_link.get('href'):
-                            href = parent_link.get('href')
-                            # Check if link points to a full-size image
-                            if href.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                                if not href.startswith('http'):
-                                    if href.startswith('/'):
-                                        href = "https://jda.jaxa.jp" + href
-                                    else:
-                                        href = "https://jda.jaxa.jp/" + href
-                                img_url = href
-                            # Or if it's a link to a detail page
-                            elif 'detail' in href.lower() or 'photo' in href.lower():
-                                try:
-                                    if not href.startswith('http'):
-                                        if href.startswith('/'):
-                                            href = "https://jda.jaxa.jp" + href
-                                        else:
-                                            href = "https://jda.jaxa.jp/" + href
-                                            
-                                    # Follow link to detail page
-                                    detail_response = requests.get(href, headers=HEADERS)
-                                    if detail_response.status_code == 200:
-                                        detail_soup = BeautifulSoup(detail_response.content, "html.parser")
-                                        
-                                        # Look for the full-size image
-                                        detail_img = detail_soup.select_one('.full-image img') or detail_soup.select_one('.detail-image img') or detail_soup.select_one('figure img')
-                                        
-                                        if detail_img and detail_img.get('src'):
-                                            full_img_url = detail_img.get('src')
-                                            if not full_img_url.startswith('http'):
-                                                if full_img_url.startswith('/'):
-                                                    full_img_url = "https://jda.jaxa.jp" + full_img_url
-                                                else:
-                                                    full_img_url = "https://jda.jaxa.jp/" + full_img_url
-                                            img_url = full_img_url
-                                except Exception as e:
-                                    print(f"Error following detail link: {e}")
-                        
-                        # Get title from alt text, figcaption, or parent text
-                        title = img.get('alt', '')
-                        if not title:
-                            # Check for caption
-                            figcaption = container.find('figcaption') if container.name != 'img' else None
-                            if figcaption:
-                                title = figcaption.get_text().strip()
-                            else:
-                                title_tag = container.find('h2') or container.find('h3') or container.find('div', class_='title')
-                                if title_tag:
-                                    title = title_tag.get_text().strip()
-                        
-                        if not title:
-                            title = f"JAXA Space Image {downloaded_count + 1}"
-                            
-                        # Get description
-                        desc = ""
-                        desc_elem = container.find('p', class_='description') or container.find('div', class_='description')
-                        if desc_elem:
-                            desc = desc_elem.get_text().strip()
-                        else:
-                            # Use default description
-                            desc = "JAXA satellite or space mission image from JAXA Digital Archives."
-                        
-                        print(f"Processing JAXA image: {title}")
-                        if save_image_data("JAXA", title, img_url, desc, "jaxa_images", force_redownload, recreate_overlays):
-                            downloaded_count += 1
-                        time.sleep(1)
-                    except Exception as e:
-                        print(f"Error processing image container: {e}")
+
+                category_soup = make_soup(category_response.content)
+                items = parse_jaxa_category(category_soup)
             except Exception as e:
                 print(f"Error accessing category {idx+1}: {e}")
-                
+                items = []
+
+            for item in items:
+                img_url = item['url']
+                if item['detail_url']:
+                    try:
+                        # Follow link to detail page
+                        detail_response = http_get(item['detail_url'])
+                        if detail_response.status_code == 200:
+                            detail_soup = make_soup(detail_response.content, keep_jaxa_detail)
+                            img_url = parse_jaxa_detail(detail_soup) or img_url
+                    except Exception as e:
+                        print(f"Error following detail link: {e}")
+
+                title = item['title'] or f"JAXA Space Image {found_count + 1}"
+
+                print(f"Processing JAXA image: {title}")
+                found_count += 1
+                yield ImageRecord("JAXA", title, img_url, item['desc'], OUTDIR, progress.track(img_url))
+            checkpoint(idx + 1)
+
         # If we still don't have enough images, try a generic approach
-        if downloaded_count < 5:
+        if found_count < 5:
             print("Trying additional image search across the site...")
-            
+
             # Search for other images that might be higher quality
-            search_url = "https://jda.jaxa.jp/search.php?lang=e"
+            search_results = []
             try:
-                search_response = requests.get(search_url, headers=HEADERS)
+                search_response = http_get(SEARCH_URL)
                 if search_response.status_code == 200:
-                    search_soup = BeautifulSoup(search_response.content, "html.parser")
-                    
+                    search_soup = make_soup(search_response.content)
+
                     # Look for search results or featured content
                     search_results = search_soup.select('.search-result') or search_soup.select('.result-item') or search_soup.select('.gallery-item')
-                    
-                    if search_results:
-                        print(f"Found {len(search_results)} search results")
-                        
-                        for result in search_results:
-                            if downloaded_count >= max_images:
-                                break
-                                
-                            try:
-                                # Find the image
-                                img = result.find('img')
-                                if not img or not img.get('src'):
-                                    continue
-                                    
-                                img_url = img.get('src')
-                                if not img_url.startswith('http'):
-                                    if img_url.startswith('/'):
-                                        img_url = "https://jda.jaxa.jp" + img_url
-                                    else:
-                                        img_url = "https://jda.jaxa.jp/" + img_url
-                                
-                                # Check for title
-                                title_elem = result.find('h3') or result.find('h4') or result.find('div', class_='title')
-                                title = title_elem.get_text().strip() if title_elem else img.get('alt', '')
-                                
-                                if not title:
-                                    title = f"JAXA Space Image {downloaded_count + 1}"
-                                
-                                # Description
-                                desc_elem = result.find('p', class_='description') or result.find('div', class_='description')
-                                desc = desc_elem.get_text().strip() if desc_elem else "JAXA satellite or space mission image from JAXA Digital Archives."
-                                
-                                print(f"Processing JAXA image: {title}")
-                                if save_image_data("JAXA", title, img_url, desc, "jaxa_images", force_redownload, recreate_overlays):
-                                    downloaded_count += 1
-                                time.sleep(1)
-                            except Exception as e:
-                                print(f"Error processing search result: {e}")
             except Exception as e:
                 print(f"Error with search approach: {e}")
-    
+
+            if search_results:
+                print(f"Found {len(search_results)} search results")
+
+            for result in search_results:
+                try:
+                    # Find the image
+                    img = result.find('img')
+                    if not img or not img.get('src'):
+                        continue
+
+                    img_url = jaxa_url(img.get('src'))
+
+                    # Check for title
+                    title_elem = result.find('h3') or result.find('h4') or result.find('div', class_='title')
+                    title = title_elem.get_text().strip() if title_elem else img.get('alt', '')
+
+                    if not title:
+                        title = f"JAXA Space Image {found_count + 1}"
+
+                    # Description
+                    desc_elem = result.find('p', class_='description') or result.find('div', class_='description')
+                    desc = desc_elem.get_text().strip() if desc_elem else DEFAULT_DESC
+                except Exception as e:
+                    print(f"Error processing search result: {e}")
+                    continue
+
+                print(f"Processing JAXA image: {title}")
+                found_count += 1
+                yield ImageRecord("JAXA", title, img_url, desc, OUTDIR, progress.track(img_url))
+
+    except SourceLimitReached:
+        pass  # the crawl is complete
     except Exception as e:
         print(f"Error accessing JAXA Digital Archives: {e}")
-    
-    if downloaded_count == 0:
-        print("No JAXA images found or all images already exist. Website structure may have changed.")
+
+    progress.wait()
+    clear_checkpoint("jaxa")
+    if found_count == 0:
+        print("No JAXA images found. Website structure may have changed.")
     else:
-        print(f"JAXA scraping complete - downloaded {downloaded_count} images") 
\ No newline at end of file
+        print(f"JAXA scraping complete - found {found_count} images")
+
+def scrape_jaxa_images(force_redownload=False, recreate_overlays=False, backend="sync", resume=False):
+    """Scrape JAXA on its own through the shared source runner (see jaxa_records)"""
+    if recreate_overlays:
+        print("JAXA: Recreate overlays mode - skipping image scraping")
+        return
+    return run_source("JAXA", force_redownload=force_redownload, backend=backend, resume=resume)
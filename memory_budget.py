@@ -0,0 +1,166 @@
+"""
+Memory budget for decoded images
+
+Rendering an overlay holds the decoded original, its RGB conversion (unless
+it was decoded as RGB), the composited band at the top and the derivatives,
+all at once. A 50-megapixel original needs hundreds of megabytes for that,
+and several renders at the same time can exhaust the machine.
+
+With a budget configured (configure_memory_budget), every render first
+estimates what it will hold from the image header (plan_render) and
+reserves that much of the budget for its duration, so concurrent renders
+never hold more than the budget between them. An image that does not fit
+into the budget even on its own is decoded at reduced size: JPEGs are
+decoded at 1/2, 1/4 or 1/8 scale by the decoder itself (Pillow's draft
+mode), so the full-size frame never exists in memory. Other formats have no
+reduced decode; they are decoded in full but only once nothing else holds
+any of the budget.
+
+Callers with many workers (pipeline.py, utils.regenerate_overlays) send
+jobs costing more than a worker's share of the budget to a separate queue,
+run once enough of the budget is free, so small images do not wait behind
+them.
+"""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from PIL import Image
+
+BYTES_PER_PIXEL = 4          # Pillow keeps RGB, RGBA and CMYK pixels in 4 bytes
+SMALL_MODES = ("1", "L", "P")  # one byte per pixel
+JPEG_SCALES = (1, 2, 4, 8)   # reductions the JPEG decoder can do itself
+MAX_BAND_ROWS = 720          # tallest description box (OVERLAY_SETTINGS allow about 28 lines)
+
+# cost: estimated bytes held while rendering
+# scale: reduction to decode at (1 = full size)
+# max_dimension: longest side to decode to, or None for the full size
+RenderPlan = namedtuple("RenderPlan", ["cost", "scale", "max_dimension"])
+
+def render_cost(width, height, mode="RGB"):
+    """Bytes of pixel buffers a render of an image of this size holds at its peak"""
+    decoded = width * height * (1 if mode in SMALL_MODES else BYTES_PER_PIXEL)
+    converted = 0 if mode == "RGB" else width * height * BYTES_PER_PIXEL
+    # The band is cropped, converted to RGBA, composited and converted back
+    band = width * min(height // 4, MAX_BAND_ROWS) * BYTES_PER_PIXEL * 3
+    return decoded + converted + band
+
+class MemoryBudget:
+    """
+    Bytes of pixel buffers that concurrent renders may hold between them
+
+    A reservation larger than the whole budget is granted once nothing else
+    is held, so an oversized image still renders, alone. Priority
+    reservations (the deferred queue) stop new ordinary reservations while
+    they wait, so a steady stream of small images cannot starve them.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self._priority_waiting = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.limit is None or self.used == 0 or self.used + nbytes <= self.limit
+
+    def oversized(self, nbytes, share=1):
+        """True if a job needs more than 1/share of the budget and should be deferred"""
+        return self.limit is not None and nbytes > self.limit / max(1, share)
+
+    def reserve(self, nbytes, priority=False):
+        """Block until nbytes can be held"""
+        with self._condition:
+            if priority:
+                self._priority_waiting += 1
+            try:
+                while not self._fits(nbytes) or (self._priority_waiting and not priority):
+                    self._condition.wait()
+                self.used += nbytes
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+                    self._condition.notify_all()
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self, nbytes, priority=False):
+        """Hold nbytes of the budget for the duration of the block"""
+        self.reserve(nbytes, priority)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def plan(self, width, height, mode="RGB", jpeg=False, min_scale=1):
+        """
+        Decide how to decode an image so its render fits into the budget
+
+        Args:
+            min_scale: Reduction the caller asks for anyway (JPEGs only)
+
+        Returns:
+            RenderPlan; JPEGs too large for the whole budget get the smallest
+            decoder reduction that fits (at most 1/8)
+        """
+        if not jpeg:
+            return RenderPlan(render_cost(width, height, mode), 1, None)
+        for scale in JPEG_SCALES:
+            if scale < min_scale:
+                continue
+            # The decoder rounds reduced sizes up
+            cost = render_cost(-(-width // scale), -(-height // scale), mode)
+            if self.limit is None or cost <= self.limit:
+                break
+        if scale == 1:
+            return RenderPlan(cost, 1, None)
+        # Asking draft mode for exactly width // scale makes it pick this scale
+        return RenderPlan(cost, scale, max(width, height) // scale)
+
+_budget = MemoryBudget()
+
+def get_memory_budget():
+    """Return the process-wide MemoryBudget"""
+    return _budget
+
+def plan_render(img_path, max_dimension=None):
+    """
+    Plan the render of an image file from its header, without decoding it
+
+    Args:
+        max_dimension: Longest side the caller will downscale to anyway
+            (OVERLAY_SETTINGS["max_dimension"]); JPEGs are reduced at least
+            this much by the decoder, so the plan is costed at that size
+    """
+    with Image.open(img_path) as img:
+        width, height = img.size
+        mode = img.mode
+        jpeg = img.format == "JPEG"
+    min_scale = 1
+    if max_dimension and jpeg:
+        # Draft mode decodes at the largest 1/2^n scale still at least max_dimension
+        min_scale = max(s for s in JPEG_SCALES if max(width, height) / s >= max_dimension or s == 1)
+    plan = _budget.plan(width, height, mode, jpeg, min_scale)
+    if plan.max_dimension is None or (max_dimension and max_dimension < plan.max_dimension):
+        return plan._replace(max_dimension=max_dimension)
+    return plan
+
+def configure_memory_budget(limit_mb=None, max_image_pixels=None):
+    """
+    Set the memory budget and the largest image Pillow will open
+
+    Args:
+        limit_mb: Megabytes of pixel buffers all renders may hold at once
+            (None: no budget)
+        max_image_pixels: Refuse to open images with more pixels than this,
+            as a guard against decompression bombs. Pillow warns above
+            Image.MAX_IMAGE_PIXELS and refuses above twice that, so it is
+            set to half of this value. None keeps Pillow's default (about
+            179 million pixels); the check is never switched off.
+    """
+    _budget.limit = int(limit_mb * 1024 * 1024) if limit_mb else None
+    if max_image_pixels:
+        Image.MAX_IMAGE_PIXELS = max(1, max_image_pixels // 2)
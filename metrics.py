@@ -0,0 +1,232 @@
+"""
+Structured metrics for every fetch, download and overlay render
+
+Code that does the work reports one event per request or image with
+record_event(): its kind, status, size and how long each phase took. Events
+are turned into Prometheus-style counters and histograms, optionally written
+to a JSON-lines log as they happen, and summed per agency for the table
+printed at the end of a run, which shows where the time went.
+
+Phases, in seconds:
+    connect    DNS lookup and TCP connect (0 when a pooled connection is reused)
+    tls        TLS handshake
+    ttfb       request sent until the response headers arrived
+    transfer   reading the response body
+    write      writing a download to disk
+    decode     opening and decoding an original with Pillow
+    composite  drawing and compositing the text overlay
+    derive     scaling and encoding the web derivatives (see utils.create_derivatives)
+    encode     encoding and saving the overlay
+
+Events are labelled with the agency set by agency() on the current thread;
+the source runner and the image pipeline set it, so scrapers need not.
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRIC_PREFIX = "space_images"
+PHASES = ("connect", "tls", "ttfb", "transfer", "write", "decode", "composite", "derive", "encode")
+# Histogram bucket upper bounds in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_context = threading.local()
+_thread_agencies = {}  # thread ident -> agency, for code looking at other threads (profiling.py)
+
+@contextmanager
+def agency(name):
+    """Label the events recorded on this thread inside the block with an agency"""
+    previous = getattr(_context, "agency", None)
+    thread_id = threading.get_ident()
+    _context.agency = name
+    _thread_agencies[thread_id] = name
+    try:
+        yield
+    finally:
+        _context.agency = previous
+        if previous is None:
+            _thread_agencies.pop(thread_id, None)
+        else:
+            _thread_agencies[thread_id] = previous
+
+def current_agency():
+    return getattr(_context, "agency", None)
+
+def agency_of_thread(thread_id):
+    """The agency another thread is currently working for, or None"""
+    return _thread_agencies.get(thread_id)
+
+@contextmanager
+def timed(timings, phase):
+    """Add the duration of the block to timings[phase]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+class Metrics:
+    """
+    Counters, histograms and per-agency totals built from events
+
+    Counters and histograms are keyed by metric name and a sorted tuple of
+    label pairs, as in the Prometheus data model.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.agencies = {}
+        self.log = None
+        self._lock = threading.Lock()
+
+    def open_log(self, path):
+        """Append every event to a JSON-lines file from now on"""
+        with self._lock:
+            if self.log is not None:
+                self.log.close()
+            self.log = open(path, "a", encoding="utf-8", buffering=1)
+
+    def close(self):
+        with self._lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def _inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # One count per bucket, then the sum and count of all observations
+            histogram = self.histograms[key] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def count(self, name, value=1, **labels):
+        """Increase a counter that is not tied to a request or image, e.g. images skipped"""
+        labels.setdefault("agency", current_agency() or "-")
+        with self._lock:
+            self._inc(name, labels, value)
+
+    def record(self, kind, status=None, size=None, **fields):
+        """
+        Record one event
+
+        Args:
+            kind: "fetch" (a page or API response), "download" (an image) or "overlay"
+            status: HTTP status code, "error", or None for local work
+            size: Bytes transferred or written
+            fields: Phase timings in seconds (see PHASES) and any other
+                details to log, e.g. url or path
+        """
+        name = fields.pop("agency", None) or current_agency() or "-"
+        event = {"time": round(time.time(), 3), "kind": kind, "agency": name}
+        if status is not None:
+            event["status"] = status
+        if size is not None:
+            event["bytes"] = size
+        event.update({key: round(value, 6) if key in PHASES else value for key, value in fields.items()})
+
+        with self._lock:
+            labels = {"agency": name, "kind": kind}
+            self._inc("events_total", dict(labels, status=str(status if status is not None else "ok")))
+            if size:
+                self._inc("bytes_total", labels, size)
+            totals = self.agencies.setdefault(name, {})
+            totals[kind] = totals.get(kind, 0) + 1
+            totals["bytes"] = totals.get("bytes", 0) + (size or 0)
+            if isinstance(status, int) and status >= 400 or status == "error":
+                totals["errors"] = totals.get("errors", 0) + 1
+            for phase in PHASES:
+                if phase in fields:
+                    self._observe("phase_seconds", {"agency": name, "phase": phase}, fields[phase])
+                    totals[phase] = totals.get(phase, 0.0) + fields[phase]
+            if self.log is not None:
+                self.log.write(json.dumps(event) + "\n")
+
+    def prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for (metric, labels), value in counters:
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}_{name}{label_text(labels)} {value}")
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    continue
+                # Bucket counts are cumulative already: an observation counts in every bucket it fits
+                for bound, bucket_count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{label_text(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{METRIC_PREFIX}_{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram[-1]}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{label_text(labels)} {histogram[-2]:.6f}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{label_text(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file, e.g. for node_exporter's textfile collector"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+
+    def summary(self):
+        """
+        Per-agency table of fetches, downloads, overlays, bytes and seconds spent per phase
+
+        The last column names the phase that took the most time, which is
+        where a slow run should be looked at first.
+        """
+        with self._lock:
+            agencies = {name: dict(totals) for name, totals in self.agencies.items()}
+        if not agencies:
+            return "No metrics recorded"
+
+        header = (f"{'Agency':<10}{'fetches':>8}{'images':>8}{'overlays':>9}{'MB':>9}{'errors':>7}"
+                  + "".join(f"{phase:>10}" for phase in PHASES) + "  bottleneck")
+        lines = [header, "-" * len(header)]
+        for name in sorted(agencies):
+            totals = agencies[name]
+            phase_times = {phase: totals.get(phase, 0.0) for phase in PHASES}
+            slowest = max(phase_times, key=phase_times.get)
+            lines.append(
+                f"{name:<10}{totals.get('fetch', 0):>8}{totals.get('download', 0):>8}{totals.get('overlay', 0):>9}"
+                f"{totals.get('bytes', 0) / 1e6:>9.1f}{totals.get('errors', 0):>7}"
+                + "".join(f"{phase_times[phase]:>9.2f}s" for phase in PHASES)
+                + (f"  {slowest}" if phase_times[slowest] else "")
+            )
+        return "\n".join(lines)
+
+_metrics = Metrics()
+
+def get_metrics():
+    """Return the process-wide Metrics"""
+    return _metrics
+
+def record_event(kind, status=None, size=None, **fields):
+    """Record one fetch, download or overlay event on the shared Metrics (see Metrics.record)"""
+    _metrics.record(kind, status, size, **fields)
+
+def count(name, value=1, **labels):
+    """Increase a counter on the shared Metrics (see Metrics.count)"""
+    _metrics.count(name, value, **labels)
+
+def configure_metrics(log_path=None):
+    """Start writing events to a JSON-lines log"""
+    if log_path:
+        _metrics.open_log(log_path)
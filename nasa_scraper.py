@@ -1,33 +1,285 @@
-from utils import save_image_data, HEADERS
-import time
-import requests
+from utils import ImageRecord, http_get
+from sources import register_source, run_source
+from http_cache import cached_get
+from checkpoint import (
+    CrawlProgress, load_checkpoint, save_checkpoint, clear_checkpoint, load_known_items, save_known_items,
+)
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import datetime
 import traceback
 import random
 
-def scrape_nasa_images(force_redownload=False, recreate_overlays=False):
-    if recreate_overlays:
-        print("NASA: Recreate overlays mode - skipping image scraping")
+OUTDIR = "nasa_images"
+
+# NASA now has a dedicated Images API we can use instead of scraping
+API_URL = "https://images-api.nasa.gov/search"
+
+# Search queries to pick from randomly, or to page through completely when harvesting
+SEARCH_QUERIES = [
+    "earth OR planet OR space",
+    "moon OR mars OR jupiter",
+    "galaxy OR nebula OR stars",
+    "spacecraft OR astronaut",
+    "asteroid OR comet OR meteor"
+]
+
+# The API stops at 10,000 results per search, so harvests split each query
+# into year ranges; None as the end year means "up to now"
+HARVEST_YEAR_RANGES = [(2000, 2009), (2010, 2019), (2020, None)]
+HARVEST_PAGE_SIZE = 100
+HARVEST_MAX_PAGES = 100
+HARVEST_WORKERS = 4
+
+# Rendition suffixes from the asset manifest, best first
+RENDITION_PREFERENCE = ["~large", "~orig", "~medium", "~small"]
+
+def parse_nasa_item(item):
+    """
+    Extract the title, description and image URL from a search result item
+
+    Only the links embedded in the search response are used; see
+    resolve_rendition() for items that only link a small preview.
+
+    Returns:
+        Tuple of (title, description, image URL), or None if there is no image
+    """
+    if "data" not in item or not item["data"]:
+        print("Missing data in item")
+        return None
+
+    metadata = item["data"][0]
+    title = metadata.get("title", "Untitled NASA Image")
+    desc = metadata.get("description", "No description available")
+
+    # If the description is too short, add the keywords
+    if len(desc) < 50 and "keywords" in metadata:
+        keywords = metadata.get("keywords", [])
+        if isinstance(keywords, list):
+            desc += " | Keywords: " + ", ".join(keywords)
+
+    # Get the image URL - we need to find the image link in the links array
+    if "links" not in item or not item["links"]:
+        print(f"No links found for {title}")
+        return None
+
+    # First try to find a large image
+    img_url = None
+    for link in item["links"]:
+        if "href" not in link:
+            continue
+
+        if "render" in link and link["render"] == "image":
+            img_url = link["href"]
+            # If we find a large version, prefer it
+            if "large" in link["href"]:
+                img_url = link["href"]
+                break
+
+    # If we didn't find a render:image link, fall back to first image link
+    if not img_url and len(item["links"]) > 0:
+        img_url = item["links"][0].get("href")
+
+    if not img_url:
+        print(f"No image URL found for {title}")
+        return None
+
+    # Sometimes NASA API returns http URLs, convert to https
+    if img_url.startswith("http://"):
+        img_url = "https://" + img_url[7:]
+    return title, desc, img_url
+
+def nasa_item_id(item):
+    return (item.get("data") or [{}])[0].get("nasa_id") or item.get("href")
+
+def pick_rendition(urls):
+    """Choose the best image from an asset manifest's list of URLs"""
+    images = [url for url in urls if url.lower().endswith((".jpg", ".jpeg", ".png", ".tif", ".tiff"))]
+    for suffix in RENDITION_PREFERENCE:
+        for url in images:
+            if suffix in url:
+                return url
+    return images[0] if images else None
+
+def resolve_renditions(items, executor):
+    """
+    Find the image URL for every item of a search result page
+
+    Items whose embedded links already include a large rendition need no
+    further request. The asset manifests of the others (which only link a
+    thumbnail) are fetched together on the pool instead of one after another.
+
+    Returns:
+        List of (item, title, description, image URL) for items with an image
+    """
+    resolved = []
+    manifest_needed = []
+    for item in items:
+        parsed = parse_nasa_item(item)
+        if parsed is None:
+            continue
+        title, desc, img_url = parsed
+        if "~large" in img_url or "~orig" in img_url or not item.get("href"):
+            resolved.append((item, title, desc, img_url))
+        else:
+            manifest_needed.append((item, title, desc, img_url))
+
+    agency = metrics.current_agency()  # pool threads don't inherit the runner's label
+
+    def fetch_manifest(entry):
+        item, title, desc, img_url = entry
+        try:
+            with metrics.agency(agency):
+                response = http_get(item["href"])
+            if response.status_code == 200:
+                img_url = pick_rendition(response.json()) or img_url
+        except Exception as e:
+            print(f"NASA asset manifest error for {title}: {e}")
+        if img_url.startswith("http://"):
+            img_url = "https://" + img_url[7:]
+        return item, title, desc, img_url
+
+    resolved.extend(executor.map(fetch_manifest, manifest_needed))
+    return resolved
+
+def nasa_harvest_records(force_redownload=False, queries=None, year_ranges=None, workers=HARVEST_WORKERS):
+    """
+    Page through every search result for a fixed set of queries
+
+    Each (query, year range) pair keeps a cursor with the next page to fetch,
+    so a harvest continues where the last run stopped. Once a closed year
+    range has been paged to the end it is not searched again; an open range
+    starts over at page 1 to pick up newly published images, and stops again
+    at the first unchanged page (HTTP cache) with nothing new on it. Items
+    whose image was saved are remembered by nasa_id and skipped; items that
+    failed are kept in a retry list and tried again at the start of the next
+    harvest.
+
+    Args:
+        force_redownload: Whether to re-download existing images
+        queries: Search queries (default: SEARCH_QUERIES)
+        year_ranges: (start year, end year or None) pairs (default: HARVEST_YEAR_RANGES)
+        workers: Number of asset manifests fetched at the same time
+    """
+    print("Harvesting NASA Images API...")
+    queries = queries or SEARCH_QUERIES
+    year_ranges = year_ranges or HARVEST_YEAR_RANGES
+
+    # Cursors persist across runs, so they are never cleared like a checkpoint
+    cursors = load_checkpoint("nasa_harvest") or {}
+    done_ids = load_known_items("nasa")
+    # Items whose save failed, as [nasa_id, title, description, image URL];
+    # the cursors have moved past their pages, so they are retried from here
+    retry = {entry[0]: entry for entry in load_checkpoint("nasa_harvest_retry") or [] if entry[0] not in done_ids}
+
+    def harvest(entries):
+        """Yield the records of some items and wait until they have all been saved or have failed"""
+        progress = CrawlProgress()
+        for item_id, title, desc, img_url in entries:
+            print(f"Processing NASA image: {title} - {img_url}")
+            yield ImageRecord("NASA", title, img_url, desc, OUTDIR, progress.track(item_id))
+        progress.wait()
+        done_ids.update(progress.saved)
+        for entry in entries:
+            if entry[0] in progress.saved:
+                retry.pop(entry[0], None)
+            else:
+                retry[entry[0]] = list(entry)
+        save_known_items("nasa", done_ids)
+        save_checkpoint("nasa_harvest_retry", list(retry.values()))
+
+    if retry:
+        print(f"NASA harvest: retrying {len(retry)} items that failed before")
+        yield from harvest(list(retry.values()))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="nasa") as executor:
+        for query in queries:
+            for year_start, year_end in year_ranges:
+                key = f"{query}|{year_start}-{year_end or ''}"
+                cursor = cursors.get(key, {"page": 1, "complete": False})
+                restarted = cursor["complete"]
+                if restarted:
+                    if year_end is not None:
+                        continue
+                    cursor = {"page": 1, "complete": False}
+
+                params = {
+                    "q": query,
+                    "media_type": "image",
+                    "year_start": str(year_start),
+                    "year_end": str(year_end or datetime.date.today().year),
+                    "page_size": HARVEST_PAGE_SIZE,
+                }
+                while not cursor["complete"]:
+                    params["page"] = cursor["page"]
+                    print(f"NASA harvest: '{query}' {params['year_start']}-{params['year_end']} page {cursor['page']}")
+                    response = cached_get(API_URL, params=params)
+                    if response.status_code != 200:
+                        # Leave the cursor on this page and try again next run
+                        print(f"Failed to access NASA API: {response.status_code}")
+                        break
+                    collection = response.json().get("collection", {})
+                    items = collection.get("items", [])
+                    new_items = [item for item in items if force_redownload or nasa_item_id(item) not in done_ids]
+                    if restarted and not new_items and response.not_modified:
+                        # Results are newest first: an unchanged, fully ingested
+                        # page means nothing was published since the last pass
+                        print(f"NASA harvest: '{query}' {params['year_start']}-{params['year_end']} unchanged")
+                        cursors[key] = {"page": cursor["page"], "complete": True}
+                        break
+
+                    # The cursor only moves past the page once its records are saved
+                    yield from harvest([(nasa_item_id(item), title, desc, img_url)
+                                        for item, title, desc, img_url in resolve_renditions(new_items, executor)])
+
+                    has_next = any(link.get("rel") == "next" for link in collection.get("links", []))
+                    if not has_next or not items or cursor["page"] >= HARVEST_MAX_PAGES:
+                        cursor = {"page": cursor["page"], "complete": True}
+                    else:
+                        cursor = {"page": cursor["page"] + 1, "complete": False}
+                    cursors[key] = cursor
+                    save_checkpoint("nasa_harvest", cursors)
+
+    print("NASA harvest complete")
+
+# The search API and its image CDN answer fast and tolerate far more than one request a second
+@register_source("NASA", OUTDIR, hosts={"images-api.nasa.gov": (0.5, 10.0), "images-assets.nasa.gov": (0.5, 20.0)})
+def nasa_records(force_redownload=False, resume=False, nasa_harvest=False, nasa_workers=HARVEST_WORKERS, **options):
+    """
+    Yield images from the NASA Images API
+
+    Args:
+        force_redownload: Whether to re-download existing images
+        resume: Continue the random page of an interrupted run
+        nasa_harvest: Page through every result instead of one random page
+        nasa_workers: Number of asset manifests fetched at the same time in a harvest
+    """
+    if nasa_harvest:
+        yield from nasa_harvest_records(force_redownload, workers=nasa_workers)
         return
         
     print("Scraping NASA...")
     
-    # NASA now has a dedicated Images API we can use instead of scraping
-    API_URL = "https://images-api.nasa.gov/search"
-    
     try:
-        # Search queries to pick from randomly
-        search_queries = [
-            "earth OR planet OR space",
-            "moon OR mars OR jupiter",
-            "galaxy OR nebula OR stars",
-            "spacecraft OR astronaut",
-            "asteroid OR comet OR meteor"
-        ]
-        
         # Get NASA images from their Images API
-        # Use random query and page for more variety
-        random_query = random.choice(search_queries)
-        random_page = random.randint(1, 50)  # NASA API has many pages of results
+        # Use random query and page for more variety, unless an interrupted
+        # run left a checkpoint with its query, page and finished items
+        state = load_checkpoint("nasa") if resume else None
+        if state:
+            random_query = state["query"]
+            random_page = state["page"]
+            done_ids = set(state["done_ids"])
+            print(f"NASA: resuming query '{random_query}' page {random_page} ({len(done_ids)} items already processed)")
+        else:
+            random_query = random.choice(SEARCH_QUERIES)
+            random_page = random.randint(1, 50)  # NASA API has many pages of results
+            done_ids = set()
+
+        # Saved whenever an item is done, by whichever thread finished it
+        def checkpoint(progress):
+            save_checkpoint("nasa", {"query": random_query, "page": random_page, "done_ids": sorted(progress.finished)})
+        progress = CrawlProgress(done_ids, on_change=checkpoint)
+        checkpoint(progress)
         
         params = {
             "q": random_query,
@@ -38,7 +290,7 @@ def scrape_nasa_images(force_redownload=False, recreate_overlays=False):
         }
         
         print(f"Fetching images from NASA API with query '{random_query}' (page {random_page})...")
-        response = requests.get(API_URL, params=params)
+        response = cached_get(API_URL, params=params)
         if response.status_code != 200:
             print(f"Failed to access NASA API: {response.status_code}")
             return
@@ -57,61 +309,35 @@ def scrape_nasa_images(force_redownload=False, recreate_overlays=False):
         random.shuffle(items)
         
         for item in items:
+            item_id = nasa_item_id(item)
+            if item_id in progress.finished:
+                continue
             try:
-                # Extract metadata
-                if "data" not in item or not item["data"]:
-                    print("Missing data in item")
-                    continue
-                    
-                metadata = item["data"][0]
-                title = metadata.get("title", "Untitled NASA Image")
-                desc = metadata.get("description", "No description available")
-                
-                # If the description is too short, add the keywords
-                if len(desc) < 50 and "keywords" in metadata:
-                    keywords = metadata.get("keywords", [])
-                    if isinstance(keywords, list):
-                        desc += " | Keywords: " + ", ".join(keywords)
-                
-                # Get the image URL - we need to find the image link in the links array
-                if "links" not in item or not item["links"]:
-                    print(f"No links found for {title}")
-                    continue
-                
-                # First try to find a large image
-                img_url = None
-                for link in item["links"]:
-                    if "href" not in link:
-                        continue
-                        
-                    if "render" in link and link["render"] == "image":
-                        img_url = link["href"]
-                        # If we find a large version, prefer it
-                        if "large" in link["href"]:
-                            img_url = link["href"]
-                            break
-                
-                # If we didn't find a render:image link, fall back to first image link
-                if not img_url and len(item["links"]) > 0:
-                    img_url = item["links"][0].get("href")
-                
-                if not img_url:
-                    print(f"No image URL found for {title}")
-                    continue
-                
-                # Sometimes NASA API returns http URLs, convert to https
-                if img_url.startswith("http://"):
-                    img_url = "https://" + img_url[7:]
-                
-                print(f"Processing NASA image: {title} - {img_url}")
-                save_image_data("NASA", title, img_url, desc, "nasa_images", force_redownload, recreate_overlays)
-                time.sleep(1)  # Be respectful with rate limiting
-                
+                parsed = parse_nasa_item(item)
             except Exception as e:
                 print(f"Error processing NASA image: {e}")
                 traceback.print_exc()
+                parsed = None
+
+            if parsed is not None:
+                title, desc, img_url = parsed
+                print(f"Processing NASA image: {title} - {img_url}")
+                yield ImageRecord("NASA", title, img_url, desc, OUTDIR, progress.track(item_id))
+            else:
+                progress.complete(item_id)
                 
+        progress.wait()
+        clear_checkpoint("nasa")
         print("NASA scraping complete")
     except Exception as e:
         print(f"NASA scraping error: {e}")
-        traceback.print_exc() 
\ No newline at end of file
+        traceback.print_exc()
+
+def scrape_nasa_images(force_redownload=False, recreate_overlays=False, resume=False, harvest=False,
+                       workers=HARVEST_WORKERS):
+    """Scrape NASA on its own through the shared source runner (see nasa_records)"""
+    if recreate_overlays:
+        print("NASA: Recreate overlays mode - skipping image scraping")
+        return
+    return run_source("NASA", force_redownload=force_redownload, resume=resume, nasa_harvest=harvest,
+                      nasa_workers=workers)
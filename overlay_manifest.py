@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import tempfile
+
+MANIFEST_NAME = ".overlay_manifest.json"
+
+def settings_hash(settings):
+    """Hash the overlay render parameters"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Hash a file in chunks without reading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def overlay_fingerprint(img_path, source_sha256, description, params_hash, derivatives_hash=None,
+                        decode_dimension=None):
+    """
+    Build the manifest entry describing what an overlay was rendered from
+
+    The size and mtime of the original are stored alongside the content hash
+    so later runs can trust the stored hash without re-reading unchanged files.
+    derivatives_hash is the hash of the derivative settings the derivatives
+    were made with, or None if none were made. decode_dimension is the
+    longest side the memory budget reduced the original to (None when it
+    was decoded at the size the render parameters ask for).
+    """
+    stat = os.stat(img_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "source_sha256": source_sha256,
+        "description_sha256": text_hash(description),
+        "params_sha256": params_hash,
+        "derivatives_sha256": derivatives_hash,
+        "decode_max_dimension": decode_dimension,
+    }
+
+def same_inputs(entry, fingerprint):
+    """True if an overlay was rendered from exactly these inputs, at the same size"""
+    return entry is not None and all(
+        entry.get(key) == fingerprint[key]
+        for key in ("source_sha256", "description_sha256", "params_sha256", "decode_max_dimension")
+    )
+
+def derivatives_current(entry, derivatives_hash, paths):
+    """
+    True if an original's derivatives need no work
+
+    They do when derivatives are enabled (derivatives_hash is not None) and
+    the entry records other derivative settings, or one of the files is gone.
+    """
+    if derivatives_hash is None:
+        return True
+    return (entry is not None and entry.get("derivatives_sha256") == derivatives_hash
+            and all(os.path.exists(path) for path in paths))
+
+class OverlayManifest:
+    """
+    Record of what every overlay in a directory was rendered from
+
+    Maps the original's file name to a fingerprint holding hashes of the
+    original bytes, the description and the render parameters. An overlay is
+    up to date when all three still match, so regeneration only rebuilds the
+    stale ones. The derivative settings are hashed separately, so changing
+    them (or turning derivatives on) only remakes the derivatives.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, directory):
+        manifest = cls(directory)
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as f:
+                manifest.entries = json.load(f)
+        except (OSError, ValueError):
+            manifest.entries = {}
+        return manifest
+
+    def get(self, img_path):
+        return self.entries.get(os.path.basename(img_path))
+
+    def update(self, img_path, fingerprint):
+        self.entries[os.path.basename(img_path)] = fingerprint
+        self.dirty = True
+
+    def is_current(self, img_path, overlay_path, description, params_hash, derivatives_hash=None,
+                   derivative_paths=(), decode_dimension=None):
+        """
+        Cheap check that an overlay and any derivatives are up to date
+
+        Only stats the original: if its size or mtime changed the answer is
+        False and the caller has to hash the bytes to be sure.
+        """
+        entry = self.get(img_path)
+        if entry is None or entry.get("params_sha256") != params_hash:
+            return False
+        if entry.get("decode_max_dimension") != decode_dimension:
+            return False
+        if not os.path.exists(overlay_path):
+            return False
+        if not derivatives_current(entry, derivatives_hash, derivative_paths):
+            return False
+        stat = os.stat(img_path)
+        if stat.st_size != entry.get("size") or stat.st_mtime_ns != entry.get("mtime_ns"):
+            return False
+        return entry.get("description_sha256") == text_hash(description)
+
+    def save(self):
+        """Write the manifest atomically if anything changed"""
+        if not self.dirty:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
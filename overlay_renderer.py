@@ -0,0 +1,223 @@
+import textwrap
+from collections import OrderedDict
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+PANEL_CACHE_BYTES = 16 * 1024 * 1024  # rendered panels kept (each is width x band height RGBA)
+PANEL_MAX_BYTES = 4 * 1024 * 1024     # larger panels (very wide images) are not kept at all
+LAYOUT_CACHE_SIZE = 1024     # wrapped descriptions kept
+KERNING_CACHE_SIZE = 50000   # character pairs whose kerning is kept
+
+BOX_COLOR = (0, 0, 0, 180)
+TEXT_COLOR = (255, 255, 255, 255)
+
+def _lru_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _lru_put(cache, key, value, max_size):
+    cache[key] = value
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+class OverlayRenderer:
+    """
+    Draws the description box onto images, reusing work between images
+
+    Four caches sit between a description and the composited image:
+
+    - the font is loaded once instead of for every image;
+    - wrapped layouts are kept by (description, line width), since the same
+      description is rendered again whenever an overlay is regenerated;
+    - each character is rasterized by FreeType once and its advance and the
+      kerning of each character pair measured once; lines are then assembled
+      from those glyph masks instead of being laid out and rendered again;
+    - the finished RGBA panel (box and text for the top band) is kept by
+      layout and image size and pasted as is onto any image of that size.
+      Panels are kept up to PANEL_CACHE_BYTES per renderer, and only small
+      ones: this memory is outside the render budget (see memory_budget.py),
+      and in bulk regeneration every image has its own description anyway.
+
+    With the basic FreeType layout the output is visually identical to
+    drawing each line with ImageDraw.text: glyph placement matches exactly,
+    but where overlapping glyph edges are combined a few pixels may differ
+    by one intensity level. Fonts laid out by libraqm (ligatures,
+    complex scripts) or bitmap fonts skip the glyph cache and draw each line
+    with ImageDraw.text; the panel and layout caches still apply.
+    A renderer is not thread-safe; each overlay worker process or thread
+    uses its own (see utils.get_overlay_renderer).
+    """
+
+    def __init__(self, settings):
+        self.settings = dict(settings)
+        self.font = self._load_font(settings["font"], settings["font_size"])
+        self._layouts = OrderedDict()
+        self._glyphs = {}
+        self._kerning = OrderedDict()
+        # Glyphs can only be assembled by hand when each character is placed
+        # independently, which is what the basic layout engine does
+        self._glyph_cache = (isinstance(self.font, ImageFont.FreeTypeFont)
+                             and self.font.layout_engine == ImageFont.Layout.BASIC)
+        self._panels = OrderedDict()
+        self._panel_bytes = 0
+
+    @staticmethod
+    def _load_font(name, size):
+        # Try to use a system font, fall back to default if not available
+        try:
+            return ImageFont.truetype(name, size)
+        except IOError:
+            return ImageFont.load_default()
+
+    def layout(self, description, max_width):
+        """Return the wrapped lines of a description as a tuple"""
+        key = (description, max_width)
+        lines = _lru_get(self._layouts, key)
+        if lines is None:
+            limit = self.settings["description_limit"]
+            text = description[:limit] + ("..." if len(description) > limit else "")
+            lines = tuple(textwrap.TextWrapper(width=max_width).fill(text).split('\n'))
+            _lru_put(self._layouts, key, lines, LAYOUT_CACHE_SIZE)
+        return lines
+
+    def _glyph(self, char):
+        """Rasterize a character once; returns (mask or None, left, top, advance)"""
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            core, (left, top) = self.font.getmask2(char, "L")
+            mask = None
+            if core.size[0] and core.size[1]:
+                mask = Image.new("L", core.size)
+                mask.im = core
+            glyph = self._glyphs[char] = (mask, left, top, self.font.getlength(char))
+        return glyph
+
+    def _kern(self, first, second):
+        """Kerning between two characters, as the basic layout adds it to the pen position"""
+        pair = first + second
+        kerning = _lru_get(self._kerning, pair)
+        if kerning is None:
+            kerning = self.font.getlength(pair) - self._glyph(first)[3] - self._glyph(second)[3]
+            _lru_put(self._kerning, pair, kerning, KERNING_CACHE_SIZE)
+        return kerning
+
+    def _draw_line(self, draw, x, y, line):
+        if not self._glyph_cache:
+            draw.text((x, y), line, font=self.font, fill=TEXT_COLOR)
+            return
+
+        # Place every glyph where FreeType would: at the rounded pen position,
+        # which advances by each character's width plus the pair kerning.
+        # Advances are multiples of 1/64 pixel, so the float sums are exact.
+        placed = []
+        pen = 0.0
+        previous = None
+        for char in line:
+            if previous is not None:
+                pen += self._kern(previous, char)
+            mask, left, top, advance = self._glyph(char)
+            if mask is not None:
+                placed.append((mask, int(pen + 0.5) + left, top))
+            pen += advance
+            previous = char
+        if not placed:
+            return
+
+        # Glyphs that overlap are combined the way FreeType's renderer does:
+        # new coverage fills the part the earlier glyphs left uncovered
+        # (italic glyphs may start left of the pen, hence the origin shift)
+        x0 = min(gx for _, gx, _ in placed)
+        y0 = min(gy for _, _, gy in placed)
+        width = max(gx + mask.width for mask, gx, _ in placed) - x0
+        height = max(gy + mask.height for mask, _, gy in placed) - y0
+        line_mask = Image.new("L", (width, height), 0)
+        covered = 0  # right edge of the glyphs placed so far
+        for mask, gx, gy in placed:
+            box = (gx - x0, gy - y0, gx - x0 + mask.width, gy - y0 + mask.height)
+            if box[0] >= covered:
+                # Nothing drawn here yet, which is the usual case
+                line_mask.paste(mask, box)
+                covered = box[2]
+                continue
+            covered = max(covered, box[2])
+            below = line_mask.crop(box)
+            uncovered = ImageChops.multiply(mask, ImageChops.invert(below))
+            line_mask.paste(ImageChops.add(below, uncovered), box)
+        draw.bitmap((x + x0, y + y0), line_mask, fill=TEXT_COLOR)
+
+    def panel(self, lines, width, overlay_height, band_height):
+        """
+        Return the RGBA tile holding the box and text for the top band of an image
+
+        Args:
+            lines: Wrapped lines from layout()
+            width: Image width
+            overlay_height: Height of the box
+            band_height: Height of the band the tile covers (box plus its bottom edge)
+        """
+        key = (lines, width, overlay_height, band_height)
+        panel = _lru_get(self._panels, key)
+        if panel is not None:
+            return panel
+
+        line_height = self.settings["line_height"]
+        padding = self.settings["padding"]
+
+        # For width, use 3/4 of the image width to allow for more text per line
+        # Position - shifted more to the right (15% from the left edge)
+        left = int(width * 0.15)
+        right = left + int(width * 0.75)
+        top = 0
+        bottom = top + overlay_height
+
+        panel = Image.new('RGBA', (width, band_height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(panel)
+        draw.rectangle([(left, top), (right, bottom)], fill=BOX_COLOR)
+
+        y_position = top + padding
+        for line in lines:
+            self._draw_line(draw, left + padding, y_position, line)
+            y_position += line_height
+
+            # Stop drawing text if we go beyond the overlay height
+            if y_position > bottom - padding:
+                break
+
+        self._keep_panel(key, panel)
+        return panel
+
+    def _keep_panel(self, key, panel):
+        size = panel.width * panel.height * 4
+        if size > PANEL_MAX_BYTES:
+            return
+        self._panels[key] = panel
+        self._panel_bytes += size
+        while self._panel_bytes > PANEL_CACHE_BYTES:
+            _, old = self._panels.popitem(last=False)
+            self._panel_bytes -= old.width * old.height * 4
+
+    def render(self, img, description, max_width=None):
+        """
+        Composite the description box onto the top of an RGB image
+
+        Only the band at the top of the image covered by the box is converted
+        to RGBA and alpha-composited; the rest of the frame is left untouched.
+
+        Returns:
+            The same image, modified in place
+        """
+        max_width = max_width or self.settings["max_width"]
+        lines = self.layout(description, max_width)
+
+        # Size the box to the text, but never more than 1/4 of the image height
+        required_height = len(lines) * self.settings["line_height"] + self.settings["padding"] * 2
+        overlay_height = min(required_height, img.height // 4)
+
+        # Only the full-width band holding the box (and any text running past its
+        # right edge) needs compositing
+        band_box = (0, 0, img.width, min(img.height, overlay_height + 1))
+        panel = self.panel(lines, img.width, overlay_height, band_box[3])
+        band = Image.alpha_composite(img.crop(band_box).convert('RGBA'), panel)
+        img.paste(band.convert('RGB'), band_box)
+        return img
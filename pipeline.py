@@ -0,0 +1,203 @@
+import os
+import queue
+import threading
+from utils import (
+    get_image_paths, fetch_image, write_overlay, write_description,
+    record_image, record_overlay, report_outcome, save_overlay_manifests, set_image_pipeline, OVERLAY_SETTINGS,
+)
+from memory_budget import get_memory_budget, plan_render
+import metrics
+
+# Marks the end of a work queue for one worker thread
+_STOP = object()
+
+class ImagePipeline:
+    """
+    Producer/consumer pipeline for saving scraped images
+
+    Scrapers only discover images and submit records. A pool of download
+    workers fetches the originals and writes them to disk, and a separate pool
+    renders the text overlays, so HTML parsing, network transfer and Pillow
+    work overlap instead of running one after another.
+
+    Both queues are bounded: when the workers fall behind, submit() blocks and
+    the scrapers slow down instead of piling up records in memory.
+
+    With a memory budget (see memory_budget.py), an overlay needing more than
+    one overlay worker's share of it is passed to a deferred queue instead.
+    A single thread renders those, each once enough of the budget is free,
+    while the overlay workers carry on with smaller images.
+
+    Usage:
+        with ImagePipeline(download_workers=4, overlay_workers=2) as pipeline:
+            scrape_esa_images()  # emit_image() now feeds the pipeline
+    """
+
+    def __init__(self, download_workers=4, overlay_workers=2, queue_size=32):
+        self.download_workers = max(1, download_workers)
+        self.overlay_workers = max(1, overlay_workers)
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        self.overlay_queue = queue.Queue(maxsize=queue_size)
+        # Unbounded: it holds paths only, and must never block an overlay worker
+        self.deferred_queue = queue.Queue()
+        self.stats = {"queued": 0, "saved": 0, "reused": 0, "skipped": 0, "failed": 0, "overlays": 0,
+                      "overlay_failures": 0, "deferred": 0}
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        for i in range(self.download_workers):
+            self._spawn(self._download_worker, f"download-{i}")
+        for i in range(self.overlay_workers):
+            self._spawn(self._overlay_worker, f"overlay-{i}")
+        self._spawn(self._deferred_worker, "deferred-overlays")
+        set_image_pipeline(self)
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+        if key in ("saved", "reused", "skipped", "failed"):
+            metrics.count("images_total", outcome=key)
+
+    def submit(self, record, force_redownload=False):
+        """
+        Queue an image record for download
+
+        The existence check happens here so scrapers still learn straight away
+        whether an image is new (JAXA and APOD count new images). Whether it
+        was saved is only known later: the record's on_done is called once
+        the download has finished (see ImageRecord).
+
+        Returns:
+            True if the record was queued, False if it was skipped
+        """
+        os.makedirs(record.outdir, exist_ok=True)
+        safe_title, img_path, _, _ = get_image_paths(record.title, record.image_url, record.outdir)
+
+        with self._lock:
+            already_queued = img_path in self._in_flight
+            if not already_queued:
+                self._in_flight.add(img_path)
+
+        if already_queued or (os.path.exists(img_path) and not force_redownload):
+            if not already_queued:
+                with self._lock:
+                    self._in_flight.discard(img_path)
+            print(f"Skipping (already exists): {safe_title}")
+            self._count("skipped")
+            report_outcome(record.on_done, "duplicate" if already_queued else "exists")
+            return False
+
+        # Workers label their events with the agency of the scraper that found the image
+        self.download_queue.put((record, force_redownload, metrics.current_agency()))
+        self._count("queued")
+        return True
+
+    def _download_worker(self):
+        while True:
+            job = self.download_queue.get()
+            if job is _STOP:
+                break
+
+            record, force_redownload, agency = job
+            safe_title, img_path, overlay_path, txt_path = get_image_paths(record.title, record.image_url, record.outdir)
+            with metrics.agency(agency):
+                try:
+                    sha256, downloaded = fetch_image(record.image_url, img_path, force_redownload)
+                    write_description(record.description, txt_path)
+                    record_image(record.source, record.title, record.image_url, record.description, img_path, sha256)
+                    print(f"Saved: {safe_title}" if downloaded else f"Saved (reused earlier download): {safe_title}")
+                    self._count("saved" if downloaded else "reused")
+                    report_outcome(record.on_done, "saved")
+
+                    # Hand the CPU-bound overlay rendering to the overlay pool; it
+                    # reads the original back from disk, so no image bytes are queued
+                    self.overlay_queue.put((record.title, img_path, record.description, overlay_path, agency, sha256))
+                except Exception as e:
+                    print(f"Failed to save {record.title}: {e}")
+                    self._count("failed")
+                    report_outcome(record.on_done, "failed")
+                finally:
+                    with self._lock:
+                        self._in_flight.discard(img_path)
+
+    def _render(self, job, plan=None, priority=False):
+        title, img_path, description, overlay_path, agency, sha256 = job
+        with metrics.agency(agency):
+            try:
+                write_overlay(img_path, description, overlay_path, plan=plan, priority=priority)
+                record_overlay(img_path, description, sha256)
+                self._count("overlays")
+            except Exception as e:
+                print(f"Failed to create overlay for {title}: {e}")
+                self._count("overlay_failures")
+
+    def _overlay_worker(self):
+        budget = get_memory_budget()
+        while True:
+            job = self.overlay_queue.get()
+            if job is _STOP:
+                break
+
+            plan = None
+            if budget.limit is not None:
+                try:
+                    plan = plan_render(job[1], OVERLAY_SETTINGS["max_dimension"])
+                except Exception:
+                    pass  # write_overlay reports the error
+            if plan is not None and budget.oversized(plan.cost, self.overlay_workers):
+                print(f"Deferring overlay of {job[0]} ({plan.cost / 1e6:.0f} MB) until the memory budget allows it")
+                self._count("deferred")
+                self.deferred_queue.put((job, plan))
+                continue
+            self._render(job, plan)
+
+    def _deferred_worker(self):
+        while True:
+            item = self.deferred_queue.get()
+            if item is _STOP:
+                break
+            job, plan = item
+            self._render(job, plan, priority=True)
+
+    def close(self):
+        """Wait for all queued work to finish and stop the workers"""
+        set_image_pipeline(None)
+
+        download_threads = [t for t in self._threads if t.name.startswith("download-")]
+        overlay_threads = [t for t in self._threads if t.name.startswith("overlay-")]
+
+        # Downloads feed the overlay queue, so drain them first
+        for _ in download_threads:
+            self.download_queue.put(_STOP)
+        for thread in download_threads:
+            thread.join()
+        for _ in overlay_threads:
+            self.overlay_queue.put(_STOP)
+        for thread in overlay_threads:
+            thread.join()
+        # Overlay workers feed the deferred queue
+        self.deferred_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        save_overlay_manifests()
+
+        print(f"Pipeline: {self.stats['saved']} downloaded, {self.stats['reused']} reused, {self.stats['skipped']} skipped, "
+              f"{self.stats['failed']} failed, {self.stats['overlays']} overlays rendered "
+              f"({self.stats['overlay_failures']} overlay failures"
+              + (f", {self.stats['deferred']} deferred for memory" if self.stats["deferred"] else "") + ")")
+        return self.stats
@@ -0,0 +1,254 @@
+"""
+Profiling mode for download_all.py (--profile, --profile-memory)
+
+A sampling profiler looks at the stack of every thread at a fixed interval
+and files each sample under the agency the thread is working for (see
+metrics.agency), so scrapers running side by side and the pipeline workers
+serving them are told apart. At the end it writes, per agency:
+
+    stacks_<agency>.folded   one "frame;frame;...;frame count" line per stack,
+                             the input format of flamegraph.pl and speedscope
+    report.txt               functions ranked by samples spent in them (self)
+                             and below them (total)
+
+Samples are wall-clock: time spent waiting on the network or a queue shows
+up as well as CPU time, which is usually what a suddenly slow scraper needs.
+With --profile cprofile the main thread is also run under cProfile, and its
+statistics are added to the report and saved as run.prof for pstats or
+snakeviz.
+
+--profile-memory traces allocations with tracemalloc around the save path
+(save_image_data, or fetch_image and write_overlay in the pipeline workers)
+and the overlay and derivative renders (see trace_memory), and writes
+memory.txt with the peak per call and the top allocation sites. The peak is
+process-wide, so it is exact only when calls do not overlap
+(--download-workers 0, or a single overlay worker). Pillow allocates pixel
+buffers outside the Python allocator, so decoded images are not counted.
+"""
+import io
+import os
+import sys
+import time
+import datetime
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+import metrics
+
+PROFILE_DIR = "./data/profiles"
+SAMPLE_INTERVAL = 0.005     # seconds between samples
+REPORT_FUNCTIONS = 25       # functions listed per agency in the report
+MEMORY_FRAMES = 10          # stack depth kept by tracemalloc
+UNLABELLED = "other"        # samples of threads not working for an agency
+
+# Functions wrapped by trace_memory: name -> [calls, largest peak, total peak]
+_memory_calls = {}
+_memory_peak = [0]  # highest traced memory seen, since the wrappers keep resetting the peak
+_memory_lock = threading.Lock()
+_memory_depth = threading.local()  # wrapped calls running on this thread
+
+def trace_memory(function):
+    """
+    Decorator measuring the peak traced memory of each call while tracemalloc is on
+
+    Only the outermost wrapped call on a thread resets the peak, so a call
+    made inside another (write_overlay inside save_image_data) does not wipe
+    the outer call's peak. The nested call's figure is the peak since the
+    outer call started, an upper bound of its own. Costs one check per call
+    when memory profiling is off.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not tracemalloc.is_tracing():
+            return function(*args, **kwargs)
+        depth = getattr(_memory_depth, "value", 0)
+        _memory_depth.value = depth + 1
+        start, _ = tracemalloc.get_traced_memory()
+        if depth == 0:
+            tracemalloc.reset_peak()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _memory_depth.value = depth
+            _, peak = tracemalloc.get_traced_memory()
+            with _memory_lock:
+                _memory_peak[0] = max(_memory_peak[0], peak)
+                stats = _memory_calls.setdefault(function.__name__, [0, 0, 0])
+                stats[0] += 1
+                stats[1] = max(stats[1], peak - start)
+                stats[2] += peak - start
+    return wrapper
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}  # agency -> Counter of stacks (tuples of frame labels, root first)
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        labels = {}  # code object -> frame label
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.reverse()
+                agency = metrics.agency_of_thread(thread_id) or UNLABELLED
+                self.stacks.setdefault(agency, Counter())[tuple(stack)] += 1
+            self.samples += 1
+
+    def write_folded(self, directory):
+        """Write one collapsed-stack file per agency; returns their paths"""
+        paths = []
+        for agency, stacks in sorted(self.stacks.items()):
+            path = os.path.join(directory, f"stacks_{agency}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(";".join(stack) + f" {count}\n")
+            paths.append(path)
+        return paths
+
+    def ranking(self, agency, limit=REPORT_FUNCTIONS):
+        """Report lines ranking an agency's functions by self and total samples"""
+        stacks = self.stacks.get(agency, Counter())
+        total_samples = sum(stacks.values())
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in stacks.items():
+            self_counts[stack[-1]] += count
+            for label in set(stack):
+                total_counts[label] += count
+
+        lines = [f"== {agency}: {total_samples} samples ({total_samples * self.interval:.1f}s of thread time) =="]
+        for title, counts in (("self", self_counts), ("total", total_counts)):
+            lines.append(f"-- by {title} samples --")
+            for label, count in counts.most_common(limit):
+                lines.append(f"{count:8d} {count / total_samples * 100:6.1f}%  {label}")
+        return lines
+
+class Profiler:
+    """
+    Profiles one run of download_all.py
+
+    Usage:
+        profiler = Profiler(mode="sample", memory=True)
+        profiler.start()
+        ... run ...
+        profiler.stop()
+        profiler.write_reports()
+    """
+
+    def __init__(self, mode="sample", memory=False, directory=None):
+        self.mode = mode
+        self.memory = memory
+        self.directory = directory or os.path.join(PROFILE_DIR, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self.sampler = SamplingProfiler() if mode else None
+        self.cprofile = None
+        if mode == "cprofile":
+            import cProfile
+            self.cprofile = cProfile.Profile()
+        self.started = None
+        self.elapsed = None
+        self.snapshot = None
+        self.traced_peak = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        if self.memory:
+            tracemalloc.start(MEMORY_FRAMES)
+        if self.sampler:
+            self.sampler.start()
+        if self.cprofile:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile:
+            self.cprofile.disable()
+        if self.sampler:
+            self.sampler.stop()
+        self.elapsed = time.monotonic() - self.started
+        if self.memory:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.traced_peak = max(tracemalloc.get_traced_memory()[1], _memory_peak[0])
+            tracemalloc.stop()
+
+    def write_reports(self):
+        """Write the reports to the profile directory and print where they are"""
+        os.makedirs(self.directory, exist_ok=True)
+        written = []
+
+        if self.sampler:
+            lines = [f"Run time {self.elapsed:.1f}s, {self.sampler.samples} samples every "
+                     f"{self.sampler.interval * 1000:.0f}ms", ""]
+            # Agencies with the most samples first
+            agencies = sorted(self.sampler.stacks, key=lambda a: -sum(self.sampler.stacks[a].values()))
+            for agency in agencies:
+                lines.extend(self.sampler.ranking(agency))
+                lines.append("")
+            if self.cprofile:
+                prof_path = os.path.join(self.directory, "run.prof")
+                self.cprofile.dump_stats(prof_path)
+                written.append(prof_path)
+                lines.append("== cProfile, main thread ==")
+                lines.extend(self._pstats_text().splitlines())
+            report_path = os.path.join(self.directory, "report.txt")
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            written.append(report_path)
+            written.extend(self.sampler.write_folded(self.directory))
+
+        if self.snapshot is not None:
+            memory_path = os.path.join(self.directory, "memory.txt")
+            with open(memory_path, "w", encoding="utf-8") as f:
+                f.write(self._memory_text())
+            written.append(memory_path)
+
+        print(f"Profile written to {self.directory}:")
+        for path in written:
+            print(f"  {os.path.basename(path)}")
+        return written
+
+    def _pstats_text(self):
+        import pstats
+        out = io.StringIO()
+        stats = pstats.Stats(self.cprofile, stream=out).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+        stats.sort_stats("tottime").print_stats(REPORT_FUNCTIONS)
+        return out.getvalue()
+
+    def _memory_text(self):
+        lines = [f"Peak traced memory: {self.traced_peak / 1e6:.1f} MB",
+                 "(tracemalloc sees Python allocations only; Pillow's pixel buffers are not included)", "",
+                 f"{'function':<34}{'calls':>8}{'max peak MB':>14}{'mean peak MB':>14}"]
+        with _memory_lock:
+            calls = dict(_memory_calls)
+        for name, (count, largest, total) in sorted(calls.items()):
+            lines.append(f"{name:<34}{count:>8}{largest / 1e6:>14.1f}{total / count / 1e6:>14.1f}")
+        lines.extend(["", "Top allocation sites still held at the end of the run:"])
+        for stat in self.snapshot.statistics("lineno")[:REPORT_FUNCTIONS]:
+            lines.append(str(stat))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,128 @@
+import time
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+
+# Request rates are in requests per second per host
+DEFAULT_RATE = 1.0           # starting rate for a host
+DEFAULT_FLOOR = 0.2          # never slower than this, unless the host sends Retry-After
+DEFAULT_CEILING = 4.0        # never faster than this
+BURST = 2                    # requests that may start back to back after an idle spell
+RATE_INCREASE = 0.1          # added to the rate after each fast, successful response
+RATE_DECREASE = 0.5          # rate multiplier after 429/503 or a failed request
+SLOWDOWN_DECREASE = 0.8      # rate multiplier when a response is much slower than usual
+SLOWDOWN_FACTOR = 2.0        # "much slower" = this many times the average latency
+LATENCY_SMOOTHING = 0.2      # weight of the newest sample in the average latency
+THROTTLE_STATUSES = (429, 503)
+
+def parse_retry_after(value):
+    """Return the seconds to wait from a Retry-After header (seconds or HTTP date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+class HostRateLimiter:
+    """
+    Token bucket for one host whose rate follows how the host responds
+
+    Tokens refill at the current rate up to BURST. Fast successful responses
+    raise the rate additively towards the ceiling; 429/503 responses, failed
+    requests and responses much slower than the running average cut it
+    multiplicatively towards the floor (AIMD, as in TCP congestion control).
+    A Retry-After header pauses the whole host for that long, for every
+    thread using it.
+    """
+
+    def __init__(self, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING, rate=DEFAULT_RATE):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.rate = min(max(rate, floor), ceiling)
+        self.tokens = BURST
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.latency = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Nothing accrues while the host has paused us
+        if now > self.updated:
+            self.tokens = min(BURST, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        """Block until a request to this host may start"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def record(self, status=None, latency=None, retry_after=None):
+        """
+        Adapt the rate to the outcome of a request
+
+        Args:
+            status: HTTP status code, or None if the request failed without one
+            latency: Seconds until the response headers arrived
+            retry_after: Seconds the host asked us to wait, if any
+        """
+        with self._lock:
+            now = time.monotonic()
+            if status is None or status in THROTTLE_STATUSES:
+                self.rate = max(self.floor, self.rate * RATE_DECREASE)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                    self.tokens = 0
+                    self.updated = self.paused_until
+                return
+            if latency is None:
+                return
+            if status < 500 and (self.latency is None or latency <= self.latency * SLOWDOWN_FACTOR):
+                self.rate = min(self.ceiling, self.rate + RATE_INCREASE)
+            else:
+                self.rate = max(self.floor, self.rate * SLOWDOWN_DECREASE)
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+_limiters = {}
+_host_limits = {}
+_enabled = True
+_lock = threading.Lock()
+
+def set_host_limits(host, floor=None, ceiling=None):
+    """Set the rate floor and ceiling (requests per second) for a host"""
+    with _lock:
+        old_floor, old_ceiling = _host_limits.get(host, (DEFAULT_FLOOR, DEFAULT_CEILING))
+        _host_limits[host] = (floor if floor is not None else old_floor,
+                              ceiling if ceiling is not None else old_ceiling)
+        _limiters.pop(host, None)
+
+def configure_rate_limits(enabled=None):
+    """Turn adaptive per-host rate limiting on or off"""
+    global _enabled
+    if enabled is not None:
+        _enabled = enabled
+
+def get_rate_limiter(host):
+    """Return the shared limiter for a host, or None when rate limiting is disabled"""
+    if not _enabled:
+        return None
+    with _lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            floor, ceiling = _host_limits.get(host, (DEFAULT_FLOOR, DEFAULT_CEILING))
+            limiter = _limiters[host] = HostRateLimiter(floor, ceiling)
+        return limiter
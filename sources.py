@@ -0,0 +1,269 @@
+"""
+Registry of image sources and the runner that drives them
+
+A source is a generator function that yields ImageRecord tuples; it only
+knows how to find images. The runner does everything else the same way for
+every source: it drops image URLs already handed on in this run, enforces
+per-source limits and passes each record to emit_image, which downloads it (inline or through the pipeline)
+and records it in the catalog. A record's on_done callback hears how its
+save ended, so sources can checkpoint only what has been saved (see
+checkpoint.CrawlProgress). Request pacing is not done here but per host
+by the adaptive limiter behind http_get (see rate_limit.py); sources only
+declare the rate floor and ceiling for the hosts they use.
+
+Sources register themselves with the register_source decorator when their
+module is imported; load_sources() imports the modules listed in
+SOURCE_INDEX, only for the sources a run asks for, so a run limited to some
+agencies (or one that only regenerates overlays) does not load the scrapers
+of the others or the networking and parsing libraries they use. Adding a
+source means writing a module with a registered generator and listing it
+there.
+"""
+import time
+import importlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import emit_image, report_outcome
+from checkpoint import load_checkpoint
+from rate_limit import set_host_limits
+import metrics
+
+# Source name -> (module registering it, directory its images are saved in)
+SOURCE_INDEX = {
+    "ESA": ("esa_scraper", "esa_images"),
+    "NASA": ("nasa_scraper", "nasa_images"),
+    "JAXA": ("jaxa_scraper", "jaxa_images"),
+    "APOD": ("apod_scraper", "apod_images"),
+    "CNSA": ("cnsa_scraper", "cnsa_images"),
+}
+
+# name: label used in summaries and on the command line
+# outdir: directory the source's images are saved in
+# records: generator function called with the run options as keyword arguments
+# limit: maximum number of images saved per crawl, or None; a crawl resumed
+#     with --resume counts the images its checkpoint's "downloaded_count" says
+#     the interrupted run saved
+# hosts: {host: (floor, ceiling)} request rates in requests per second
+Source = namedtuple("Source", ["name", "outdir", "records", "limit", "hosts"])
+
+SOURCES = {}
+
+def register_source(name, outdir, limit=None, hosts=None):
+    """Decorator registering a record generator as an image source"""
+    def decorator(records):
+        SOURCES[name] = Source(name, outdir, records, limit, hosts or {})
+        for host, (floor, ceiling) in (hosts or {}).items():
+            set_host_limits(host, floor, ceiling)
+        return records
+    return decorator
+
+def select_sources(only=None):
+    """
+    Resolve a comma-separated list of source names, e.g. "esa,apod"
+
+    Names are matched case-insensitively against SOURCE_INDEX.
+
+    Returns:
+        List of source names in SOURCE_INDEX order (all of them if only is empty)
+
+    Raises:
+        ValueError: If a name is not a known source
+    """
+    if not only:
+        return list(SOURCE_INDEX)
+    wanted = {name.strip().upper() for name in only.split(",") if name.strip()}
+    unknown = wanted - set(SOURCE_INDEX)
+    if unknown:
+        raise ValueError(f"unknown source {', '.join(sorted(unknown))} (choose from {', '.join(SOURCE_INDEX)})")
+    return [name for name in SOURCE_INDEX if name in wanted]
+
+def source_outdirs(names=None):
+    """Image directories of the given sources, without importing their modules"""
+    return [SOURCE_INDEX[name][1] for name in names or SOURCE_INDEX]
+
+def load_sources(names=None):
+    """
+    Import source modules so their sources register themselves
+
+    Args:
+        names: Source names to load (default: all in SOURCE_INDEX)
+
+    Returns:
+        Dictionary mapping each requested name to its Source
+    """
+    names = names or list(SOURCE_INDEX)
+    for name in names:
+        importlib.import_module(SOURCE_INDEX[name][0])
+    return {name: SOURCES[name] for name in names}
+
+class SourceLimitReached(BaseException):
+    """
+    Thrown into a source's generator once the runner has saved its limit of images
+
+    A source with a checkpoint catches it to finish its crawl as complete;
+    a generator that is closed instead (GeneratorExit) was interrupted. It is
+    not an Exception, so the scrapers' error handlers let it through.
+    """
+
+class _RunState:
+    """Image URLs handed on so far, shared by all sources of one run"""
+
+    def __init__(self):
+        self.seen_urls = set()
+        self.lock = threading.Lock()
+
+    def claim(self, image_url):
+        with self.lock:
+            if image_url in self.seen_urls:
+                return False
+            self.seen_urls.add(image_url)
+            return True
+
+class _Outcomes:
+    """How the records one source emitted ended, as their on_done callbacks report it"""
+
+    # on_done outcome -> summary count (images already on disk are not counted)
+    KEYS = {"saved": "saved", "duplicate": "duplicates", "failed": "failed"}
+
+    def __init__(self):
+        self.counts = {"saved": 0, "duplicates": 0, "failed": 0}
+        self.pending = 0
+        self._condition = threading.Condition()
+
+    def track(self, on_done):
+        """Return an on_done that counts the outcome and passes it on; only its first call counts"""
+        with self._condition:
+            self.pending += 1
+        reported = []
+
+        def done(outcome):
+            with self._condition:
+                if reported:
+                    return
+                reported.append(outcome)
+                self.pending -= 1
+                if outcome in self.KEYS:
+                    self.counts[self.KEYS[outcome]] += 1
+                self._condition.notify_all()
+            report_outcome(on_done, outcome)
+
+        return done
+
+    def wait(self):
+        """Block until every tracked record has reported"""
+        with self._condition:
+            while self.pending:
+                self._condition.wait()
+
+def _drain(source, options, state):
+    """
+    Pull every record from one source and emit it
+
+    Only records whose image was saved count toward the source's limit;
+    with the download pipeline that is known once the download has finished,
+    so draining waits for the queued records when they could reach the limit.
+    Once the limit is reached, SourceLimitReached is thrown into the
+    source's generator; it is closed in any case when draining stops.
+
+    Returns:
+        Dictionary with the saved, duplicate and failed counts
+    """
+    outcomes = _Outcomes()
+    counts = outcomes.counts
+    force_redownload = options.get("force_redownload", False)
+    saved_before = 0
+    if source.limit is not None and options.get("resume"):
+        saved_before = (load_checkpoint(source.name) or {}).get("downloaded_count", 0)
+
+    records = source.records(**options)
+    try:
+        for record in records:
+            on_done = outcomes.track(record.on_done)
+            if not state.claim(record.image_url):
+                on_done("duplicate")
+                continue
+
+            try:
+                emit_image(record.source, record.title, record.image_url, record.description,
+                           record.outdir, force_redownload, False, on_done)
+            except Exception as e:
+                print(f"{source.name}: error saving {record.title}: {e}")
+                on_done("failed")
+
+            if source.limit is None:
+                continue
+            if saved_before + counts["saved"] + outcomes.pending >= source.limit:
+                outcomes.wait()
+            if saved_before + counts["saved"] >= source.limit:
+                print(f"{source.name}: reached the limit of {source.limit} images")
+                try:
+                    records.throw(SourceLimitReached())
+                except (SourceLimitReached, StopIteration):
+                    pass
+                break
+    finally:
+        records.close()
+    # The summary reports saves, not records still queued for download
+    outcomes.wait()
+    return counts
+
+def run_sources(names=None, options=None, workers=1):
+    """
+    Run image sources and print one combined summary
+
+    All sources share one pool of worker threads; each worker drains one
+    source at a time, so the wall-clock time approaches the slowest source
+    once there are as many workers as sources.
+
+    Args:
+        names: Source names to run, in order (default: all registered sources)
+        options: Run options passed to every source generator as keyword arguments
+        workers: Number of sources to run at the same time
+
+    Returns:
+        Dictionary mapping source name to (status, elapsed seconds, counts)
+    """
+    options = options or {}
+    names = names or list(SOURCES)
+    state = _RunState()
+    results = {}
+
+    def timed(name):
+        started = time.monotonic()
+        counts = {}
+        try:
+            # Requests made on this thread while the source runs are labelled with it
+            with metrics.agency(name):
+                counts = _drain(SOURCES[name], options, state)
+            status = "ok"
+        except Exception as e:
+            print(f"{name} scraper failed: {e}")
+            status = f"failed: {e}"
+        return status, time.monotonic() - started, counts
+
+    run_started = time.monotonic()
+    if workers <= 1:
+        for name in names:
+            results[name] = timed(name)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scraper") as executor:
+            futures = {executor.submit(timed, name): name for name in names}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    total_elapsed = time.monotonic() - run_started
+
+    # Combined summary, in the order the sources were requested
+    print("\n=== Scraping summary ===")
+    for name in names:
+        status, elapsed, counts = results[name]
+        detail = ", ".join(f"{n} {key}" for key, n in counts.items() if n)
+        print(f"{name:<6} {elapsed:8.1f}s  {status}" + (f" ({detail})" if detail else ""))
+    print(f"Total wall-clock time: {total_elapsed:.1f}s "
+          f"(sum of agencies: {sum(elapsed for _, elapsed, _ in results.values()):.1f}s)")
+    return results
+
+def run_source(name, **options):
+    """Run a single registered source; used by the scrape_*_images wrappers"""
+    load_sources([name])
+    return run_sources([name], options)[name]
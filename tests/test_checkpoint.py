@@ -0,0 +1,43 @@
+import threading
+from checkpoint import CrawlProgress, load_checkpoint, save_checkpoint, clear_checkpoint
+
+def test_wait_blocks_until_tracked_records_finish():
+    progress = CrawlProgress()
+    on_done = progress.track("a")
+    waited = threading.Event()
+    waiter = threading.Thread(target=lambda: (progress.wait(), waited.set()))
+    waiter.start()
+    assert not waited.wait(0.1)
+
+    on_done("saved")
+    waiter.join(1)
+    assert waited.is_set()
+    assert progress.finished == {"a"} and progress.saved == {"a"} and progress.new == 1
+
+def test_outcomes():
+    progress = CrawlProgress(finished=["old"])
+    for key, outcome in [("saved", "saved"), ("exists", "exists"), ("failed", "failed"), ("dup", "duplicate")]:
+        progress.track(key)(outcome)
+    progress.complete("no image")
+    assert progress.finished == {"old", "saved", "exists", "failed", "dup", "no image"}
+    assert progress.saved == {"saved", "exists"}
+    assert progress.new == 1
+
+def test_only_the_first_outcome_counts():
+    progress = CrawlProgress()
+    on_done = progress.track("a")
+    on_done("failed")
+    on_done("saved")
+    progress.wait()
+    assert progress.saved == set() and progress.new == 0
+
+def test_on_change_runs_after_every_item(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    progress = CrawlProgress(on_change=lambda p: save_checkpoint("test", sorted(p.finished)))
+    callbacks = [progress.track(key) for key in "abc"]
+    callbacks[1]("saved")
+    assert load_checkpoint("test") == ["b"]
+    callbacks[0]("failed")
+    assert load_checkpoint("test") == ["a", "b"]
+    clear_checkpoint("test")
+    assert load_checkpoint("test") is None
@@ -0,0 +1,86 @@
+from itertools import islice
+from types import SimpleNamespace
+import pytest
+import esa_scraper
+from checkpoint import load_checkpoint
+
+PAGE_2 = f"{esa_scraper.BASE_URL}/listing/2"
+
+def listing(links, next_url=None):
+    items = "".join(f'<div class="feature-item"><a class="cta popup" href="{link}">more</a></div>' for link in links)
+    next_link = f'<a class="next" href="{next_url}">Next</a>' if next_url else ""
+    return f"<html><body>{items}{next_link}</body></html>"
+
+def detail(n):
+    return (f'<html><head><meta property="og:image" content="https://images.example/{n}.jpg"></head>'
+            f'<body><h1>Image {n}</h1><div class="modal__tab-description">About image {n}</div></body></html>')
+
+@pytest.fixture
+def esa_site(tmp_path, monkeypatch):
+    """Two listing pages of two detail pages each; checkpoints go to tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    pages = {
+        esa_scraper.START_URL: listing(["/detail/1", "/detail/2"], "/listing/2"),
+        PAGE_2: listing(["/detail/3", "/detail/4"]),
+    }
+    for n in range(1, 5):
+        pages[f"{esa_scraper.BASE_URL}/detail/{n}"] = detail(n)
+
+    def get(url, **kwargs):
+        return SimpleNamespace(status_code=200, content=pages[url].encode("utf-8"), not_modified=False)
+
+    monkeypatch.setattr(esa_scraper, "cached_get", get)
+    monkeypatch.setattr(esa_scraper, "http_get", get)
+    return pages
+
+def titles(records):
+    return [record.title for record in records]
+
+def test_checkpoint_waits_for_queued_records(esa_site):
+    records = esa_scraper.esa_records()
+    page_1 = list(islice(records, 2))
+    for record in page_1:
+        record.on_done("saved")
+    # Page 2 is handed on but still queued when the run dies
+    assert titles(islice(records, 2)) == ["Image 3", "Image 4"]
+    records.close()
+
+    state = load_checkpoint("esa")
+    assert state["current_url"] == PAGE_2
+    assert len(state["seen_links"]) == 2
+
+    resumed = esa_scraper.esa_records(resume=True)
+    page_2 = list(islice(resumed, 2))
+    assert titles(page_2) == ["Image 3", "Image 4"]
+    for record in page_2:
+        record.on_done("saved")
+    assert list(resumed) == []
+    assert load_checkpoint("esa") is None
+
+def test_unfinished_first_page_is_not_checkpointed(esa_site):
+    records = esa_scraper.esa_records()
+    assert titles(islice(records, 2)) == ["Image 1", "Image 2"]
+    records.close()
+    assert load_checkpoint("esa") is None
+
+def test_only_saved_images_become_known(esa_site):
+    records = esa_scraper.esa_records()
+    outcomes = iter(["saved", "failed", "exists", "duplicate"])
+    for record in records:
+        record.on_done(next(outcomes))
+
+    known = esa_scraper.load_known_items("esa")
+    assert known == {f"{esa_scraper.BASE_URL}/detail/1", f"{esa_scraper.BASE_URL}/detail/3"}
+
+    # An incremental run retries the images that were not saved
+    retried = []
+    for record in esa_scraper.esa_records(incremental=True):
+        retried.append(record.title)
+        record.on_done("saved")
+    assert retried == ["Image 2", "Image 4"]
+
+def test_next_link_with_several_rel_tokens():
+    page = ('<div class="feature-item"><a class="cta popup" href="/detail/1">more</a></div>'
+            '<a rel="next nofollow" href="/listing/2">Next</a>')
+    soup = esa_scraper.make_soup(page, esa_scraper.keep_esa_listing)
+    assert esa_scraper.parse_esa_listing(soup) == ([f"{esa_scraper.BASE_URL}/detail/1"], PAGE_2)
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+import nasa_scraper
+from checkpoint import load_checkpoint, load_known_items
+
+def search_item(n):
+    return {
+        "href": f"https://images-assets.example/{n}/collection.json",
+        "data": [{"nasa_id": f"id{n}", "title": f"Image {n}", "description": "A description long enough to keep."}],
+        "links": [{"href": f"https://images-assets.example/{n}/image~large.jpg", "render": "image"}],
+    }
+
+def test_harvest_marks_only_saved_items_done(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    page = {"collection": {"items": [search_item(n) for n in (1, 2, 3)], "links": []}}
+    monkeypatch.setattr(nasa_scraper, "cached_get", lambda url, params=None: SimpleNamespace(
+        status_code=200, json=lambda: page, not_modified=False))
+    options = {"queries": ["q"], "year_ranges": [(2000, 2001)]}
+
+    outcomes = {"Image 1": "saved", "Image 2": "failed", "Image 3": "exists"}
+    for record in nasa_scraper.nasa_harvest_records(**options):
+        record.on_done(outcomes[record.title])
+    assert load_known_items("nasa") == {"id1", "id3"}
+    assert [entry[0] for entry in load_checkpoint("nasa_harvest_retry")] == ["id2"]
+
+    # The closed range is complete, but the failed item is retried
+    retried = []
+    for record in nasa_scraper.nasa_harvest_records(**options):
+        retried.append(record.title)
+        record.on_done("saved")
+    assert retried == ["Image 2"]
+    assert load_known_items("nasa") == {"id1", "id2", "id3"}
+    assert load_checkpoint("nasa_harvest_retry") == []
@@ -0,0 +1,24 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import utils
+from overlay_manifest import file_hash
+
+def fake_fetch(image_url, img_path, force_redownload=False):
+    Image.new("RGB", (120, 80), (len(image_url), 40, 80)).save(img_path, "JPEG")
+    return file_hash(img_path), True
+
+def test_downloads_record_their_overlays_in_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "fetch_image", fake_fetch)
+    monkeypatch.setattr(utils, "record_image", lambda *args: None)
+    outdir = str(tmp_path / "images")
+
+    def save(i):
+        return utils.save_image_data("TEST", f"Image {i}", f"https://example.org/{'x' * i}.jpg", f"Text {i}", outdir)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(save, range(8)))
+    utils.save_overlay_manifests()
+
+    # Everything rendered while downloading is up to date for regeneration
+    assert utils.regenerate_overlays([outdir], jobs=1) == (0, [])
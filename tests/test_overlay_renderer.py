@@ -0,0 +1,36 @@
+from PIL import Image, ImageChops, ImageDraw
+import utils
+import overlay_renderer
+from overlay_renderer import OverlayRenderer, TEXT_COLOR
+
+LINES = [
+    "Hello World, AVATAR Wave fjord",
+    "The quick brown fox jumps over the lazy dog",
+    "Typography: 'Ta' \"Vo\" ff fi",
+]
+
+def draw(line, with_renderer):
+    renderer = OverlayRenderer(utils.OVERLAY_SETTINGS)
+    canvas = Image.new("RGBA", (800, 60), (0, 0, 0, 0))
+    if with_renderer:
+        renderer._draw_line(ImageDraw.Draw(canvas), 10, 10, line)
+    else:
+        ImageDraw.Draw(canvas).text((10, 10), line, font=renderer.font, fill=TEXT_COLOR)
+    return canvas
+
+def test_glyph_cache_matches_imagedraw_text_within_one_level():
+    for line in LINES:
+        difference = ImageChops.difference(draw(line, True), draw(line, False))
+        assert all(high <= 1 for _, high in difference.getextrema()), line
+
+def test_panel_cache_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(overlay_renderer, "PANEL_CACHE_BYTES", 3 * 1000 * 100 * 4)
+    renderer = OverlayRenderer(utils.OVERLAY_SETTINGS)
+    for i in range(10):
+        renderer.panel(renderer.layout(f"Description {i}", 60), 1000, 99, 100)
+    assert len(renderer._panels) == 3
+    assert renderer._panel_bytes == 3 * 1000 * 100 * 4
+
+    # A wide image's panel is drawn but not kept
+    renderer.panel(renderer.layout("Wide", 60), 6000, 719, 720)
+    assert len(renderer._panels) == 3
@@ -0,0 +1,41 @@
+import os
+from PIL import Image
+import utils
+from pipeline import ImagePipeline
+from memory_budget import get_memory_budget
+from overlay_manifest import OverlayManifest
+
+def test_memory_budget_defers_large_overlays_and_records_reduced_decodes(tmp_path, monkeypatch):
+    # PNGs have no reduced decode, so the large one is deferred at full cost;
+    # the JPEG is decoded at 1/4 scale to fit into the budget, still more
+    # than one worker's share
+    jobs = []
+    for name, size in (("small.png", (100, 100)), ("large.png", (2000, 1500)), ("huge.jpg", (4000, 3000))):
+        img_path = os.path.join(str(tmp_path), name)
+        Image.new("RGB", size, (20, 40, 60)).save(img_path)
+        overlay_path, _ = utils._overlay_paths(img_path)
+        jobs.append((name, img_path, f"Description of {name}", overlay_path, "TEST", None))
+    monkeypatch.setattr(get_memory_budget(), "limit", 10 * 1000 * 1000)
+
+    pipeline = ImagePipeline(download_workers=1, overlay_workers=2)
+    pipeline.start()
+    for job in jobs:
+        pipeline.overlay_queue.put(job)
+    stats = pipeline.close()
+
+    assert (stats["deferred"], stats["overlays"], stats["overlay_failures"]) == (2, 3, 0)
+    huge_path, huge_overlay = jobs[2][1], jobs[2][3]
+    with Image.open(huge_overlay) as overlay:
+        assert overlay.size == (1000, 750)
+    manifest = OverlayManifest.load(str(tmp_path))
+    assert [manifest.get(job[1])["decode_max_dimension"] for job in jobs] == [None, None, 1000]
+
+    # Without the budget only the overlay that was reduced is stale (the
+    # download workers would have written the descriptions)
+    monkeypatch.setattr(get_memory_budget(), "limit", None)
+    for _, img_path, description, _, _, _ in jobs:
+        utils.write_description(description, utils._overlay_paths(img_path)[1])
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1) == (1, [])
+    with Image.open(huge_overlay) as overlay:
+        assert overlay.size == (4000, 3000)
+    assert OverlayManifest.load(str(tmp_path)).get(huge_path)["decode_max_dimension"] is None
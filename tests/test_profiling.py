@@ -0,0 +1,23 @@
+import tracemalloc
+import profiling
+
+@profiling.trace_memory
+def inner():
+    return bytearray(1000)
+
+@profiling.trace_memory
+def outer():
+    buffer = bytearray(20 * 1000 * 1000)
+    del buffer
+    return inner()
+
+def test_nested_calls_keep_the_outer_peak(monkeypatch):
+    monkeypatch.setattr(profiling, "_memory_calls", {})
+    tracemalloc.start()
+    try:
+        outer()
+    finally:
+        tracemalloc.stop()
+    calls, largest, _ = profiling._memory_calls["outer"]
+    assert calls == 1 and largest >= 20 * 1000 * 1000
+    assert profiling._memory_calls["inner"][0] == 1
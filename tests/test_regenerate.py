@@ -0,0 +1,77 @@
+import os
+from multiprocessing import get_context
+from PIL import Image
+import utils
+from overlay_manifest import OverlayManifest, settings_hash
+
+def make_originals(directory, count=2, size=(400, 200)):
+    paths = []
+    for i in range(count):
+        img_path = os.path.join(directory, f"image {i}.jpg")
+        Image.new("RGB", size, (30 * i, 60, 90)).save(img_path)
+        with open(os.path.join(directory, f"image {i}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Description of image {i}")
+        paths.append(img_path)
+    return paths
+
+def test_spawned_workers_render_with_parent_settings(tmp_path, monkeypatch):
+    monkeypatch.setitem(utils.OVERLAY_SETTINGS, "max_dimension", 100)
+    paths = make_originals(str(tmp_path))
+
+    regenerated, errors = utils.regenerate_overlays([str(tmp_path)], jobs=2, mp_context=get_context("spawn"))
+
+    assert (regenerated, errors) == (2, [])
+    for img_path in paths:
+        overlay_path, _ = utils._overlay_paths(img_path)
+        with Image.open(overlay_path) as overlay:
+            assert max(overlay.size) == 100
+    manifest = OverlayManifest.load(str(tmp_path))
+    params_hash = settings_hash(utils.render_settings())
+    assert all(manifest.get(img_path)["params_sha256"] == params_hash for img_path in paths)
+
+def test_unchanged_images_are_not_rendered_again(tmp_path):
+    make_originals(str(tmp_path))
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1)[0] == 2
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1)[0] == 0
+
+def enable_derivatives(monkeypatch):
+    monkeypatch.setitem(utils.DERIVATIVE_SETTINGS, "enabled", True)
+    monkeypatch.setitem(utils.DERIVATIVE_SETTINGS, "formats", ["jpeg"])
+
+def test_enabling_derivatives_does_not_render_overlays_again(tmp_path, monkeypatch):
+    paths = make_originals(str(tmp_path))
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1)[0] == 2
+    overlay_mtimes = [os.stat(utils._overlay_paths(img_path)[0]).st_mtime_ns for img_path in paths]
+
+    enable_derivatives(monkeypatch)
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1) == (0, [])
+
+    assert [os.stat(utils._overlay_paths(img_path)[0]).st_mtime_ns for img_path in paths] == overlay_mtimes
+    for img_path in paths:
+        assert all(os.path.exists(path) for path in utils.derivative_paths(img_path))
+    manifest = OverlayManifest.load(str(tmp_path))
+    assert all(manifest.get(img_path)["derivatives_sha256"] == utils.derivatives_hash() for img_path in paths)
+
+def test_deleted_derivatives_are_made_again(tmp_path, monkeypatch):
+    enable_derivatives(monkeypatch)
+    paths = make_originals(str(tmp_path))
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1)[0] == 2
+    thumbnail = utils.derivative_path(paths[0], "thumb", "jpeg")
+    os.remove(thumbnail)
+
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1) == (0, [])
+    assert os.path.exists(thumbnail)
+
+def test_changed_derivative_settings_remake_only_derivatives(tmp_path, monkeypatch):
+    enable_derivatives(monkeypatch)
+    paths = make_originals(str(tmp_path))
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1)[0] == 2
+    thumbnail = utils.derivative_path(paths[0], "thumb", "jpeg")
+    params_hash = settings_hash(utils.render_settings())
+
+    monkeypatch.setitem(utils.DERIVATIVE_SETTINGS, "sizes", {"thumb": [64, False], "preview": [1280, True]})
+    assert settings_hash(utils.render_settings()) == params_hash
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1) == (0, [])
+    with Image.open(thumbnail) as img:
+        assert max(img.size) == 64
+    assert utils.regenerate_overlays([str(tmp_path)], jobs=1) == (0, [])
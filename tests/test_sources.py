@@ -0,0 +1,156 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+import sources
+import jaxa_scraper
+from async_engine import iter_async_records
+from checkpoint import load_checkpoint, save_checkpoint
+from utils import ImageRecord
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Record emitted titles; every save succeeds at once"""
+    titles = []
+
+    def emit(source, title, image_url, description, outdir, force_redownload, recreate_overlays, on_done=None):
+        titles.append(title)
+        if on_done:
+            on_done("saved")
+        return True
+
+    monkeypatch.setattr(sources, "emit_image", emit)
+    return titles
+
+def fake_source(monkeypatch, records, limit=None):
+    events = []
+
+    def generator(**options):
+        try:
+            for n in range(records):
+                yield ImageRecord("FAKE", f"Image {n}", f"https://example.org/{n}.jpg", "", "fake_images")
+            events.append("end")
+        except sources.SourceLimitReached:
+            events.append("limit")
+        except GeneratorExit:
+            events.append("closed")
+            raise
+
+    monkeypatch.setitem(sources.SOURCES, "FAKE", sources.Source("FAKE", "fake_images", generator, limit, {}))
+    return events
+
+def test_limit_completes_the_source(monkeypatch, emitted):
+    events = fake_source(monkeypatch, 5, limit=2)
+    status, _, counts = sources.run_sources(["FAKE"])["FAKE"]
+    assert status == "ok" and counts["saved"] == 2
+    assert emitted == ["Image 0", "Image 1"]
+    assert events == ["limit"]
+
+def test_resumed_crawl_counts_earlier_saves(tmp_path, monkeypatch, emitted):
+    monkeypatch.chdir(tmp_path)
+    fake_source(monkeypatch, 5, limit=3)
+    save_checkpoint("fake", {"downloaded_count": 2})
+    sources.run_sources(["FAKE"], {"resume": True})
+    assert emitted == ["Image 0"]
+
+def test_limit_counts_only_finished_saves(monkeypatch):
+    events = fake_source(monkeypatch, 6, limit=2)
+    emitted = []
+
+    def queue(source, title, image_url, description, outdir, force_redownload, recreate_overlays, on_done=None):
+        # Queued like the pipeline does; odd images fail to download later
+        emitted.append(title)
+        outcome = "failed" if int(title.split()[-1]) % 2 else "saved"
+        threading.Timer(0.01, on_done, (outcome,)).start()
+        return True
+
+    monkeypatch.setattr(sources, "emit_image", queue)
+    status, _, counts = sources.run_sources(["FAKE"])["FAKE"]
+    assert status == "ok" and counts == {"saved": 2, "duplicates": 0, "failed": 1}
+    assert emitted == ["Image 0", "Image 1", "Image 2"]
+    assert events == ["limit"]
+
+def test_interrupted_source_is_closed(monkeypatch):
+    events = fake_source(monkeypatch, 5, limit=10)
+
+    def emit(*args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(sources, "emit_image", emit)
+    with pytest.raises(KeyboardInterrupt):
+        sources.run_sources(["FAKE"])
+    assert events == ["closed"]
+
+def test_duplicates_are_reported(monkeypatch, emitted):
+    outcomes = []
+
+    def generator(**options):
+        for _ in range(2):
+            yield ImageRecord("FAKE", "Same", "https://example.org/same.jpg", "", "fake_images", outcomes.append)
+
+    monkeypatch.setitem(sources.SOURCES, "FAKE", sources.Source("FAKE", "fake_images", generator, None, {}))
+    sources.run_sources(["FAKE"])
+    assert outcomes == ["saved", "duplicate"]
+
+def test_async_records_reach_the_runner(monkeypatch, emitted):
+    cancelled = []
+
+    async def scrape(emit, count):
+        try:
+            for n in range(count):
+                await emit(ImageRecord("FAKE", f"Image {n}", f"https://example.org/{n}.jpg", "", "fake_images"))
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    def generator(**options):
+        try:
+            yield from iter_async_records(scrape, 100)
+        except sources.SourceLimitReached:
+            pass
+
+    monkeypatch.setitem(sources.SOURCES, "FAKE", sources.Source("FAKE", "fake_images", generator, 3, {}))
+    assert sources.run_sources(["FAKE"])["FAKE"][2]["saved"] == 3
+    assert emitted == ["Image 0", "Image 1", "Image 2"]
+    assert cancelled == [True]
+
+def test_async_scrape_errors_are_raised():
+    async def scrape(emit):
+        await emit("record")
+        raise RuntimeError("listing failed")
+
+    records = iter_async_records(scrape)
+    assert next(records) == "record"
+    with pytest.raises(RuntimeError, match="listing failed"):
+        next(records)
+
+@pytest.fixture
+def jaxa_site(tmp_path, monkeypatch):
+    """A landing page with two categories of three images; checkpoints go to tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    pages = {jaxa_scraper.ARCHIVE_URL: '<div class="category"><a href="/cat/1">1</a></div>'
+                                       '<div class="category"><a href="/cat/2">2</a></div>'}
+    for c in (1, 2):
+        pages[f"{jaxa_scraper.JAXA_ROOT}cat/{c}"] = "".join(
+            f'<img src="/img/{c}{n}.jpg" alt="Image {c}{n}">' for n in range(3))
+
+    def get(url, **kwargs):
+        return SimpleNamespace(status_code=200, content=pages[url].encode("utf-8"), not_modified=False)
+
+    monkeypatch.setattr(jaxa_scraper, "cached_get", get)
+    monkeypatch.setattr(jaxa_scraper, "http_get", get)
+    monkeypatch.setitem(sources.SOURCES, "JAXA", sources.SOURCES["JAXA"]._replace(limit=4))
+
+def test_jaxa_resume_keeps_count_and_limit_clears_checkpoint(jaxa_site, emitted):
+    # An interrupted run: the first category is saved, the second one was started
+    records = jaxa_scraper.jaxa_records()
+    for _ in range(3):
+        next(records).on_done("saved")
+    next(records)
+    records.close()
+    assert load_checkpoint("jaxa") == {"category_index": 1, "downloaded_count": 3}
+
+    sources.run_sources(["JAXA"], {"resume": True})
+    assert emitted == ["Image 20"]
+    assert load_checkpoint("jaxa") is None
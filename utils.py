@@ -1,87 +1,319 @@
 import os
-import csv
 import time
-import requests
-from bs4 import BeautifulSoup
-from PIL import Image, ImageDraw, ImageFont
+from urllib.parse import urljoin
+from PIL import Image
 import io
-import textwrap
 import glob
+import uuid
+import hashlib
+import threading
+from collections import namedtuple
+from itertools import chain, repeat
+from blob_store import get_blob_store
+from catalog import get_catalog
+from overlay_manifest import (
+    OverlayManifest, settings_hash, overlay_fingerprint, file_hash, same_inputs, derivatives_current,
+)
+from metrics import record_event, count, timed
+from memory_budget import get_memory_budget, plan_render
+from profiling import trace_memory
 
-HEADERS = {"User-Agent": "Mozilla/5.0"}
-CSV_FILE = "./data/image_catalog.csv"
+# The HTTP client lives in http_client.py and is only imported once something
+# asks for it, so modes that never touch the network (--recreate-overlays)
+# start without loading requests and urllib3. These names stay importable
+# from utils for the scrapers.
+_HTTP_CLIENT_NAMES = {
+    "HEADERS", "HTTP_TIMEOUT", "HTTP_RETRIES", "HTTP_BACKOFF", "HTTP_POOL_SIZE", "HTTP_MAX_PER_HOST",
+    "TimedHTTPAdapter", "configure_http", "get_session", "http_get", "http_stream",
+}
+
+def __getattr__(name):
+    if name in _HTTP_CLIENT_NAMES:
+        import http_client
+        return getattr(http_client, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+CSV_FILE = "./data/image_catalog.csv"  # CSV export of the SQLite catalog (see catalog.py)
+
+# Overlay rendering parameters. Changing any of them makes existing overlays
+# stale for incremental regeneration (see overlay_manifest.py); bump "version"
+# when the rendering code itself changes.
+OVERLAY_SETTINGS = {
+    "max_width": 60,            # characters per wrapped line
+    "description_limit": 1600,  # characters of description drawn
+    "line_height": 24,
+    "padding": 20,
+    "font": "Arial",
+    "font_size": 20,
+    "max_dimension": None,      # downscale originals larger than this (pixels)
+    # Encoder options for JPEG overlays (other formats use Pillow's defaults)
+    "jpeg": {"quality": 88, "optimize": True, "progressive": True},
+    "version": 2,
+}
+
+# Smaller renditions for the web front end, made from the same decode as the
+# overlay (see create_derivatives) and saved as
+# <outdir>/derivatives/<name>_<size><ext>. The manifests hash them apart
+# from OVERLAY_SETTINGS (see derivatives_hash): changing them, or turning
+# derivatives on, remakes the derivatives but not the overlays.
+DERIVATIVES_DIR = "derivatives"
+DERIVATIVE_SETTINGS = {
+    "enabled": False,
+    # size name -> (longest side in pixels, draw the description box)
+    "sizes": {"thumb": [320, False], "preview": [1280, True]},
+    "formats": ["jpeg", "webp"],
+    # format -> (Pillow format, file extension, encoder options)
+    "encoders": {
+        "jpeg": ["JPEG", ".jpg", {"quality": 82, "optimize": True, "progressive": True, "subsampling": "4:2:0"}],
+        "webp": ["WEBP", ".webp", {"quality": 78, "method": 4}],
+        "avif": ["AVIF", ".avif", {"quality": 60, "speed": 6}],
+    },
+    "version": 1,
+}
+
+# What a scraper hands over for each discovered image. on_done, if set, is
+# called once the save has finished, possibly on a download worker thread,
+# with the outcome: "saved", "exists" (already on disk), "failed" or
+# "duplicate" (another record of this run has the same image URL); see
+# checkpoint.CrawlProgress
+ImageRecord = namedtuple("ImageRecord", ["source", "title", "image_url", "description", "outdir", "on_done"],
+                         defaults=(None,))
+
+# Active ImagePipeline, if any (see pipeline.py)
+_image_pipeline = None
+
+# Overlay manifests of the directories downloads render into, shared by all
+# threads of a run (see record_overlay)
+MANIFEST_SAVE_EVERY = 50
+_manifests = {}
+_manifest_updates = 0
+_manifests_lock = threading.Lock()
+
+def absolute_url(href, base):
+    """
+    Resolve a link found on a page to an absolute URL
+
+    Args:
+        href: Link as written in the page (absolute, root-relative or relative)
+        base: URL of the page, or the site root the page's links are relative to
+    """
+    return urljoin(base, href)
 
 def sanitize_filename(name):
     return "".join(c if c.isalnum() or c in " _-" else "_" for c in name)[:100]
 
-def create_image_with_text_overlay(img_data, description, max_width=60):
-    # Load image from binary data
-    img = Image.open(io.BytesIO(img_data))
-    
-    # Create a semi-transparent overlay
-    overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-    
-    # Try to use a system font, fall back to default if not available
-    try:
-        font = ImageFont.truetype("Arial", 20)
-    except IOError:
-        font = ImageFont.load_default()
-    
-    # Wrap text to fit the width - increased max_width for longer lines
-    wrapper = textwrap.TextWrapper(width=max_width)
-    
-    # Increase character limit from 250 to 800 characters
-    description_limit = 1600
-    wrapped_text = wrapper.fill(description[:description_limit] + ("..." if len(description) > description_limit else ""))
-    
-    # Count the number of lines to determine overlay height
-    lines = wrapped_text.split('\n')
-    num_lines = len(lines)
-    
-    # Calculate overlay dimensions - adjust height based on number of lines
-    line_height = 24
-    padding = 20
-    required_height = (num_lines * line_height) + (padding * 2)
-    
-    # Make sure overlay doesn't exceed 1/4 of the image height (reduced from 1/3)
-    max_overlay_height = img.height // 4
-    overlay_height = min(required_height, max_overlay_height)
-    
-    # For width, use 3/4 of the image width to allow for more text per line
-    overlay_width = int(img.width * 0.75)
-    
-    # Position - shifted more to the right
-    left = int(img.width * 0.15)  # Start at 15% from left edge
-    top = 0
-    right = left + overlay_width
-    bottom = top + overlay_height
-    
-    # Create the background rectangle
-    draw.rectangle([(left, top), (right, bottom)], fill=(0, 0, 0, 180))
-    
-    # Add text to the overlay
-    y_position = top + padding
-    for line in lines:
-        # Position text with padding from the left edge of overlay
-        x_position = left + padding
-        draw.text((x_position, y_position), line, font=font, fill=(255, 255, 255, 255))
-        y_position += line_height
-        
-        # Stop drawing text if we go beyond the overlay height
-        if y_position > bottom - padding:
-            break
-    
-    # Convert images to RGBA if they aren't already
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
-    
-    # Combine the image with the overlay
-    result = Image.alpha_composite(img, overlay)
-    return result
+def open_image(img_source, max_dimension=None):
+    """
+    Open an image from a file path or encoded bytes, optionally at reduced size
 
-def save_image_data(source, title, image_url, description, outdir, force_redownload=False, recreate_overlays=False):
-    os.makedirs(outdir, exist_ok=True)
+    Opening from a path lets Pillow decode straight from the file instead of
+    holding a second, in-memory copy of the encoded image.
+
+    For JPEGs Pillow's draft mode lets the decoder skip detail (1/2, 1/4 or
+    1/8 scale) instead of decoding the full frame and shrinking it afterwards.
+    """
+    if isinstance(img_source, (bytes, bytearray, memoryview)):
+        img_source = io.BytesIO(img_source)
+    img = Image.open(img_source)
+    if max_dimension and max(img.size) > max_dimension:
+        if img.format == "JPEG":
+            # Ask for the image's own aspect ratio: draft mode picks the
+            # reduction the shorter requested side allows, so a square box
+            # would decode wide images at needlessly large size
+            ratio = max_dimension / max(img.size)
+            img.draft("RGB", (max(1, int(img.width * ratio)), max(1, int(img.height * ratio))))
+        img.thumbnail((max_dimension, max_dimension))
+    return img
+
+def encoder_available(pillow_format):
+    """True if this Pillow build (or an installed plugin) can save the format"""
+    Image.init()
+    return pillow_format in Image.SAVE
+
+def configure_derivatives(enabled=None, sizes=None, formats=None):
+    """
+    Change which derivatives are written next to each overlay
+
+    Args:
+        enabled: Write derivatives at all
+        sizes: {name: longest side} replacing the configured sizes; a size
+            keeps its description-box setting if it was configured before
+        formats: Formats to write, keys of DERIVATIVE_SETTINGS["encoders"];
+            ones this Pillow cannot encode (AVIF before Pillow 11.2 without
+            pillow-avif-plugin) are left out with a warning
+
+    Raises:
+        ValueError: For an unknown format
+    """
+    if enabled is not None:
+        DERIVATIVE_SETTINGS["enabled"] = enabled
+    if sizes is not None:
+        old_sizes = DERIVATIVE_SETTINGS["sizes"]
+        DERIVATIVE_SETTINGS["sizes"] = {name: [pixels, old_sizes.get(name, [0, False])[1]]
+                                        for name, pixels in sizes.items()}
+    if formats is not None:
+        encoders = DERIVATIVE_SETTINGS["encoders"]
+        unknown = [fmt for fmt in formats if fmt not in encoders]
+        if unknown:
+            raise ValueError(f"unknown derivative format {', '.join(unknown)} (choose from {', '.join(encoders)})")
+        available = []
+        for fmt in formats:
+            if encoder_available(encoders[fmt][0]):
+                available.append(fmt)
+            else:
+                print(f"WARNING: this Pillow cannot encode {fmt.upper()}; skipping {fmt} derivatives")
+        DERIVATIVE_SETTINGS["formats"] = available
+
+def render_settings():
+    """Everything an overlay render depends on, for the manifests (see settings_hash)"""
+    # Not the memory budget: most renders come out the same with or without
+    # one, so the manifests record the size it reduced an image to instead
+    # (see budget_dimension)
+    return dict(OVERLAY_SETTINGS)
+
+def derivative_path(img_path, name, fmt):
+    """Where the derivative of an original at one size and format is saved"""
+    directory, file_name = os.path.split(img_path)
+    base_name = os.path.splitext(file_name)[0]
+    extension = DERIVATIVE_SETTINGS["encoders"][fmt][1]
+    return os.path.join(directory, DERIVATIVES_DIR, f"{base_name}_{name}{extension}")
+
+def derivative_paths(img_path):
+    """Every derivative file the current settings make from an original"""
+    return [derivative_path(img_path, name, fmt)
+            for name in DERIVATIVE_SETTINGS["sizes"] for fmt in DERIVATIVE_SETTINGS["formats"]]
+
+def derivatives_hash():
+    """Hash of the derivative settings for the manifests, or None while derivatives are disabled"""
+    if not DERIVATIVE_SETTINGS["enabled"]:
+        return None
+    return settings_hash({key: value for key, value in DERIVATIVE_SETTINGS.items() if key != "enabled"})
+
+def _save_options(path):
+    """Encoder options for an overlay, by the format its file name implies"""
+    if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg"):
+        return OVERLAY_SETTINGS["jpeg"]
+    return {}
+
+_renderers = threading.local()
+
+def get_overlay_renderer():
+    """
+    Return this thread's OverlayRenderer for the current OVERLAY_SETTINGS
+
+    Each thread (and each worker process) keeps its own renderer and its
+    caches; a new one is made when the settings change.
+    """
+    renderer = getattr(_renderers, "renderer", None)
+    if renderer is None or renderer.settings != OVERLAY_SETTINGS:
+        from overlay_renderer import OverlayRenderer
+        renderer = _renderers.renderer = OverlayRenderer(OVERLAY_SETTINGS)
+    return renderer
+
+def decode_image(img_source, max_dimension=None):
+    """
+    Decode an image fully as RGB, at reduced size if requested
+
+    Args:
+        img_source: Path of the image file, or encoded image bytes
+        max_dimension: Downscale so the longest side is at most this many pixels
+    """
+    img = open_image(img_source, max_dimension)
+    img.load()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')  # Overlays are saved as RGB
+    return img
+
+@trace_memory
+def create_derivatives(img, description, sizes=None):
+    """
+    Scale a decoded image down to every derivative size
+
+    Sizes are made from largest to smallest, each from the one before, so
+    only the first resize reads the full-size image. Resizing first reduces
+    by an integer factor (reducing_gap) and then resamples with Lanczos,
+    which is fast and keeps thin detail. Images are never enlarged. Sizes
+    marked for it get the description box drawn after scaling, so the text
+    stays readable at its normal size.
+
+    Args:
+        img: Decoded RGB image; it is not modified
+        description: Text for sizes that show the description box
+        sizes: {name: (longest side, draw the box)} (default: DERIVATIVE_SETTINGS)
+
+    Returns:
+        List of (size name, image) pairs
+    """
+    sizes = sizes or DERIVATIVE_SETTINGS["sizes"]
+    derivatives = []
+    current = img
+    for name, (longest, with_overlay) in sorted(sizes.items(), key=lambda item: -item[1][0]):
+        scale = longest / max(current.size)
+        if scale < 1:
+            size = (max(1, round(current.width * scale)), max(1, round(current.height * scale)))
+            current = current.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        derivative = current
+        if with_overlay:
+            derivative = get_overlay_renderer().render(current.copy(), description)
+        elif derivative is img:
+            derivative = img.copy()  # the caller draws the full-size overlay onto img next
+        derivatives.append((name, derivative))
+    return derivatives
+
+def save_derivatives(derivatives, img_path, formats=None):
+    """
+    Encode derivatives in every configured format
+
+    Returns:
+        Total bytes written
+    """
+    formats = formats or DERIVATIVE_SETTINGS["formats"]
+    encoders = DERIVATIVE_SETTINGS["encoders"]
+    os.makedirs(os.path.join(os.path.dirname(img_path), DERIVATIVES_DIR), exist_ok=True)
+    written = 0
+    for name, derivative in derivatives:
+        for fmt in formats:
+            pillow_format, _, options = encoders[fmt]
+            path = derivative_path(img_path, name, fmt)
+            derivative.save(path, pillow_format, **options)
+            written += os.path.getsize(path)
+    return written
+
+@trace_memory
+def create_image_with_text_overlay(img_source, description, max_width=None, max_dimension=None, timings=None):
+    """
+    Draw the description box onto the top of an image
+
+    Only the band at the top of the image covered by the text box is converted
+    to RGBA and alpha-composited; the rest of the frame is left untouched.
+
+    Args:
+        img_source: Path of the image file, or encoded image bytes
+        description: Text to draw
+        max_width: Characters per wrapped line (default: OVERLAY_SETTINGS)
+        max_dimension: Downscale so the longest side is at most this many pixels
+            (default: OVERLAY_SETTINGS, None keeps the original size)
+        timings: Optional dictionary the decode and composite times are added to
+
+    Returns:
+        RGB image with the overlay applied
+    """
+    max_dimension = max_dimension or OVERLAY_SETTINGS["max_dimension"]
+    timings = {} if timings is None else timings
+
+    # Load image from binary data, at reduced size if requested
+    with timed(timings, "decode"):
+        img = decode_image(img_source, max_dimension)
+    with timed(timings, "composite"):
+        return get_overlay_renderer().render(img, description, max_width)
+
+def get_image_paths(title, image_url, outdir):
+    """
+    Work out where an image and its companion files are stored
+
+    Returns:
+        Tuple of (safe_title, img_path, overlay_path, txt_path)
+    """
     safe_title = sanitize_filename(title)
     image_ext = os.path.splitext(image_url)[-1].split("?")[0]
     if not image_ext:
@@ -90,132 +322,598 @@ def save_image_data(source, title, image_url, description, outdir, force_redownl
     img_path = os.path.join(outdir, f"{safe_title}{image_ext}")
     overlay_path = os.path.join(outdir, f"{safe_title}_overlay{image_ext}")
     txt_path = os.path.join(outdir, f"{safe_title}.txt")
+    return safe_title, img_path, overlay_path, txt_path
+
+def download_image(image_url, img_path, chunk_size=64 * 1024):
+    """
+    Stream an image to disk and save the original
+
+    The body is written in chunks to a temporary file next to the destination
+    and renamed into place once complete, so a failed or interrupted download
+    never leaves a truncated original behind. The content hash and size are
+    computed while streaming.
+
+    Returns:
+        Tuple of (sha256 hex digest, size in bytes)
+    """
+    from http_client import http_stream
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = f"{img_path}.{uuid.uuid4().hex}.part"
+    timings = {}
+    status = None
+    try:
+        with http_stream(image_url) as response:
+            status = response.status_code
+            timings.update(response.timings)
+            response.raise_for_status()
+            with open(tmp_path, 'xb') as f:
+                # Time spent in iter_content is the transfer, in f.write the disk
+                started = time.perf_counter()
+                for chunk in response.iter_content(chunk_size):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    with timed(timings, "write"):
+                        f.write(chunk)
+                timings["transfer"] = time.perf_counter() - started - timings.get("write", 0.0)
+        with timed(timings, "write"):
+            os.replace(tmp_path, img_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        record_event("download", status or "error", size, url=image_url, **timings)
+        raise
+    record_event("download", status, size, url=image_url, **timings)
+    return digest.hexdigest(), size
+
+@trace_memory
+def fetch_image(image_url, img_path, force_redownload=False):
+    """
+    Put the original for image_url at img_path, downloading only if needed
+
+    Goes through the content-addressed blob store: a URL already in the
+    catalog (saved by any agency) is linked from the store without a request,
+    and a download whose bytes are already stored is dropped in favour of the
+    existing blob.
+
+    Returns:
+        Tuple of (sha256 hex digest, whether the network was used)
+    """
+    store = get_blob_store()
+    if store is None:
+        sha256, _ = download_image(image_url, img_path)
+        return sha256, True
+
+    sha256 = None
+    if not force_redownload:
+        known = get_catalog().find_by_url(image_url)
+        if known and known["sha256"] and store.has(known["sha256"]):
+            sha256 = known["sha256"]
+    downloaded = sha256 is None
+    if downloaded:
+        staging_path = store.staging_path()
+        sha256, _ = download_image(image_url, staging_path)
+        store.add(staging_path, sha256)
+    store.link(sha256, img_path)
+    return sha256, downloaded
+
+def _render_outputs(img_source, description, overlay_path, max_dimension, timings):
+    """Decode an original once and save its overlay and any derivatives"""
+    if DERIVATIVE_SETTINGS["enabled"] and isinstance(img_source, str):
+        with timed(timings, "decode"):
+            img = decode_image(img_source, max_dimension)
+        with timed(timings, "derive"):
+            derivatives = create_derivatives(img, description)
+            save_derivatives(derivatives, img_source)
+            del derivatives
+        with timed(timings, "composite"):
+            overlay_img = get_overlay_renderer().render(img, description)
+    else:
+        overlay_img = create_image_with_text_overlay(img_source, description, max_dimension=max_dimension,
+                                                     timings=timings)
+    with timed(timings, "encode"):
+        overlay_img.save(overlay_path, **_save_options(overlay_path))
+
+@trace_memory
+def write_overlay(img_source, description, overlay_path, record=True, plan=None, priority=False):
+    """
+    Render the text overlay for an image and save it next to the original
+
+    When derivatives are enabled and img_source is the original's path, they
+    are made from the same decode before the overlay is drawn onto it.
+    With a memory budget (see memory_budget.py) the render holds its share
+    of the budget throughout, and decodes at reduced size if the image does
+    not fit into the budget at all.
+
+    Args:
+        record: Record an "overlay" event; overlay worker processes pass False
+            and leave it to the parent, which holds the run's metrics
+        plan: RenderPlan from memory_budget.plan_render, if the caller made one
+        priority: Reserve the budget ahead of ordinary renders (deferred jobs)
+
+    Returns:
+        Dictionary of the decode, composite, derive and encode times
+    """
+    timings = {}
+    budget = get_memory_budget()
+    plan = plan or _render_plan(img_source)
+    max_dimension = plan.max_dimension if plan else OVERLAY_SETTINGS["max_dimension"]
+    reduced = {"reduced": plan.scale} if plan and plan.scale > 1 else {}
+    try:
+        # The decoded buffers are freed when _render_outputs returns, before
+        # the budget is released
+        with budget.hold(plan.cost if plan else 0, priority):
+            _render_outputs(img_source, description, overlay_path, max_dimension, timings)
+    except Exception:
+        if record:
+            record_event("overlay", "error", path=overlay_path, **timings)
+        raise
+    if record:
+        record_event("overlay", size=os.path.getsize(overlay_path), path=overlay_path, **reduced, **timings)
+    return timings
+
+def _render_plan(img_source):
+    """RenderPlan for an image under the memory budget, or None without a budget"""
+    if get_memory_budget().limit is None:
+        return None
+    source = img_source if isinstance(img_source, str) else io.BytesIO(img_source)
+    return plan_render(source, OVERLAY_SETTINGS["max_dimension"])
+
+def budget_dimension(img_source):
+    """
+    Longest side the memory budget makes an original decode to, for the manifests
+
+    Returns:
+        The reduced size, or None if the image decodes at the size
+        OVERLAY_SETTINGS ask for (always, without a budget)
+    """
+    plan = _render_plan(img_source)
+    if plan is None or plan.max_dimension == OVERLAY_SETTINGS["max_dimension"]:
+        return None
+    return plan.max_dimension
+
+def write_derivatives(img_path, description, record=True):
+    """
+    Make and save the derivatives of an original whose overlay is up to date
+
+    Used when only the derivatives are missing or were made with other
+    settings; the original is decoded as for its overlay, under the same
+    memory budget rules (see write_overlay).
+
+    Returns:
+        Dictionary of the decode and derive times
+    """
+    timings = {}
+    plan = _render_plan(img_path)
+    max_dimension = plan.max_dimension if plan else OVERLAY_SETTINGS["max_dimension"]
+    try:
+        with get_memory_budget().hold(plan.cost if plan else 0):
+            with timed(timings, "decode"):
+                img = decode_image(img_path, max_dimension)
+            with timed(timings, "derive"):
+                written = save_derivatives(create_derivatives(img, description), img_path)
+    except Exception:
+        if record:
+            record_event("overlay", "error", path=img_path, **timings)
+        raise
+    if record:
+        record_event("overlay", "derivatives", written, path=img_path, **timings)
+    return timings
+
+def _stale_output(img_path, overlay_path, entry, fingerprint):
+    """
+    What an original needs rendered, given its manifest entry
+
+    Returns:
+        "overlay" (which also makes any derivatives), "derivatives", or None
+        if both are up to date
+    """
+    if not os.path.exists(overlay_path) or not same_inputs(entry, fingerprint):
+        return "overlay"
+    if not derivatives_current(entry, fingerprint["derivatives_sha256"], derivative_paths(img_path)):
+        return "derivatives"
+    return None
+
+def _shared_manifest(directory):
+    # Callers hold _manifests_lock
+    manifest = _manifests.get(directory)
+    if manifest is None:
+        manifest = _manifests[directory] = OverlayManifest.load(directory)
+    return manifest
+
+def record_overlay(img_path, description, sha256=None):
+    """
+    Note in its directory's manifest what a freshly rendered overlay was made from
+
+    Downloads call this for every overlay they render, from whichever thread
+    rendered it, so the next regeneration finds those overlays up to date.
+    Each directory's manifest is loaded once per run and saved every
+    MANIFEST_SAVE_EVERY updates and by save_overlay_manifests().
+
+    Args:
+        sha256: Hash of the original if the caller knows it (it is read otherwise)
+    """
+    global _manifest_updates
+    fingerprint = overlay_fingerprint(img_path, sha256 or file_hash(img_path), description,
+                                      settings_hash(render_settings()), derivatives_hash(), budget_dimension(img_path))
+    with _manifests_lock:
+        _shared_manifest(os.path.dirname(img_path)).update(img_path, fingerprint)
+        _manifest_updates += 1
+        if _manifest_updates % MANIFEST_SAVE_EVERY == 0:
+            for manifest in _manifests.values():
+                manifest.save()
+
+def save_overlay_manifests():
+    """Write the manifests record_overlay updated; called when a run ends"""
+    with _manifests_lock:
+        for manifest in _manifests.values():
+            manifest.save()
+
+def write_description(description, txt_path):
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write(description)
+
+def record_image(source, title, image_url, description, img_path, sha256=None):
+    """Add a saved image to the catalog"""
+    get_catalog().add(source, title, image_url, description, img_path, sha256, os.path.getsize(img_path))
+
+def report_outcome(on_done, outcome):
+    """Tell the scraper of a record how its save ended (see ImageRecord)"""
+    if on_done is None:
+        return
+    try:
+        on_done(outcome)
+    except Exception as e:
+        print(f"Error recording the outcome of a save: {e}")
+
+@trace_memory
+def save_image_data(source, title, image_url, description, outdir, force_redownload=False, recreate_overlays=False,
+                    on_done=None):
+    os.makedirs(outdir, exist_ok=True)
+    safe_title, img_path, overlay_path, txt_path = get_image_paths(title, image_url, outdir)
 
     # Check if we're in recreate_overlays mode and the original image exists
     if recreate_overlays and os.path.exists(img_path):
         try:
-            # Read the original image instead of downloading it
-            with open(img_path, 'rb') as f:
-                img_data = f.read()
-                
             # Read description from text file if it exists, otherwise use provided description
-            if os.path.exists(txt_path):
-                with open(txt_path, 'r', encoding='utf-8') as f:
-                    description = f.read()
+            description = _read_description(txt_path, description)
+            
+            # Skip overlays already rendered from this image, description and settings
+            sha256 = file_hash(img_path)
+            fingerprint = overlay_fingerprint(img_path, sha256, description, settings_hash(render_settings()),
+                                              derivatives_hash(), budget_dimension(img_path))
+            with _manifests_lock:
+                entry = _shared_manifest(outdir).get(img_path)
+            stale = _stale_output(img_path, overlay_path, entry, fingerprint)
+            if stale is None:
+                print(f"Overlay up to date: {safe_title}")
+                report_outcome(on_done, "exists")
+                return False
             
-            # Create and save the new overlay image
-            overlay_img = create_image_with_text_overlay(img_data, description)
-            overlay_img = overlay_img.convert('RGB')  # Convert to RGB for saving jpg
-            overlay_img.save(overlay_path)
-            print(f"Recreated overlay for: {safe_title}")
+            # Create and save the new overlay image (or only the derivatives) from the original on disk
+            if stale == "derivatives":
+                write_derivatives(img_path, description)
+            else:
+                write_overlay(img_path, description, overlay_path)
+            record_overlay(img_path, description, sha256)
+            print(f"Recreated {'derivatives' if stale == 'derivatives' else 'overlay'} for: {safe_title}")
+            report_outcome(on_done, "exists")
             return True
             
         except Exception as e:
             print(f"Failed to recreate overlay for {title}: {e}")
+            report_outcome(on_done, "failed")
             return False
     
     # Skip if image exists and we're not forcing redownload or just recreating overlays
     if os.path.exists(img_path) and not force_redownload and not recreate_overlays:
         print(f"Skipping (already exists): {safe_title}")
+        count("images_total", outcome="skipped")
+        report_outcome(on_done, "exists")
         return False
 
     # Standard download and save process
     if not recreate_overlays:
         try:
-            img_data = requests.get(image_url, headers=HEADERS).content
-            
-            # Save original image
-            with open(img_path, 'wb') as f:
-                f.write(img_data)
+            sha256, downloaded = fetch_image(image_url, img_path, force_redownload)
                 
             # Create and save image with text overlay
             try:
-                overlay_img = create_image_with_text_overlay(img_data, description)
-                overlay_img = overlay_img.convert('RGB')  # Convert to RGB for saving jpg
-                overlay_img.save(overlay_path)
+                write_overlay(img_path, description, overlay_path)
+                record_overlay(img_path, description, sha256)
             except Exception as e:
                 print(f"Failed to create overlay for {title}: {e}")
 
             # Save description as text file
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(description)
+            write_description(description, txt_path)
 
-            # Record in CSV
-            with open(CSV_FILE, "a", encoding="utf-8", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([source, title, image_url, description, img_path])
+            # Record in the catalog
+            record_image(source, title, image_url, description, img_path, sha256)
 
-            print(f"Saved: {safe_title}")
+            print(f"Saved: {safe_title}" if downloaded else f"Saved (reused earlier download): {safe_title}")
+            count("images_total", outcome="saved" if downloaded else "reused")
+            report_outcome(on_done, "saved")
             return True
         except Exception as e:
             print(f"Failed to save {title}: {e}")
+            count("images_total", outcome="failed")
+            report_outcome(on_done, "failed")
             return False
+    report_outcome(on_done, "failed")  # recreating overlays, but there is no original
+
+def set_image_pipeline(pipeline):
+    """Route emit_image calls to a pipeline (None restores inline saving)"""
+    global _image_pipeline
+    _image_pipeline = pipeline
 
-def regenerate_all_overlays(directory):
+def emit_image(source, title, image_url, description, outdir, force_redownload=False, recreate_overlays=False,
+               on_done=None):
     """
-    Regenerate overlay images for all original images in a directory
-    
+    Hand a discovered image over for saving
+
+    Scrapers call this instead of save_image_data. When a pipeline is active the
+    record is queued for the download workers and the scraper moves straight on
+    to the next page; otherwise the image is saved inline.
+
     Args:
-        directory: Directory containing images to process
-    
+        on_done: Called with the outcome once the save has finished (see ImageRecord)
+
     Returns:
-        Number of overlays regenerated
+        True if the image was queued or saved, False if it was skipped or failed
     """
-    if not os.path.exists(directory):
-        print(f"Directory not found: {directory}")
-        return 0
-        
-    print(f"Regenerating overlays in {directory}...")
-    
-    # Find all images that don't have '_overlay' in the filename
+    pipeline = _image_pipeline
+    if pipeline is None or recreate_overlays:
+        return save_image_data(source, title, image_url, description, outdir, force_redownload, recreate_overlays,
+                               on_done)
+    return pipeline.submit(ImageRecord(source, title, image_url, description, outdir, on_done), force_redownload)
+
+def find_original_images(directory):
+    """List the original images in a directory, skipping generated overlays"""
     image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif']
     original_images = []
     
     for ext in image_extensions:
         pattern = os.path.join(directory, ext)
         original_images.extend([f for f in glob.glob(pattern) if '_overlay' not in f])
-    
-    print(f"Found {len(original_images)} original images")
+    return original_images
+
+def _read_description(txt_path, default="No description available."):
+    if os.path.exists(txt_path):
+        with open(txt_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return default
+
+def _overlay_paths(img_path):
+    directory = os.path.dirname(img_path)
+    base_name, ext = os.path.splitext(os.path.basename(img_path))
+    overlay_path = os.path.join(directory, f"{base_name}_overlay{ext}")
+    txt_path = os.path.join(directory, f"{base_name}.txt")
+    return overlay_path, txt_path
+
+def regenerate_overlay(img_path, old_entry=None, params_hash=None, force=False):
+    """
+    Rebuild the overlay for one original image if it is stale
+
+    Runs in overlay worker processes, so it must stay a module-level function.
+    The original is hashed as it is read; if its content, the description and
+    the render parameters all match old_entry, rendering is skipped, and only
+    missing or outdated derivatives are made.
+
+    Returns:
+        Tuple of (img_path, status, error message or None, manifest fingerprint,
+        render timings) where status is "rendered", "derived" (derivatives
+        only), "unchanged" or "failed"
+    """
+    try:
+        # Paths for related files
+        overlay_path, txt_path = _overlay_paths(img_path)
+        params_hash = params_hash or settings_hash(render_settings())
+        
+        # Read description from text file if it exists
+        description = _read_description(txt_path)
+        fingerprint = overlay_fingerprint(img_path, file_hash(img_path), description, params_hash,
+                                          derivatives_hash(), budget_dimension(img_path))
+        
+        # Content unchanged (e.g. the file was only touched) - nothing to render
+        stale = "overlay" if force else _stale_output(img_path, overlay_path, old_entry, fingerprint)
+        if stale is None:
+            return img_path, "unchanged", None, fingerprint, {}
+        if stale == "derivatives":
+            return img_path, "derived", None, fingerprint, write_derivatives(img_path, description, record=False)
+        
+        # Create and save new overlay, decoding straight from the original file;
+        # the timings go back to the parent, which records the event
+        timings = write_overlay(img_path, description, overlay_path, record=False)
+        return img_path, "rendered", None, fingerprint, timings
+    except Exception as e:
+        return img_path, "failed", str(e), None, {}
+
+def _render_config():
+    """The module-level settings a render depends on, for overlay worker processes"""
+    return dict(OVERLAY_SETTINGS), dict(DERIVATIVE_SETTINGS), get_memory_budget().limit, Image.MAX_IMAGE_PIXELS
+
+def _init_overlay_worker(overlay_settings, derivative_settings, budget_limit, max_image_pixels):
+    """
+    Process pool initializer: render with the parent's settings
+
+    Workers started with spawn or forkserver import this module afresh, so
+    without this they would render with its defaults while the parent records
+    its own settings in the manifests.
+    """
+    OVERLAY_SETTINGS.clear()
+    OVERLAY_SETTINGS.update(overlay_settings)
+    DERIVATIVE_SETTINGS.clear()
+    DERIVATIVE_SETTINGS.update(derivative_settings)
+    get_memory_budget().limit = budget_limit
+    Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+def regenerate_overlays(directories, jobs=None, force=False, mp_context=None):
+    """
+    Regenerate stale overlay images for all original images in several directories
+
+    Each directory keeps a manifest of what its overlays were rendered from
+    (hashes of the original, the description and the render parameters), so
+    only overlays whose inputs changed are rebuilt. With derivatives enabled,
+    originals whose derivatives are missing or were made with other settings
+    get only those remade. The work is spread over a
+    pool of processes so every core renders overlays. A failing image does not
+    stop the run; its error is collected and reported. With a memory budget
+    (see memory_budget.py), images too large to share it with the other
+    workers are rendered after the pool has finished.
+
+    Args:
+        directories: Directories containing images to process
+        jobs: Number of worker processes (default: number of CPUs, 1 runs in-process)
+        force: Re-render every overlay, ignoring the manifests
+        mp_context: multiprocessing context for the worker processes
+            (default: the platform's start method)
+
+    Returns:
+        Tuple of (number of overlays regenerated, list of (img_path, error) pairs)
+    """
+    params_hash = settings_hash(render_settings())
+    derivatives = derivatives_hash()
+    manifests = {}
+    pending = []
+    up_to_date = 0
+    for directory in directories:
+        if not os.path.exists(directory):
+            print(f"Directory not found: {directory}")
+            continue
+        manifest = manifests[directory] = OverlayManifest.load(directory)
+        found = find_original_images(directory)
+        stale = 0
+        for img_path in found:
+            # Cheap stat-based check first; only uncertain images go to the workers
+            overlay_path, txt_path = _overlay_paths(img_path)
+            try:
+                current = not force and manifest.is_current(
+                    img_path, overlay_path, _read_description(txt_path), params_hash,
+                    derivatives, derivative_paths(img_path), budget_dimension(img_path))
+            except Exception:
+                current = False  # unreadable header; the worker reports the error
+            if current:
+                up_to_date += 1
+                continue
+            pending.append((img_path, manifest.get(img_path)))
+            stale += 1
+        print(f"Found {len(found)} original images in {directory} ({stale} to check)")
+
+    total = len(pending)
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, total) if total else 1
+    print(f"Regenerating up to {total} overlays with {jobs} worker(s), {up_to_date} already up to date...")
+
     regenerated_count = 0
+    derived_count = 0
+    unchanged_count = 0
+    errors = []
+    started = time.monotonic()
+    progress_every = max(10, total // 20)
+    img_paths = [img_path for img_path, _ in pending]
+    old_entries = [entry for _, entry in pending]
+
+    if jobs <= 1:
+        results = map(regenerate_overlay, img_paths, old_entries, repeat(params_hash), repeat(force))
+        executor = None
+    else:
+        # With a memory budget, images needing more than one worker's share of
+        # it are held back and rendered here, one at a time, once the pool is done
+        deferred = []
+        if get_memory_budget().limit is not None:
+            pooled = []
+            for img_path, entry in pending:
+                try:
+                    oversized = get_memory_budget().oversized(plan_render(img_path, OVERLAY_SETTINGS["max_dimension"]).cost, jobs)
+                except Exception:
+                    oversized = False  # the worker reports the error
+                (deferred if oversized else pooled).append((img_path, entry))
+            if deferred:
+                print(f"Deferring {len(deferred)} large images until the other overlays are done")
+                img_paths = [img_path for img_path, _ in pooled]
+                old_entries = [entry for _, entry in pooled]
+
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context,
+                                       initializer=_init_overlay_worker, initargs=_render_config())
+        # Hand out work in chunks so per-task IPC stays small next to the rendering
+        chunksize = max(1, min(32, total // (jobs * 8)))
+        results = chain(
+            executor.map(regenerate_overlay, img_paths, old_entries, repeat(params_hash), repeat(force), chunksize=chunksize),
+            map(regenerate_overlay, [img_path for img_path, _ in deferred], [entry for _, entry in deferred],
+                repeat(params_hash), repeat(force)),
+        )
+
+    try:
+        for done, (img_path, status, error, fingerprint, timings) in enumerate(results, 1):
+            directory = os.path.dirname(img_path)
+            if status == "failed":
+                errors.append((img_path, error))
+                print(f"Error regenerating overlay for {img_path}: {error}")
+                record_event("overlay", "error", agency=os.path.basename(directory), path=img_path)
+            else:
+                manifests[directory].update(img_path, fingerprint)
+                if status == "rendered":
+                    record_event("overlay", agency=os.path.basename(directory), path=img_path, **timings)
+                    regenerated_count += 1
+                elif status == "derived":
+                    record_event("overlay", "derivatives", agency=os.path.basename(directory), path=img_path, **timings)
+                    derived_count += 1
+                else:
+                    unchanged_count += 1
+            if done % progress_every == 0 or done == total:
+                elapsed = time.monotonic() - started
+                print(f"Progress: {done}/{total} ({done / elapsed:.1f} images/s)")
+            # Persist progress now and then so an interrupted run is not repeated
+            if done % 500 == 0:
+                for manifest in manifests.values():
+                    manifest.save()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for manifest in manifests.values():
+            manifest.save()
+
+    derived = f", derivatives only for {derived_count}" if derived_count else ""
+    print(f"Regenerated {regenerated_count} overlays{derived}, {up_to_date + unchanged_count} up to date, "
+          f"{len(errors)} failed")
+    return regenerated_count, errors
+
+def regenerate_all_overlays(directory, jobs=1, force=False):
+    """
+    Regenerate stale overlay images for all original images in a directory
     
-    for img_path in original_images:
-        try:
-            # Get base filename
-            filename = os.path.basename(img_path)
-            base_name, ext = os.path.splitext(filename)
-            
-            # Paths for related files
-            overlay_path = os.path.join(directory, f"{base_name}_overlay{ext}")
-            txt_path = os.path.join(directory, f"{base_name}.txt")
-            
-            # Read the original image
-            with open(img_path, 'rb') as f:
-                img_data = f.read()
-            
-            # Read description from text file if it exists
-            description = "No description available."
-            if os.path.exists(txt_path):
-                with open(txt_path, 'r', encoding='utf-8') as f:
-                    description = f.read()
-            
-            # Create and save new overlay
-            overlay_img = create_image_with_text_overlay(img_data, description)
-            overlay_img = overlay_img.convert('RGB')  # Convert to RGB for saving jpg
-            overlay_img.save(overlay_path)
-            
-            regenerated_count += 1
-            if regenerated_count % 10 == 0:
-                print(f"Regenerated {regenerated_count} overlays so far...")
-                
-        except Exception as e:
-            print(f"Error regenerating overlay for {img_path}: {e}")
+    Args:
+        directory: Directory containing images to process
+        jobs: Number of worker processes (default: 1)
+        force: Re-render every overlay even if it is up to date
     
+    Returns:
+        Number of overlays regenerated
+    """
+    if not os.path.exists(directory):
+        print(f"Directory not found: {directory}")
+        return 0
+        
+    print(f"Regenerating overlays in {directory}...")
+    regenerated_count, _ = regenerate_overlays([directory], jobs, force)
     print(f"Regenerated {regenerated_count} overlays in {directory}")
     return regenerated_count
 
-def setup_csv():
+def setup_catalog():
+    """
+    Open the SQLite catalog, importing the old CSV catalog the first time
+
+    Returns:
+        The shared Catalog
+    """
+    catalog = get_catalog()
+    if catalog.is_empty() and os.path.exists(CSV_FILE):
+        imported = catalog.import_csv(CSV_FILE)
+        print(f"Imported {imported} rows from {CSV_FILE} into {catalog.path}")
+    return catalog
+
+def export_catalog_csv():
+    """Write data/image_catalog.csv from the SQLite catalog for compatibility"""
     os.makedirs(os.path.dirname(CSV_FILE), exist_ok=True)
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, "w", encoding="utf-8", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["Source", "Title", "Image URL", "Description", "Saved Image Path"]) 
\ No newline at end of file
+    return get_catalog().export_csv(CSV_FILE)